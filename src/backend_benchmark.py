@@ -0,0 +1,44 @@
+import getopt
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+import pydash as _
+
+from data_fetchers import get_connection, load_page_id_order
+
+def _time_query(cursor, query):
+  start = time.perf_counter()
+  cursor.execute(query)
+  num_rows = len(cursor.fetchall())
+  return time.perf_counter() - start, num_rows
+
+def main():
+  load_dotenv(dotenv_path='.env')
+  args = dict(getopt.getopt(_.tail(sys.argv), '', ['backend=', 'num_pages=', 'chunk_size='])[0])
+  num_pages = int(args.get('--num_pages', 10000))
+  chunk_size = int(args.get('--chunk_size', 100))
+  page_ids = load_page_id_order(os.getenv("PAGE_ID_ORDER_PATH"))[:num_pages]
+  queries = {'pages': 'select id, content from pages where id in ({})',
+             'entity_mentions_text': 'select mention, page_id, entity_id, mention_id, offset from entity_mentions_text where page_id in ({})'}
+  db_connection = get_connection(args.get('--backend'))
+  try:
+    with db_connection.cursor() as cursor:
+      for name, query in queries.items():
+        total_time = 0
+        total_rows = 0
+        for start in range(0, len(page_ids), chunk_size):
+          elapsed, num_rows = _time_query(cursor, query.format(str(page_ids[start : start + chunk_size])[1:-1]))
+          total_time += elapsed
+          total_rows += num_rows
+        print('{}: {:.2f}s, {:.0f} pages/s, {:.0f} rows/s'.format(name,
+                                                              total_time,
+                                                              len(page_ids) / total_time,
+                                                              total_rows / total_time))
+  finally:
+    db_connection.close()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,111 @@
+import Levenshtein
+import numpy as np
+import torch
+
+from utils import LRUCache
+
+class CandidateTable(object):
+  def __init__(self, entity_candidates_prior):
+    self.mention_row_lookup = {}
+    offsets = [0]
+    ids = []
+    counts = []
+    for row, (mention, entity_counts) in enumerate(entity_candidates_prior.items()):
+      self.mention_row_lookup[mention] = row
+      ids.extend(entity_counts.keys())
+      counts.extend(entity_counts.values())
+      offsets.append(len(ids))
+    self.offsets = np.array(offsets, dtype=np.int64)
+    self.ids = np.array(ids, dtype=np.int64)
+    self.counts = np.array(counts, dtype=np.float32)
+
+  def _get_base_candidates(self, mentions, labels, cheat):
+    rows = np.array([self.mention_row_lookup.get(mention, -1) for mention in mentions], dtype=np.int64)
+    in_prior = rows != -1
+    starts = np.where(in_prior, self.offsets[rows], 0)
+    lens = np.where(in_prior, self.offsets[rows + 1] - starts, 0)
+    max_len = max(int(lens.max()), 1)
+    positions = np.arange(max_len)
+    valid = positions[None, :] < lens[:, None]
+    idxs = np.where(valid, starts[:, None] + positions[None, :], 0)
+    base_ids = np.where(valid, self.ids[idxs] if len(self.ids) > 0 else 0, -1)
+    base_counts = np.where(valid, self.counts[idxs] if len(self.counts) > 0 else 0, 0).astype(np.float32)
+    if cheat:
+      has_label = (base_ids == labels[:, None]).any(1)
+      base_ids = np.concatenate([base_ids, np.where(has_label, -1, labels)[:, None]], 1)
+      base_counts = np.concatenate([base_counts, np.zeros((len(labels), 1), dtype=np.float32)], 1)
+    return base_ids, base_counts, in_prior
+
+  def _fill_random_candidates(self, candidate_ids, num_entities):
+    to_fill = candidate_ids == -1
+    if (to_fill.sum(1) > 0).any() and num_entities < candidate_ids.shape[1]:
+      raise ValueError
+    num_candidates = candidate_ids.shape[1]
+    earlier = np.tril(np.ones((num_candidates, num_candidates), dtype=bool), -1)
+    need = to_fill.copy()
+    while need.any():
+      candidate_ids[need] = np.random.randint(0, num_entities, size=int(need.sum()))
+      same = candidate_ids[:, :, None] == candidate_ids[:, None, :]
+      clashes_with = earlier[None, :, :] | ~to_fill[:, None, :]
+      need = to_fill & (same & clashes_with & ~np.eye(num_candidates, dtype=bool)[None]).any(2)
+    return candidate_ids
+
+  def get_batch_candidate_ids_and_p_prior(self, mentions, labels, num_entities, num_candidates, cheat=False):
+    labels = np.array([int(label) for label in labels], dtype=np.int64)
+    base_ids, base_counts, in_prior = self._get_base_candidates(mentions, labels, cheat)
+    keys = np.random.random(base_ids.shape)
+    keys[base_ids == labels[:, None]] = -1
+    keys[base_ids == -1] = 2
+    if base_ids.shape[1] < num_candidates:
+      padding = ((0, 0), (0, num_candidates - base_ids.shape[1]))
+      base_ids = np.pad(base_ids, padding, constant_values=-1)
+      base_counts = np.pad(base_counts, padding, constant_values=0)
+      keys = np.pad(keys, padding, constant_values=2)
+    keep = np.argsort(keys, axis=1)[:, :num_candidates]
+    candidate_ids = self._fill_random_candidates(np.take_along_axis(base_ids, keep, 1), num_entities)
+    candidate_counts = np.take_along_axis(base_counts, keep, 1)
+    order = np.argsort(np.random.random(candidate_ids.shape), axis=1)
+    candidate_ids = np.take_along_axis(candidate_ids, order, 1)
+    candidate_counts = np.take_along_axis(candidate_counts, order, 1)
+    totals = candidate_counts.sum(1, keepdims=True)
+    p_prior = np.where(in_prior[:, None],
+                       candidate_counts / np.where(totals == 0, 1, totals),
+                       0)
+    return (torch.from_numpy(candidate_ids),
+            torch.from_numpy(p_prior.astype(np.float32)))
+
+  def get_batch_p_prior(self, mentions, candidate_ids):
+    '''Prior of the given candidates of each mention, normalized over the row.'''
+    counts = np.zeros(tuple(candidate_ids.shape), dtype=np.float32)
+    for row, (mention, row_candidate_ids) in enumerate(zip(mentions, candidate_ids.tolist())):
+      mention_row = self.mention_row_lookup.get(mention)
+      if mention_row is None: continue
+      start, end = self.offsets[mention_row], self.offsets[mention_row + 1]
+      entity_counts = dict(zip(self.ids[start:end].tolist(), self.counts[start:end].tolist()))
+      counts[row] = [entity_counts.get(candidate_id, 0) for candidate_id in row_candidate_ids]
+    totals = counts.sum(1, keepdims=True)
+    return torch.from_numpy(counts / np.where(totals == 0, 1, totals))
+
+  def get_candidate_ids_and_p_prior(self, mention, label, num_entities, num_candidates, cheat=False):
+    candidate_ids, p_prior = self.get_batch_candidate_ids_and_p_prior([mention],
+                                                                      [label],
+                                                                      num_entities,
+                                                                      num_candidates,
+                                                                      cheat=cheat)
+    return candidate_ids[0], p_prior[0]
+
+class CandidateMentionSim(object):
+  def __init__(self, entity_text_by_label, max_cache_size=1000000):
+    self.entity_text_by_label = entity_text_by_label
+    self._cache = LRUCache(max_cache_size)
+
+  def _sim(self, mention, candidate_id):
+    key = (mention, candidate_id)
+    sim = self._cache.get(key)
+    if sim is None:
+      sim = Levenshtein.ratio(mention, self.entity_text_by_label[candidate_id] or '')
+      self._cache.set(key, sim)
+    return sim
+
+  def __call__(self, mention, candidate_ids):
+    return torch.tensor([self._sim(mention, candidate_id) for candidate_id in candidate_ids.tolist()])
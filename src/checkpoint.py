@@ -0,0 +1,78 @@
+import os
+import random
+import threading
+
+import numpy as np
+import torch
+
+def get_rng_state():
+  return {'python': random.getstate(),
+          'numpy': np.random.get_state(),
+          'torch': torch.get_rng_state(),
+          'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None}
+
+def set_rng_state(state):
+  random.setstate(state['python'])
+  np.random.set_state(state['numpy'])
+  torch.set_rng_state(state['torch'])
+  if state['cuda'] is not None and torch.cuda.is_available():
+    torch.cuda.set_rng_state_all(state['cuda'])
+
+def _copy_to_cpu(state):
+  if torch.is_tensor(state):
+    return state.detach().to('cpu', copy=True)
+  elif isinstance(state, dict):
+    return {key: _copy_to_cpu(value) for key, value in state.items()}
+  elif isinstance(state, (list, tuple)):
+    return type(state)(_copy_to_cpu(value) for value in state)
+  else:
+    return state
+
+class Checkpointer(object):
+  '''Writes training state to `path` every `every_n_batches` batches. The
+  state is copied to the cpu on the training thread, then written to a
+  temporary file and moved over the previous checkpoint in the background so
+  a checkpoint on disk is never half written.'''
+  def __init__(self, path, every_n_batches):
+    self.path = path
+    self.every_n_batches = every_n_batches
+    self._thread = None
+    self._error = None
+
+  def should_save(self, batch_num):
+    return self.every_n_batches > 0 and (batch_num + 1) % self.every_n_batches == 0
+
+  def _write(self, state):
+    try:
+      tmp_path = self.path + '.tmp'
+      torch.save(state, tmp_path)
+      os.replace(tmp_path, self.path)
+    except Exception as e:
+      self._error = e
+
+  def save(self, state):
+    self.wait()
+    self._thread = threading.Thread(target=self._write, args=(_copy_to_cpu(state),), daemon=True)
+    self._thread.start()
+
+  def wait(self):
+    if self._thread is not None:
+      self._thread.join()
+      self._thread = None
+    if self._error is not None:
+      error, self._error = self._error, None
+      raise error
+
+def load_checkpoint(path, device=None):
+  if not os.path.exists(path): return None
+  return torch.load(path, map_location=device, weights_only=False)
+
+def load_model_state(model, state_dict):
+  '''Models saved before the word embedding was registered on the encoders
+  lack its weights, and ones saved since carry them. Any other mismatch is an
+  error.'''
+  result = model.load_state_dict(state_dict, strict=False)
+  mismatched = [key for key in result.missing_keys + result.unexpected_keys
+                if 'word_embedding' not in key.split('.')]
+  assert not mismatched, 'State dict does not match the model: {}'.format(mismatched)
+  return model
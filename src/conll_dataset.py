@@ -1,101 +1,150 @@
-import Levenshtein
+import hashlib
+import multiprocessing
+import os
 import re
+from bisect import bisect_left
 
+import Levenshtein
 import numpy as np
 import torch
 from torch.utils.data import Dataset
 
-import pydash as _
 
-from data_transformers import embed_page_content
-from data_fetchers import get_candidate_ids, get_p_prior, get_candidate_strs
-from parsers import parse_for_sentence_spans, parse_for_tokens
+from data_transformers import page_content_to_token_idxs
+from data_fetchers import fetch_by_ids, get_candidate_ids, get_p_prior, get_candidate_strs
+from parsers import parse_for_sentence_spans, parse_for_tokens, set_parse_cache
+
+_features_version = 2
 
 def _get_doc_lines(lines):
   divs = [i for i, line in enumerate(lines) if '-DOCSTART-' in line] + [len(lines)]
   return [lines[start + 1 : end] for start, end in zip(divs, divs[1:])]
 
+def _parse_lines(lines):
+  '''Reads the documents and their mentions from the TSV lines in one pass.'''
+  parsed = {'documents': [], 'mentions': [], 'entity_page_ids': [], 'mention_doc_id': [], 'mentions_by_doc_id': []}
+  for doc_id, doc in enumerate(_get_doc_lines(lines)):
+    tokens = []
+    doc_mentions = []
+    for line in doc:
+      fields = line.split('\t')
+      tokens.append(fields[0])
+      if len(fields) >= 5 and fields[1] == 'B':
+        doc_mentions.append(fields[2])
+        parsed['entity_page_ids'].append(int(fields[5]))
+        parsed['mention_doc_id'].append(doc_id)
+    parsed['documents'].append(' '.join(tokens))
+    parsed['mentions'].extend(doc_mentions)
+    parsed['mentions_by_doc_id'].append(doc_mentions)
+  return parsed
+
 def _get_documents(lines):
-  doc_lines = _get_doc_lines(lines)
-  return [' '.join([line.split('\t')[0]
-                    if len(line.split('\t')) != 0 else '\n' for line in doc])
-          for doc in doc_lines]
+  return _parse_lines(lines)['documents']
 
 def _get_mentions(lines):
-  doc_lines = _get_doc_lines(lines)
-  return [line.split('\t')[2]
-          for doc in doc_lines
-          for line in doc
-          if len(line.split('\t')) >= 5 and line.split('\t')[1] == 'B']
-
-def _get_mention_splits(doc, mention, seek, span):
-  mention_start_seek_offset = _.index_of(doc[seek:], mention)
-  mention_start_sentence_offset = seek - span[0] + mention_start_seek_offset
+  return _parse_lines(lines)['mentions']
+
+def _get_mention_splits(doc, mention, mention_start_idx, span):
+  mention_start_sentence_offset = mention_start_idx - span[0]
   to_idx = mention_start_sentence_offset + len(mention)
   sentence = doc[span[0]:span[1]]
   return ([parse_for_tokens(sentence[:mention_start_sentence_offset] + mention),
            parse_for_tokens(mention + sentence[to_idx:])],
           span[0] + to_idx)
 
-def _create_span(spans, mention_start_idx, mention_end_idx):
-  start_span_idx = _.find_index(spans,
-                                lambda span: span[0] <= mention_start_idx and span[1] >= mention_start_idx)
-  assert start_span_idx != -1
-  end_span_offset = _.find_index(spans[start_span_idx:],
-                                 lambda span: mention_end_idx <= span[1] and mention_end_idx >= span[0])
-  assert end_span_offset != -1
-  end_span_idx = start_span_idx + end_span_offset
+def _create_span(spans, span_ends, mention_start_idx, mention_end_idx):
+  start_span_idx = bisect_left(span_ends, mention_start_idx)
+  assert start_span_idx < len(spans) and spans[start_span_idx][0] <= mention_start_idx
+  end_span_idx = bisect_left(span_ends, mention_end_idx, lo=start_span_idx)
+  assert end_span_idx < len(spans) and spans[end_span_idx][0] <= mention_end_idx
   return spans[start_span_idx][0], spans[end_span_idx][1]
 
+def _get_doc_splits(doc, spans, mentions):
+  '''Splits for `mentions` located in order in `doc`, stopping at the first
+  mention that is not found.'''
+  splits = []
+  span_ends = [span[1] for span in spans]
+  seek = 0
+  for mention in mentions:
+    mention_start_idx = doc.find(mention, seek)
+    if mention_start_idx == -1:
+      mention_start_idx = doc.find(re.sub(' +', ' ', ' , '.join(' . '.join(mention.split('.')).split(','))).replace('D . C .', 'D.C.'), seek)
+      if mention_start_idx == -1: break
+    mention_end_idx = mention_start_idx + len(mention)
+    span = _create_span(spans, span_ends, mention_start_idx, mention_end_idx)
+    mention_splits, seek = _get_mention_splits(doc, mention, mention_start_idx, span)
+    splits.append(mention_splits)
+  return splits
+
 def _get_splits(documents, mentions):
   all_splits = []
-  doc_sentence_spans = [parse_for_sentence_spans(doc) for doc in documents]
-  mention_idx = 0
-  for doc, spans in zip(documents, doc_sentence_spans):
-    seek = 0
-    while mention_idx < len(mentions):
-      mention = mentions[mention_idx]
-      mention_start_offset = _.index_of(doc[seek:], mention)
-      if mention_start_offset == -1:
-        mention_start_offset = _.index_of(doc[seek:], re.sub(' +', ' ', ' , '.join(' . '.join(mention.split('.')).split(','))).replace('D . C .', 'D.C.'))
-        if mention_start_offset == -1: break
-      mention_start_idx = mention_start_offset + seek
-      mention_end_idx = mention_start_idx + len(mention)
-      span = _create_span(spans, mention_start_idx, mention_end_idx)
-      splits, seek = _get_mention_splits(doc, mention, seek, span)
-      all_splits.append(splits)
-      mention_idx += 1
+  for doc in documents:
+    all_splits.extend(_get_doc_splits(doc, parse_for_sentence_spans(doc), mentions[len(all_splits):]))
   return all_splits
 
 def _get_entity_page_ids(lines):
-  doc_lines = _get_doc_lines(lines)
-  return [int(line.split('\t')[5])
-          for doc in doc_lines
-          for line in doc
-          if len(line.split('\t')) >= 5 and line.split('\t')[1] == 'B']
+  return _parse_lines(lines)['entity_page_ids']
 
 def _from_page_ids_to_entity_ids(cursor, page_ids):
-  entity_ids = []
-  for page_id in page_ids:
-    cursor.execute('select entity_id from entity_by_page where source_id = %s', page_id)
-    result = cursor.fetchone()
-    if result:
-      entity_ids.append(result['entity_id'])
-    else:
-      entity_ids.append(-1)
-  return entity_ids
+  entity_id_by_page_id = {}
+  for row in fetch_by_ids(cursor,
+                          'select source_id, entity_id from entity_by_page where source_id in ({})',
+                          set(page_ids)):
+    entity_id_by_page_id.setdefault(row['source_id'], row['entity_id'])
+  return [entity_id_by_page_id.get(page_id, -1) for page_id in page_ids]
 
 def _get_doc_id_per_mention(lines):
-  doc_lines = _get_doc_lines(lines)
-  return [doc_id
-          for doc_id, doc in enumerate(doc_lines)
-          for line in doc if len(line.split('\t')) >= 5 and line.split('\t')[1] == 'B']
+  return _parse_lines(lines)['mention_doc_id']
 
 def _get_mentions_by_doc_id(lines):
-  doc_lines = _get_doc_lines(lines)
-  return [[line.split('\t')[2]
-           for line in doc if len(line.split('\t')) >= 5 and line.split('\t')[1] == 'B']
-          for doc in doc_lines]
+  return _parse_lines(lines)['mentions_by_doc_id']
+
+_worker_token_idx_lookup = None
+
+def _init_featurize_worker(token_idx_lookup):
+  global _worker_token_idx_lookup
+  _worker_token_idx_lookup = token_idx_lookup
+  set_parse_cache(None)
+
+def _featurize_document(doc_and_mentions):
+  doc, mentions = doc_and_mentions
+  splits = _get_doc_splits(doc, parse_for_sentence_spans(doc), mentions)
+  if len(splits) != len(mentions):
+    raise ValueError('Could not locate mention ' + repr(mentions[len(splits)]) + ' in document ' + repr(doc[:50]))
+  return (page_content_to_token_idxs(_worker_token_idx_lookup, doc),
+          page_content_to_token_idxs(_worker_token_idx_lookup, ' '.join(mentions)),
+          splits)
+
+def _featurize_documents(documents, mentions_by_doc_id, token_idx_lookup, num_workers=1):
+  '''Returns the content token idxs, mention list token idxs and mention
+  splits of every document, featurized in a pool of `num_workers`
+  processes.'''
+  docs_and_mentions = list(zip(documents, mentions_by_doc_id))
+  if num_workers > 1:
+    with multiprocessing.Pool(num_workers, initializer=_init_featurize_worker, initargs=(token_idx_lookup,)) as pool:
+      return pool.map(_featurize_document, docs_and_mentions, chunksize=4)
+  _init_featurize_worker(token_idx_lookup)
+  try:
+    return [_featurize_document(doc_and_mentions) for doc_and_mentions in docs_and_mentions]
+  finally:
+    _init_featurize_worker(None)
+
+def _get_cache_key(tsv_contents, token_idx_lookup):
+  key = hashlib.sha1(tsv_contents.encode('utf-8'))
+  for token, idx in sorted(token_idx_lookup.items(), key=lambda pair: pair[1]):
+    key.update(token.encode('utf-8') + b'\0')
+  return key.hexdigest()
+
+def _load_features(cache_path, key):
+  if cache_path is None or not os.path.exists(cache_path): return None
+  features = torch.load(cache_path, weights_only=False)
+  if features.get('version') != _features_version or features.get('key') != key: return None
+  return features
+
+def _save_features(cache_path, features):
+  tmp_path = cache_path + '.tmp'
+  torch.save(features, tmp_path)
+  os.replace(tmp_path, cache_path)
 
 class CoNLLDataset(Dataset):
   def __init__(self,
@@ -106,48 +155,100 @@ class CoNLLDataset(Dataset):
                num_entities,
                num_candidates,
                entity_label_lookup,
-               path='./AIDA-YAGO2-dataset.tsv'):
+               path='./AIDA-YAGO2-dataset.tsv',
+               candidate_mention_sim=None,
+               cache_path=None,
+               num_workers=1):
     self.cursor = cursor
     self.entity_candidates_prior = entity_candidates_prior
     self.embedding = embedding
     self.token_idx_lookup = token_idx_lookup
     self.num_entities = num_entities
     self.num_candidates = num_candidates
+    self.candidate_mention_sim = candidate_mention_sim
     with open(path, 'r') as fh:
-      self.lines = fh.read().strip().split('\n')[:-1]
-    self.documents = _get_documents(self.lines)
-    self.embedded_documents = [embed_page_content(self.embedding, self.token_idx_lookup, document)
-                               for document in self.documents]
-    self.mentions = _get_mentions(self.lines)
-    self.sentence_splits = _get_splits(self.documents, self.mentions)
-    self.entity_page_ids = _get_entity_page_ids(self.lines)
-    self.labels = _from_page_ids_to_entity_ids(cursor, self.entity_page_ids)
+      contents = fh.read()
+    key = _get_cache_key(contents, token_idx_lookup)
+    features = _load_features(cache_path, key)
+    if features is None:
+      features = self._featurize(contents, num_workers)
+      features['version'] = _features_version
+      features['key'] = key
+      if cache_path is not None: _save_features(cache_path, features)
+    self.documents = features['documents']
+    self.document_token_idxs = features['document_token_idxs']
+    self.mentions = features['mentions']
+    self.sentence_splits = features['sentence_splits']
+    self.entity_page_ids = features['entity_page_ids']
+    self.labels = features['labels']
+    self.mention_doc_id = features['mention_doc_id']
+    self.mentions_by_doc_id = features['mentions_by_doc_id']
+    self.doc_entity_page_mentions = features['doc_entity_page_mentions']
     self.with_label = [i for i, x in enumerate(self.labels) if x != -1]
-    self.mention_doc_id = _get_doc_id_per_mention(self.lines)
-    self.mentions_by_doc_id = _get_mentions_by_doc_id(self.lines)
+    self.with_label_by_doc_id = [[] for __ in self.documents]
+    for idx in self.with_label:
+      self.with_label_by_doc_id[self.mention_doc_id[idx]].append(idx)
+    self._pending_samples = {}
     self.entity_label_lookup = entity_label_lookup
     self.entity_id_lookup = {int(label): entity_id for entity_id, label in self.entity_label_lookup.items()}
 
+  def _featurize(self, contents, num_workers):
+    features = _parse_lines(contents.strip().split('\n')[:-1])
+    doc_features = _featurize_documents(features['documents'],
+                                        features['mentions_by_doc_id'],
+                                        self.token_idx_lookup,
+                                        num_workers=num_workers)
+    features['document_token_idxs'] = [torch.tensor(token_idxs, dtype=torch.int32) for token_idxs, __, __ in doc_features]
+    features['doc_entity_page_mentions'] = [torch.tensor(token_idxs, dtype=torch.int32) for __, token_idxs, __ in doc_features]
+    features['sentence_splits'] = [splits for __, __, doc_splits in doc_features for splits in doc_splits]
+    features['labels'] = _from_page_ids_to_entity_ids(self.cursor, features['entity_page_ids'])
+    return features
+
   def __len__(self):
     return len(self.with_label)
 
   def __getitem__(self, idx):
     idx = self.with_label[idx]
-    label = self.entity_label_lookup.get(self.labels[idx]) or -1
-    mention = self.mentions[idx]
-    candidate_ids = get_candidate_ids(self.entity_candidates_prior,
-                                      self.num_entities,
-                                      self.num_candidates,
-                                      mention,
-                                      label)
-    candidates = get_candidate_strs(self.cursor, [self.entity_id_lookup[cand_id] for cand_id in candidate_ids.tolist()])
-    return {'sentence_splits': self.sentence_splits[idx],
-            'label': label,
-            'embedded_page_content': self.embedded_documents[self.mention_doc_id[idx]],
-            'entity_page_mentions': embed_page_content(self.embedding,
-                                                       self.token_idx_lookup,
-                                                       ' '.join(self.mentions_by_doc_id[self.mention_doc_id[idx]])),
-            'p_prior': get_p_prior(self.entity_candidates_prior, mention, candidate_ids),
-            'candidate_ids': candidate_ids,
-            'candidate_mention_sim': torch.tensor([Levenshtein.ratio(mention, candidate)
-                                                   for candidate in candidates])}
+    if idx not in self._pending_samples:
+      self._pending_samples.update(self._get_doc_samples(self.mention_doc_id[idx]))
+    return self._pending_samples.pop(idx)
+
+  def _get_doc_samples(self, doc_id):
+    '''Builds the samples of every labelled mention of a document at once.
+    The page content and mention list tensors are shared by reference and the
+    candidate strings of the document are fetched in one query. Each sample is
+    handed out once, so the next pass draws fresh random candidates.'''
+    idxs = self.with_label_by_doc_id[doc_id]
+    labels = [self.entity_label_lookup.get(self.labels[idx]) or -1 for idx in idxs]
+    mentions = [self.mentions[idx] for idx in idxs]
+    candidate_ids = [get_candidate_ids(self.entity_candidates_prior,
+                                       self.num_entities,
+                                       self.num_candidates,
+                                       mention,
+                                       label)
+                     for mention, label in zip(mentions, labels)]
+    candidate_mention_sims = self._get_candidate_mention_sims(mentions, candidate_ids)
+    return {idx: {'mention': mention,
+                  'sentence_splits': self.sentence_splits[idx],
+                  'label': label,
+                  'page_content': self.document_token_idxs[doc_id],
+                  'entity_page_mentions': self.doc_entity_page_mentions[doc_id],
+                  'p_prior': get_p_prior(self.entity_candidates_prior, mention, mention_candidate_ids),
+                  'candidate_ids': mention_candidate_ids,
+                  'candidate_mention_sim': candidate_mention_sim}
+            for idx, label, mention, mention_candidate_ids, candidate_mention_sim
+            in zip(idxs, labels, mentions, candidate_ids, candidate_mention_sims)}
+
+  def _get_candidate_mention_sims(self, mentions, candidate_ids):
+    if self.candidate_mention_sim is not None:
+      return [self.candidate_mention_sim(mention, mention_candidate_ids)
+              for mention, mention_candidate_ids in zip(mentions, candidate_ids)]
+    entity_ids = list({self.entity_id_lookup[cand_id]
+                       for mention_candidate_ids in candidate_ids
+                       for cand_id in mention_candidate_ids.tolist()})
+    text_by_entity_id = dict(zip(entity_ids, get_candidate_strs(self.cursor, entity_ids)))
+    sims = []
+    for mention, mention_candidate_ids in zip(mentions, candidate_ids):
+      sims.append(torch.tensor([Levenshtein.ratio(mention, text_by_entity_id[self.entity_id_lookup[cand_id]])
+                                for cand_id in mention_candidate_ids.tolist()]))
+    return sims
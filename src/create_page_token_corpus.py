@@ -0,0 +1,44 @@
+import getopt
+import os
+import sys
+
+from dotenv import load_dotenv
+import pydash as _
+
+from data_fetchers import get_connection, get_embedding_store, load_page_id_order
+from default_params import default_model_params, default_train_params
+from page_token_corpus import write_page_token_corpus
+from parse_cache import ParseCache
+from parsers import set_parse_cache
+
+def main():
+  load_dotenv(dotenv_path='.env')
+  args = dict(getopt.getopt(_.tail(sys.argv), '', ['path=', 'word_embed_len=', 'num_workers=', 'parse_cache=', 'min_mentions='])[0])
+  word_embed_len = int(args.get('--word_embed_len', default_model_params.word_embed_len))
+  path = args.get('--path', os.getenv("PAGE_TOKEN_CORPUS_PATH"))
+  num_workers = int(args.get('--num_workers', 1))
+  min_mentions = int(args.get('--min_mentions', default_train_params.min_mentions))
+  parse_cache = ParseCache(path=args.get('--parse_cache', os.getenv("PARSE_CACHE_PATH")))
+  set_parse_cache(parse_cache)
+  token_idx_lookup, __ = get_embedding_store(f'./glove.6B.{word_embed_len}d.txt',
+                                             embedding_dim=word_embed_len)
+  page_id_order = load_page_id_order(os.getenv("PAGE_ID_ORDER_PATH"))
+  db_connection = get_connection()
+  try:
+    with db_connection.cursor() as cursor:
+      write_page_token_corpus(cursor, page_id_order, token_idx_lookup, path, num_workers=num_workers, min_mentions=min_mentions)
+  finally:
+    db_connection.close()
+    parse_cache.close()
+
+
+if __name__ == "__main__":
+  import ipdb
+  import traceback
+
+  try:
+    main()
+  except: # pylint: disable=bare-except
+    extype, value, tb = sys.exc_info()
+    traceback.print_exc()
+    ipdb.post_mortem(tb)
@@ -1,6 +1,9 @@
 import os
 import random
 import pickle
+import threading
+import time
+from collections import defaultdict
 
 from dotenv import load_dotenv
 import numpy as np
@@ -10,10 +13,15 @@ import torch
 import torch.nn as nn
 from progressbar import progressbar
 
+from profiling import stage_timer
+from sqlite_backend import SQLiteConnection
 import utils as u
 
-def get_connection():
+def get_connection(backend=None):
   load_dotenv(dotenv_path='.env')
+  backend = backend if backend is not None else os.getenv("DBBACKEND", 'mysql')
+  if backend.lower() == 'sqlite':
+    return SQLiteConnection(os.getenv("DBPATH"))
   DATABASE_NAME = os.getenv("DBNAME")
   DATABASE_USER = os.getenv("DBUSER")
   DATABASE_PASSWORD = os.getenv("DBPASS")
@@ -27,6 +35,50 @@ def get_connection():
                                cursorclass=pymysql.cursors.DictCursor)
   return connection
 
+class QueryTimer(object):
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    with self._lock:
+      self._stats = defaultdict(lambda: {'num_queries': 0, 'num_rows': 0, 'time': 0.0})
+
+  def record(self, name, elapsed, num_queries=0, num_rows=0):
+    with self._lock:
+      stats = self._stats[name]
+      stats['num_queries'] += num_queries
+      stats['num_rows'] += num_rows
+      stats['time'] += elapsed
+
+  def report(self):
+    with self._lock:
+      return {name: dict(stats) for name, stats in self._stats.items()}
+
+query_timer = QueryTimer()
+
+def _record_fetch(name):
+  def record(elapsed, num_rows):
+    query_timer.record(name, elapsed, num_rows=num_rows)
+    stage_timer.record('db_fetch', elapsed)
+    stage_timer.count('db_rows', num_rows)
+  return record
+
+def fetch_by_ids(cursor, query, ids, args=[], chunk_size=1000, name=None, buff_len=1000):
+  '''Streams the rows of `query` for `ids`, where `query` has a `{}` in place of the
+  `in (...)` list. The ids are sent as parameters, `chunk_size` at a time, so
+  they are escaped by the driver instead of being formatted into the query.'''
+  name = name if name is not None else query
+  ids = list(ids)
+  for start in range(0, len(ids), chunk_size):
+    chunk = ids[start : start + chunk_size]
+    start_time = time.perf_counter()
+    cursor.execute(query.format(', '.join(['%s'] * len(chunk))), list(args) + chunk)
+    elapsed = time.perf_counter() - start_time
+    query_timer.record(name, elapsed, num_queries=1)
+    stage_timer.record('db_execute', elapsed)
+    yield from u.build_cursor_generator(cursor, buff_len=buff_len, on_fetch=_record_fetch(name))
+
 def get_cursor(db_connection):
   cursor = db_connection.cursor()
   cursor.execute("SET NAMES utf8mb4;")
@@ -74,6 +126,47 @@ def get_embedding_dict(path, embedding_dim=100):
                                            dtype=torch.float32)
   return lookup
 
+_special_tokens = ['<PAD>', '<UNK>', '<MENTION_START_HERE>', '<MENTION_END_HERE>']
+
+def _get_embedding_store_paths(path):
+  prefix = os.path.splitext(path)[0]
+  return prefix + '.npy', prefix + '.vocab.pkl'
+
+def create_embedding_store(path, embedding_dim=100):
+  matrix_path, vocab_path = _get_embedding_store_paths(path)
+  with open(path) as f:
+    num_lines = sum(1 for line in f)
+  tmp_matrix_path = matrix_path + '.tmp'
+  matrix = np.lib.format.open_memmap(tmp_matrix_path,
+                                     mode='w+',
+                                     dtype=np.float32,
+                                     shape=(len(_special_tokens) + num_lines, embedding_dim))
+  matrix[0] = 0
+  matrix[1:len(_special_tokens)] = np.random.randn(len(_special_tokens) - 1, embedding_dim)
+  tokens = list(_special_tokens)
+  with open(path) as f:
+    for row, line in enumerate(progressbar(f), len(_special_tokens)):
+      split_line = line.rstrip().split(' ')
+      tokens.append(split_line[0])
+      matrix[row] = np.array(split_line[1:], dtype=np.float32)
+  matrix.flush()
+  del matrix
+  with open(vocab_path, 'wb') as f:
+    pickle.dump(tokens, f)
+  os.replace(tmp_matrix_path, matrix_path)
+
+def get_embedding_store(path, embedding_dim=100):
+  matrix_path, vocab_path = _get_embedding_store_paths(path)
+  if not (os.path.exists(matrix_path) and os.path.exists(vocab_path)):
+    create_embedding_store(path, embedding_dim=embedding_dim)
+  matrix = np.load(matrix_path, mmap_mode='c')
+  assert matrix.shape[1] == embedding_dim, 'The embedding store at ' + matrix_path + ' has dimension ' + \
+    str(matrix.shape[1]) + '. Delete it to rebuild it from ' + path + ' with dimension ' + str(embedding_dim)
+  with open(vocab_path, 'rb') as f:
+    tokens = pickle.load(f)
+  token_idx_lookup = dict(zip(tokens, range(len(tokens))))
+  return token_idx_lookup, torch.from_numpy(matrix)
+
 def get_random_indexes(max_value, exclude, num_to_generate):
   if max_value < num_to_generate:
     raise ValueError
@@ -141,6 +234,21 @@ def load_page_id_order(path):
   with open(path, 'rb') as f:
     return pickle.load(f)
 
+def get_page_mention_counts(cursor, page_ids, min_mentions=1, chunk_size=10000):
+  if min_mentions > 1:
+    rows = fetch_by_ids(cursor,
+                        'select m.page_id, count(*) from mentions m inner join entity_mentions em on m.id = em.mention_id inner join entities e on e.id = em.entity_id where e.num_mentions > %s and m.page_id in ({}) group by m.page_id',
+                        page_ids,
+                        args=[min_mentions],
+                        chunk_size=chunk_size)
+  else:
+    rows = fetch_by_ids(cursor,
+                        'select page_id, count(*) from mentions where page_id in ({}) group by page_id',
+                        page_ids,
+                        chunk_size=chunk_size)
+  counts = {row['page_id']: row['count(*)'] for row in rows}
+  return np.array([counts.get(page_id, 0) for page_id in page_ids], dtype=np.int64)
+
 def get_num_entities():
   try:
     db_connection = get_connection()
@@ -167,5 +275,6 @@ def get_p_prior(entity_candidates_prior, mention, candidate_ids):
   return torch.tensor(candidate_counts, dtype=torch.float) / sum(candidate_counts)
 
 def get_candidate_strs(cursor, candidate_ids):
-  cursor.execute('select text from entities where id in (' + str(candidate_ids)[1:-1] + ')')
-  return [row['text'] for row in cursor.fetchall()]
+  text_by_id = {row['id']: row['text']
+                for row in fetch_by_ids(cursor, 'select id, text from entities where id in ({})', candidate_ids)}
+  return [text_by_id.get(candidate_id, '') for candidate_id in candidate_ids]
@@ -1,5 +1,6 @@
 from functools import reduce
 
+import numpy as np
 import pydash as _
 import torch
 import torch.nn as nn
@@ -10,33 +11,40 @@ from parsers import parse_text_for_tokens, parse_for_tokens
 import nltk
 
 
-def pad_batch(pad_vector, batch, min_len=0):
-  pad_to_len = max(min_len, max(_.map_(batch, len)))
-  to_stack = []
-  for elem in batch:
-    dim_len = len(elem)
-    if pad_to_len != dim_len:
-      pad = torch.stack([pad_vector] * (pad_to_len - dim_len))
-      to_stack.append(torch.cat((elem, pad), 0))
-    else:
-      to_stack.append(elem)
-  return torch.stack(to_stack)
+def _get_padded_lengths(batch, min_len, max_len):
+  lengths = [len(elem) for elem in batch]
+  if max_len is not None: lengths = [min(length, max_len) for length in lengths]
+  pad_to_len = max([min_len] + lengths)
+  if max_len is not None: pad_to_len = min(pad_to_len, max_len)
+  return lengths, pad_to_len
+
+def pad_batch(pad_vector, batch, min_len=0, max_len=None, return_lengths=False):
+  lengths, pad_to_len = _get_padded_lengths(batch, min_len, max_len)
+  dtype = next((elem.dtype for elem in batch if len(elem) > 0), pad_vector.dtype)
+  padded = pad_vector.to(dtype).expand((len(batch), pad_to_len) + tuple(pad_vector.shape)).clone()
+  for row, (elem, length) in enumerate(zip(batch, lengths)):
+    if length > 0: padded[row, :length] = elem[:length]
+  if return_lengths: return padded, torch.tensor(lengths, dtype=torch.long)
+  return padded
 
 def pad_batch_list(pad_elem, batch, min_len=0):
   assert isinstance(batch, list)
   assert isinstance(pad_elem, (int, str))
   pad_to_len = max(min_len, max(_.map_(batch, len)))
-  to_stack = []
-  for elem in batch:
-    dim_len = len(elem)
-    if pad_to_len != dim_len:
-      pad = [pad_elem for i in range(pad_to_len - dim_len)]
-      to_stack.append(elem + pad)
-    else:
-      to_stack.append(elem)
-  return to_stack
-
-def tokens_to_embeddings(embedding, token_idx_lookup, tokens):
+  return [elem + [pad_elem] * (pad_to_len - len(elem)) for elem in batch]
+
+def pad_batch_list_to_tensor(pad_elem, batch, min_len=0, max_len=None, return_lengths=False, dtype=torch.long):
+  lengths, pad_to_len = _get_padded_lengths(batch, min_len, max_len)
+  lengths = np.array(lengths, dtype=np.int64)
+  padded = np.full((len(batch), pad_to_len), pad_elem, dtype=np.int64)
+  values = [elem[:length] for elem, length in zip(batch, lengths)]
+  if lengths.sum() > 0:
+    padded[np.arange(pad_to_len)[None, :] < lengths[:, None]] = np.concatenate(values)
+  padded = torch.from_numpy(padded).to(dtype)
+  if return_lengths: return padded, torch.from_numpy(lengths)
+  return padded
+
+def tokens_to_idxs(token_idx_lookup, tokens):
   text_idxs = []
   for token in tokens:
     if token in token_idx_lookup:
@@ -49,7 +57,12 @@ def tokens_to_embeddings(embedding, token_idx_lookup, tokens):
       text_idxs.append(token_idx_lookup['<MENTION_END_HERE>'])
     else:
       text_idxs.append(token_idx_lookup['<UNK>'])
-  return embedding(torch.tensor(text_idxs,
+  return text_idxs
+
+def tokens_to_embeddings(embedding, token_idx_lookup, tokens):
+  if isinstance(tokens, torch.Tensor):
+    return embedding(tokens.to(dtype=torch.long, device=embedding.weight.device))
+  return embedding(torch.tensor(tokens_to_idxs(token_idx_lookup, tokens),
                                 dtype=torch.long,
                                 device=embedding.weight.device))
 
@@ -91,24 +104,29 @@ def get_mention_sentence_splits(page_content, sentence_spans, mention_info):
 def get_splits_and_order(packed):
   return packed['embeddings'], packed['order']
 
+def _to_idx_list(token_idx_lookup, tokens):
+  if isinstance(tokens, torch.Tensor):
+    return tokens.tolist()
+  return tokens_to_idxs(token_idx_lookup, tokens)
+
 def embed_and_pack_batch(embedding, token_idx_lookup, sentence_splits_batch):
-  left_order = sort_index(sentence_splits_batch, key=lambda split: len(split[0]), reverse=True)
-  right_order = sort_index(sentence_splits_batch, key=lambda split: len(split[1]), reverse=True)
-  left_batch = []
-  right_batch = []
-  for left_index, right_index in zip(left_order, right_order):
-    split_left = sentence_splits_batch[left_index]
-    split_right = sentence_splits_batch[right_index]
-    left_batch.append(tokens_to_embeddings(embedding,
-                                            token_idx_lookup,
-                                            split_left[0]))
-    right_batch.append(tokens_to_embeddings(embedding,
-                                             token_idx_lookup,
-                                             split_right[1]))
-  left_unsort_order = sort_index(left_order)
-  right_unsort_order = sort_index(right_order)
-  return ({'embeddings': nn.utils.rnn.pack_sequence(left_batch), 'order': left_unsort_order},
-          {'embeddings': nn.utils.rnn.pack_sequence(right_batch), 'order': right_unsort_order})
+  left_idxs = [_to_idx_list(token_idx_lookup, split[0]) for split in sentence_splits_batch]
+  right_idxs = [_to_idx_list(token_idx_lookup, split[1]) for split in sentence_splits_batch]
+  left_order = sort_index(left_idxs, key=len, reverse=True)
+  right_order = sort_index(right_idxs, key=len, reverse=True)
+  sorted_idxs = [left_idxs[i] for i in left_order] + [right_idxs[i] for i in right_order]
+  lengths = _.map_(sorted_idxs, len)
+  embedded = embedding(pad_batch_list_to_tensor(0, sorted_idxs).to(embedding.weight.device))
+  batch_size = len(sentence_splits_batch)
+  left_lengths, right_lengths = lengths[:batch_size], lengths[batch_size:]
+  left_packed = nn.utils.rnn.pack_padded_sequence(embedded[:batch_size, :left_lengths[0]],
+                                                  left_lengths,
+                                                  batch_first=True)
+  right_packed = nn.utils.rnn.pack_padded_sequence(embedded[batch_size:, :right_lengths[0]],
+                                                   right_lengths,
+                                                   batch_first=True)
+  return ({'embeddings': left_packed, 'order': sort_index(left_order)},
+          {'embeddings': right_packed, 'order': sort_index(right_order)})
 
 def _insert_mention_flags(page_content, mention_info):
   mention_text = mention_info['mention']
@@ -116,12 +134,22 @@ def _insert_mention_flags(page_content, mention_info):
   end = mention_info['offset'] + len(mention_text)
   return page_content[:start] + 'MENTION_START_HERE ' + mention_text +  ' MENTION_END_HERE' + page_content[end:]
 
-def embed_page_content(embedding, token_idx_lookup, page_content, page_mention_infos=[]):
+def page_content_to_token_idxs(token_idx_lookup, page_content, page_mention_infos=[]):
   page_content_with_mention_flags = reduce(_insert_mention_flags,
                                            page_mention_infos,
                                            page_content)
   tokens = parse_text_for_tokens(page_content_with_mention_flags)
-  return tokens_to_embeddings(embedding, token_idx_lookup, tokens)
+  return tokens_to_idxs(token_idx_lookup, tokens)
+
+def page_content_to_token_idx_tensor(token_idx_lookup, page_content, page_mention_infos=[]):
+  return torch.tensor(page_content_to_token_idxs(token_idx_lookup, page_content, page_mention_infos),
+                      dtype=torch.int32)
+
+def embed_page_content(embedding, token_idx_lookup, page_content, page_mention_infos=[]):
+  text_idxs = page_content_to_token_idxs(token_idx_lookup, page_content, page_mention_infos)
+  return embedding(torch.tensor(text_idxs,
+                                dtype=torch.long,
+                                device=embedding.weight.device))
 
 def get_bag_of_nouns(page_content):
   return [word.lower()
@@ -1,7 +1,10 @@
 from pyrsistent import m
 
 default_paths = m(lookups='../entity-linking-preprocessing/lookups.pkl',
-                  page_id_order='../entity-linking-preprocessing/page_id_order.pkl')
+                  page_id_order='../entity-linking-preprocessing/page_id_order.pkl',
+                  page_token_corpus=None,
+                  parse_cache=None,
+                  conll_cache=None)
 default_train_params = m(batch_size=100,
                          dataset_limit=None,
                          debug=False,
@@ -10,6 +13,12 @@ default_train_params = m(batch_size=100,
                          train_size=0.8,
                          dropout_drop_prob=0.4,
                          start_from_page_num=0,
+                         num_workers=0,
+                         prefetch_depth=0,
+                         bucket_window=0,
+                         checkpoint_every=0,
+                         eval_every=0,
+                         precision='float32',
                          clip_grad=0.01)
 default_model_params = m(num_cnn_local_filters=50,
                          embed_len=100,
@@ -21,6 +30,13 @@ default_model_params = m(num_cnn_local_filters=50,
                          num_lstm_layers=2,
                          ablation=['prior', 'local_context', 'document_context'])
 default_run_params = m(load_model=False,
+                       resume=False,
+                       profile_stages=False,
+                       profile_batches=None,
+                       profiler='torch',
                        cheat=False,
                        comments='',
-                       buffer_scale=1)
+                       buffer_scale=1,
+                       use_entity_index=False,
+                       num_retrieved=10,
+                       entity_index_num_probe=8)
@@ -7,9 +7,10 @@ from data_transformers import pad_batch
 
 
 class DescriptionEncoder(nn.Module):
-  def __init__(self, word_embed_len, entity_embeds, pad_vector):
+  def __init__(self, word_embed_len, entity_embeds, word_embedding, pad_token_idx):
     super(DescriptionEncoder, self).__init__()
-    self.pad_vector = pad_vector
+    self.word_embedding = word_embedding
+    self.pad_token_idx = pad_token_idx
     self.kernel_size = 5
     self.dropout_drop_prob = 0.4
     desc_embed_len = entity_embeds.weight.shape[1]
@@ -18,10 +19,12 @@ class DescriptionEncoder(nn.Module):
     self.dropout = nn.Dropout(p=self.dropout_drop_prob)
     self.global_avg_pooling = nn.AdaptiveAvgPool1d(1)
 
-  def forward(self, embedded_page_contents):
-    desc_embeds = pad_batch(self.pad_vector,
-                            [embeds[:100] for embeds in embedded_page_contents],
-                            min_len=100)
+  def forward(self, page_contents):
+    desc_token_idxs = pad_batch(torch.tensor(self.pad_token_idx, dtype=torch.int32),
+                                page_contents,
+                                min_len=100,
+                                max_len=100)
+    desc_embeds = self.word_embedding(desc_token_idxs.long().to(self.word_embedding.weight.device))
     encoded = pipe(desc_embeds,
                    lambda embed: torch.transpose(embed, 1, 2),
                    self.conv,
@@ -29,5 +32,5 @@ class DescriptionEncoder(nn.Module):
                    self.dropout,
                    self.global_avg_pooling,
                    lambda embed: torch.transpose(embed, 1, 2),
-                   torch.squeeze)
+                   lambda embed: embed.squeeze(1)).float()
     return encoded / torch.norm(encoded, 2, 1).unsqueeze(1)
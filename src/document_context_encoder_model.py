@@ -1,6 +1,7 @@
 import pydash as _
 import torch
 import torch.nn as nn
+from torch.nn.utils.rnn import pack_padded_sequence
 
 from data_transformers import pad_batch
 
@@ -10,13 +11,15 @@ class DocumentContextEncoder(nn.Module):
                lstm_size,
                word_embed_len,
                context_embed_len,
-               pad_vector,
+               word_embedding,
+               pad_token_idx,
                use_deep_network=True):
     super(DocumentContextEncoder, self).__init__()
     self.lstm_size = lstm_size
     self.word_embed_len = word_embed_len
     self.context_embed_len = context_embed_len
-    self.pad_vector = pad_vector
+    self.word_embedding = word_embedding
+    self.pad_token_idx = pad_token_idx
     self.lstm = nn.LSTM(input_size=self.word_embed_len,
                         hidden_size=self.lstm_size,
                         batch_first=True)
@@ -28,12 +31,22 @@ class DocumentContextEncoder(nn.Module):
     self.relu = nn.ReLU()
 
   def forward(self, entity_page_mentions):
+    device = self.word_embedding.weight.device
     if self.use_deep_network:
-      batch = pad_batch(self.pad_vector, entity_page_mentions)
+      token_idxs, lengths = pad_batch(torch.tensor(self.pad_token_idx, dtype=torch.int32),
+                                      entity_page_mentions,
+                                      min_len=1,
+                                      return_lengths=True)
+      packed_idxs = pack_padded_sequence(token_idxs.to(device),
+                                         torch.clamp(lengths, min=1),
+                                         batch_first=True,
+                                         enforce_sorted=False)
+      batch = packed_idxs._replace(data=self.word_embedding(packed_idxs.data.long()))
       output, state_info = self.lstm(batch)
       last_hidden_state = state_info[0][-2:]
       hidden = torch.cat([layer_state for layer_state in last_hidden_state], 1)
     else:
-      hidden = torch.stack([torch.sum(context, 0) / len(context) for context in entity_page_mentions])
+      hidden = torch.stack([torch.sum(self.word_embedding(token_idxs.long().to(device)), 0) / len(token_idxs)
+                            for token_idxs in entity_page_mentions])
     encoded = self.relu(self.projection(hidden))
     return encoded
@@ -0,0 +1,87 @@
+import hashlib
+import math
+
+import torch
+
+def get_weights_digest(weights):
+  return hashlib.sha1(weights.numpy().tobytes()).hexdigest()
+
+class EntityIndex(object):
+  def __init__(self, centroids, entity_ids, cluster_offsets, sorted_weights, num_probe=8, weights_digest=None):
+    self.centroids = centroids
+    self.entity_ids = entity_ids
+    self.cluster_offsets = cluster_offsets
+    self.sorted_weights = sorted_weights
+    self.num_probe = num_probe
+    self.weights_digest = weights_digest
+
+  def _get_probe_idxs(self, cluster_order, k):
+    ranges = []
+    num_found = 0
+    for probe_num, cluster in enumerate(cluster_order.tolist()):
+      if probe_num >= self.num_probe and num_found >= k: break
+      start, end = int(self.cluster_offsets[cluster]), int(self.cluster_offsets[cluster + 1])
+      ranges.append(torch.arange(start, end))
+      num_found += end - start
+    return torch.cat(ranges)
+
+  def search(self, queries, k):
+    '''Ids of the `k` best scoring entities per query. Rows are padded with
+    their last id when the index holds fewer than `k` entities.'''
+    queries = queries.detach().to(self.centroids.device, dtype=self.centroids.dtype)
+    cluster_orders = torch.argsort(torch.mm(queries, self.centroids.t()), dim=1, descending=True)
+    results = []
+    for query, cluster_order in zip(queries, cluster_orders):
+      idxs = self._get_probe_idxs(cluster_order, k)
+      scores = torch.mv(self.sorted_weights[idxs], query)
+      top = torch.topk(scores, min(k, len(idxs)))[1]
+      ids = self.entity_ids[idxs[top]]
+      if len(ids) < k: ids = torch.cat([ids, ids[-1:].expand(k - len(ids))])
+      results.append(ids)
+    return torch.stack(results)
+
+  def save(self, path):
+    torch.save({'centroids': self.centroids,
+                'entity_ids': self.entity_ids,
+                'cluster_offsets': self.cluster_offsets,
+                'num_probe': self.num_probe,
+                'weights_digest': self.weights_digest},
+               path)
+
+def _assign_clusters(weights, centroids, chunk_size=100000):
+  return torch.cat([torch.argmax(torch.mm(chunk, centroids.t()), 1)
+                    for chunk in torch.split(weights, chunk_size)])
+
+def build_entity_index(entity_embeds_weight, num_clusters=None, num_iterations=10, num_probe=8):
+  weights = entity_embeds_weight.detach().cpu().float()
+  num_entities = weights.shape[0]
+  if num_clusters is None: num_clusters = max(1, int(math.sqrt(num_entities)))
+  centroids = weights[torch.randperm(num_entities)[:num_clusters]].clone()
+  for iteration in range(num_iterations):
+    assignments = _assign_clusters(weights, centroids)
+    sums = torch.zeros_like(centroids).index_add_(0, assignments, weights)
+    counts = torch.bincount(assignments, minlength=num_clusters)
+    nonempty = counts > 0
+    centroids[nonempty] = sums[nonempty] / counts[nonempty].unsqueeze(1).float()
+  assignments = _assign_clusters(weights, centroids)
+  entity_ids = torch.argsort(assignments)
+  cluster_offsets = torch.cat([torch.zeros(1, dtype=torch.long),
+                               torch.cumsum(torch.bincount(assignments, minlength=num_clusters), 0)])
+  return EntityIndex(centroids,
+                     entity_ids,
+                     cluster_offsets,
+                     weights[entity_ids],
+                     num_probe=num_probe,
+                     weights_digest=get_weights_digest(weights))
+
+def load_entity_index(path, entity_embeds_weight):
+  '''None when the index was built from other entity embeddings.'''
+  data = torch.load(path)
+  weights = entity_embeds_weight.detach().cpu().float()
+  if data.get('weights_digest') != get_weights_digest(weights): return None
+  return EntityIndex(data['centroids'],
+                     data['entity_ids'],
+                     data['cluster_offsets'],
+                     weights[data['entity_ids']],
+                     num_probe=data['num_probe'],
+                     weights_digest=data['weights_digest'])
@@ -0,0 +1,54 @@
+import getopt
+import sys
+import time
+
+import numpy as np
+import pydash as _
+import torch
+
+from entity_index import build_entity_index
+from logits import Logits
+
+def _brute_force_search(logits, entity_embeds_weight, query, k):
+  scores = logits(query.unsqueeze(0), entity_embeds_weight.unsqueeze(0))
+  return torch.topk(scores, k, dim=1)[1]
+
+def _time_queries(search_fn, queries):
+  latencies = []
+  results = []
+  for query in queries:
+    start = time.perf_counter()
+    results.append(search_fn(query))
+    latencies.append(time.perf_counter() - start)
+  return torch.cat(results), np.array(latencies) * 1000
+
+def _recall(exact, approx):
+  return np.mean([len(set(e) & set(a)) / len(e) for e, a in zip(exact.tolist(), approx.tolist())])
+
+def main():
+  args = dict(getopt.getopt(_.tail(sys.argv), '', ['num_entities=', 'embed_len=', 'num_queries=', 'k=', 'num_probe='])[0])
+  num_entities = int(args.get('--num_entities', 200000))
+  embed_len = int(args.get('--embed_len', 100))
+  num_queries = int(args.get('--num_queries', 200))
+  k = int(args.get('--k', 30))
+  num_probe = int(args.get('--num_probe', 8))
+  entity_embeds_weight = torch.randn(num_entities, embed_len)
+  queries = entity_embeds_weight[torch.randint(0, num_entities, (num_queries,))] + 0.1 * torch.randn(num_queries, embed_len)
+  start = time.perf_counter()
+  entity_index = build_entity_index(entity_embeds_weight, num_probe=num_probe)
+  print('build time: {:.1f}s'.format(time.perf_counter() - start))
+  logits = Logits()
+  with torch.no_grad():
+    exact, brute_latencies = _time_queries(lambda query: _brute_force_search(logits, entity_embeds_weight, query, k),
+                                           queries)
+    approx, ann_latencies = _time_queries(lambda query: entity_index.search(query.unsqueeze(0), k),
+                                          queries)
+  for name, latencies in [('brute force', brute_latencies), ('ann index', ann_latencies)]:
+    print('{}: p50 {:.3f}ms p99 {:.3f}ms'.format(name,
+                                                 np.percentile(latencies, 50),
+                                                 np.percentile(latencies, 99)))
+  print('recall@{}: {:.3f}'.format(k, _recall(exact, approx)))
+
+
+if __name__ == "__main__":
+  main()
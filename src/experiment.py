@@ -1,6 +1,7 @@
 import operator
 from typing import List
 import hashlib
+import json
 import os
 import warnings
 
@@ -13,6 +14,24 @@ from logger import Logger
 
 warnings.showwarning = lambda *args, **kwargs: print(chalk.yellow(args[0]))
 
+# Params that change how a run executes but not the model it trains, so that
+# loading, resuming and retrieval find the files written under other settings
+_params_not_in_model_name = ['ablation',
+                             'load_model',
+                             'resume',
+                             'profile_stages',
+                             'profile_batches',
+                             'profiler',
+                             'use_entity_index',
+                             'num_retrieved',
+                             'entity_index_num_probe',
+                             'num_workers',
+                             'prefetch_depth',
+                             'bucket_window',
+                             'checkpoint_every',
+                             'eval_every',
+                             'precision']
+
 class ExperimentContext(object):
   def __init__(self, separator: str, train_or_test: bool, run_name: str, fields: List[str]):
     self.file_handle = open('./results_' + train_or_test + '_' + run_name, 'a+')
@@ -55,7 +74,7 @@ class Experiment(object):
 
   @property
   def model_name(self):
-    param_names = sorted([key for key in self.params.keys() if key not in ['ablation', 'load_model']])
+    param_names = sorted([key for key in self.params.keys() if key not in _params_not_in_model_name])
     param_strings = [name + '=' + str(self.params[name]) for name in param_names]
     hash_string = hashlib.sha256(str.encode('_'.join(param_strings))).hexdigest()
     return 'model_' + hash_string
@@ -64,6 +83,10 @@ class Experiment(object):
   def run_name(self):
     return self.model_name + '_' + self.ablation_string
 
+  def record_stages(self, report):
+    with open('./stages_' + self.train_or_test + '_' + self.run_name, 'w') as f:
+      json.dump(report, f, indent=2)
+
   def record_metrics(self, metrics, batch_num=None):
     metric_names = sorted(list(metrics.keys()))
     vals = [str(metrics[name]) for name in metric_names] + [str(batch_num), str(self.epoch_num)]
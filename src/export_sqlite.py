@@ -0,0 +1,58 @@
+import getopt
+import os
+import sys
+
+from dotenv import load_dotenv
+import pydash as _
+from progressbar import progressbar
+import pymysql.cursors
+
+from data_fetchers import get_connection
+from sqlite_backend import SQLiteConnection, create_index, create_table_for_row, insert_rows
+import utils as u
+
+table_indexes = {'pages': ['is_seed_page'],
+                 'entities': ['num_mentions'],
+                 'entity_mentions_text': ['page_id', 'entity_id', 'mention_id'],
+                 'entity_by_page': ['source_id', 'entity_id'],
+                 'mentions': ['page_id'],
+                 'entity_mentions': ['mention_id', 'entity_id']}
+
+def export_table(mysql_cursor, sqlite_connection, table_name, chunk_size=10000):
+  mysql_cursor.execute(f'select * from {table_name}')
+  sqlite_cursor = sqlite_connection.cursor()
+  rows = []
+  column_names = None
+  for row in progressbar(u.build_cursor_generator(mysql_cursor, buff_len=chunk_size)):
+    if column_names is None:
+      column_names = list(row.keys())
+      create_table_for_row(sqlite_cursor, table_name, row)
+    rows.append(row)
+    if len(rows) == chunk_size:
+      insert_rows(sqlite_cursor, table_name, column_names, rows)
+      rows = []
+  if rows: insert_rows(sqlite_cursor, table_name, column_names, rows)
+  for column_name in table_indexes.get(table_name, []):
+    if column_names is not None and column_name in column_names:
+      create_index(sqlite_cursor, table_name, column_name)
+  sqlite_connection.commit()
+
+def main():
+  load_dotenv(dotenv_path='.env')
+  args = dict(getopt.getopt(_.tail(sys.argv), '', ['path=', 'tables='])[0])
+  path = args.get('--path', os.getenv("DBPATH"))
+  table_names = args['--tables'].split(',') if '--tables' in args else list(table_indexes.keys())
+  mysql_connection = get_connection('mysql')
+  sqlite_connection = SQLiteConnection(path)
+  try:
+    with mysql_connection.cursor(pymysql.cursors.SSDictCursor) as mysql_cursor:
+      for table_name in table_names:
+        print('Exporting', table_name)
+        export_table(mysql_cursor, sqlite_connection, table_name)
+  finally:
+    mysql_connection.close()
+    sqlite_connection.close()
+
+
+if __name__ == "__main__":
+  main()
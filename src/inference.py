@@ -3,12 +3,14 @@ import torch
 
 from data_transformers import embed_and_pack_batch
 from logits import Logits
+from precision import get_autocast
 
-def predict(embedding, token_idx_lookup, p_prior, model, batch, ablation, entity_embeds, use_wiki2vec=False):
-  if use_wiki2vec:
-    return predict_wiki2vec(embedding, token_idx_lookup, p_prior, model, batch, ablation, entity_embeds)
-  else:
-    return predict_deep_el(embedding, token_idx_lookup, p_prior, model, batch, ablation, entity_embeds)
+def predict(embedding, token_idx_lookup, p_prior, model, batch, ablation, entity_embeds, use_wiki2vec=False, precision='float32'):
+  with get_autocast(batch['candidate_ids'].device, precision):
+    if use_wiki2vec:
+      return predict_wiki2vec(embedding, token_idx_lookup, p_prior, model, batch, ablation, entity_embeds)
+    else:
+      return predict_deep_el(embedding, token_idx_lookup, p_prior, model, batch, ablation, entity_embeds)
 
 def predict_wiki2vec(embedding, token_idx_lookup, p_prior, model, batch, ablation, entity_embeds):
   model.eval()
@@ -21,31 +23,117 @@ def predict_wiki2vec(embedding, token_idx_lookup, p_prior, model, batch, ablatio
   posterior = p_prior + p_text - (p_prior * p_text)
   return torch.argmax(posterior, dim=1)
 
+def group_documents(page_contents, entity_page_mentions):
+  '''Collapses the per mention page tensors of a batch to one entry per
+  document. Mentions of the same document share their tensors by reference,
+  as the datasets and the server hand them out. Returns the distinct page
+  contents and page mentions and the document index of every mention.'''
+  doc_idx_by_key = {}
+  doc_page_contents = []
+  doc_entity_page_mentions = []
+  mention_doc_idxs = []
+  for page_content, page_mentions in zip(page_contents, entity_page_mentions):
+    key = (id(page_content), id(page_mentions))
+    if key not in doc_idx_by_key:
+      doc_idx_by_key[key] = len(doc_page_contents)
+      doc_page_contents.append(page_content)
+      doc_entity_page_mentions.append(page_mentions)
+    mention_doc_idxs.append(doc_idx_by_key[key])
+  return doc_page_contents, doc_entity_page_mentions, torch.tensor(mention_doc_idxs, dtype=torch.long)
+
+def _encode_mentions(embedding, token_idx_lookup, model, batch, ablation):
+  left_splits, right_splits = embed_and_pack_batch(embedding,
+                                                   token_idx_lookup,
+                                                   batch['sentence_splits'])
+  if 'document_context' in ablation:
+    page_contents, entity_page_mentions, mention_doc_idxs = group_documents(batch['page_content'],
+                                                                            batch['entity_page_mentions'])
+    document_encodings = model.encoder.encode_documents(page_contents, entity_page_mentions)
+    mention_embeds, desc_embeds = model.encoder.encode_mentions((left_splits, right_splits),
+                                                                document_encodings,
+                                                                mention_doc_idxs.to(embedding.weight.device))
+  else:
+    local_context = model.encoder.local_context_encoder((left_splits, right_splits))
+    mention_embeds = model.encoder.relu(model.projection(torch.cat((local_context,
+                                                                    torch.zeros_like(local_context)), 1)))
+  return mention_embeds
+
+def _predict_from_mention_embeds(mention_embeds, p_prior, model, candidate_ids, candidate_mention_sim, ablation, entity_embeds):
+  logits = Logits()
+  calc_logits = lambda embeds, ids: logits(embeds, entity_embeds(ids))
+  men_logits = calc_logits(mention_embeds, candidate_ids)
+  p_text, __ = model.calc_scores((men_logits, torch.zeros_like(men_logits)),
+                                 candidate_mention_sim)
+  if 'prior' in ablation:
+    posterior = p_prior + p_text - (p_prior * p_text)
+    return torch.argmax(posterior, dim=1)
+  else:
+    return torch.argmax(p_text, dim=1)
+
 def predict_deep_el(embedding, token_idx_lookup, p_prior, model, batch, ablation, entity_embeds):
   model.eval()
   if ablation == ['prior']:
     return torch.argmax(p_prior, dim=1)
   elif 'local_context' in ablation:
-    left_splits, right_splits = embed_and_pack_batch(embedding,
-                                                     token_idx_lookup,
-                                                     batch['sentence_splits'])
-    if 'document_context' in ablation:
-      mention_embeds, desc_embeds = model.encoder(((left_splits, right_splits),
-                                                   batch['embedded_page_content'],
-                                                   batch['entity_page_mentions']))
-    else:
-      local_context = model.encoder.local_context_encoder((left_splits, right_splits))
-      mention_embeds = model.encoder.relu(model.projection(torch.cat((local_context,
-                                                                      torch.zeros_like(local_context)), 1)))
-    logits = Logits()
-    calc_logits = lambda embeds, ids: logits(embeds, entity_embeds(ids))
-    men_logits = calc_logits(mention_embeds, batch['candidate_ids'])
-    p_text, __ = model.calc_scores((men_logits, torch.zeros_like(men_logits)),
-                                   batch['candidate_mention_sim'])
-    if 'prior' in ablation:
-      posterior = p_prior + p_text - (p_prior * p_text)
-      return torch.argmax(posterior, dim=1)
-    else:
-      return torch.argmax(p_text, dim=1)
+    mention_embeds = _encode_mentions(embedding, token_idx_lookup, model, batch, ablation)
+    return _predict_from_mention_embeds(mention_embeds,
+                                        p_prior,
+                                        model,
+                                        batch['candidate_ids'],
+                                        batch['candidate_mention_sim'],
+                                        ablation,
+                                        entity_embeds)
   else:
     raise NotImplementedError
+
+def predict_document(embedding, token_idx_lookup, model, document, ablation, entity_embeds, precision='float32'):
+  '''Links every mention of one page. `document` holds the page\'s
+  `page_content` and `entity_page_mentions` tensors and, per mention,
+  `sentence_splits`, `candidate_ids`, `p_prior` and `candidate_mention_sim`.
+  The page is encoded once and only the local context runs per mention.'''
+  num_mentions = len(document['sentence_splits'])
+  batch = _.assign({},
+                   document,
+                   {'page_content': [document['page_content']] * num_mentions,
+                    'entity_page_mentions': [document['entity_page_mentions']] * num_mentions})
+  return predict(embedding, token_idx_lookup, document['p_prior'], model, batch, ablation, entity_embeds, precision=precision)
+
+def merge_retrieved_candidates(candidate_ids, retrieved_ids, num_retrieved):
+  is_dup = (retrieved_ids.unsqueeze(2) == candidate_ids.unsqueeze(1)).any(2)
+  positions = torch.arange(retrieved_ids.shape[1], device=retrieved_ids.device).unsqueeze(0)
+  keep = torch.argsort(positions + is_dup.long() * retrieved_ids.shape[1], dim=1)[:, :num_retrieved]
+  return torch.cat([candidate_ids, retrieved_ids.gather(1, keep)], 1)
+
+def score_candidates(mentions, candidate_ids, candidate_table, candidate_mention_sim):
+  '''Prior and string similarity of every candidate of each mention.'''
+  device = candidate_ids.device
+  candidate_ids = candidate_ids.cpu()
+  p_prior = candidate_table.get_batch_p_prior(mentions, candidate_ids)
+  sims = torch.stack([candidate_mention_sim(mention, row_candidate_ids)
+                      for mention, row_candidate_ids in zip(mentions, candidate_ids)])
+  return p_prior.to(device), sims.to(device)
+
+def predict_deep_el_with_retrieval(embedding, token_idx_lookup, p_prior, model, batch, ablation, entity_embeds, entity_index, num_retrieved, candidate_table, candidate_mention_sim, precision='float32'):
+  '''Adds the `num_retrieved` nearest entities from `entity_index` to the
+  candidates of each mention and rescores the merged candidates with their
+  prior and string similarity. `batch` needs the `mention` strings.'''
+  model.eval()
+  if 'local_context' not in ablation: raise NotImplementedError
+  with get_autocast(batch['candidate_ids'].device, precision):
+    mention_embeds = _encode_mentions(embedding, token_idx_lookup, model, batch, ablation)
+  num_candidates = batch['candidate_ids'].shape[1]
+  retrieved_ids = entity_index.search(mention_embeds, num_candidates + num_retrieved)
+  candidate_ids = merge_retrieved_candidates(batch['candidate_ids'],
+                                             retrieved_ids.to(batch['candidate_ids'].device),
+                                             num_retrieved)
+  merged_p_prior, candidate_mention_sim = score_candidates(batch['mention'], candidate_ids, candidate_table, candidate_mention_sim)
+  if isinstance(p_prior, torch.Tensor): p_prior = merged_p_prior
+  with get_autocast(batch['candidate_ids'].device, precision):
+    predictions = _predict_from_mention_embeds(mention_embeds,
+                                               p_prior,
+                                               model,
+                                               candidate_ids,
+                                               candidate_mention_sim,
+                                               ablation,
+                                               entity_embeds)
+  return predictions, candidate_ids
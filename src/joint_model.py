@@ -3,6 +3,7 @@ import torch.nn as nn
 
 from description_encoder_model import DescriptionEncoder
 from mention_context_encoder_model import MentionContextEncoder
+from precision import full_precision
 
 class JointEncoder(nn.Module):
   def __init__(self, desc_encoder, mention_context_encoder):
@@ -11,11 +12,25 @@ class JointEncoder(nn.Module):
     self.mention_context_encoder = mention_context_encoder
 
   def forward(self, data):
-    embedded_page_contents = data[1]
-    desc_embeds = self.desc_encoder(embedded_page_contents)
+    page_contents = data[1]
+    desc_embeds = self.desc_encoder(page_contents)
     mention_context_embeds = self.mention_context_encoder(data)
     return (desc_embeds, mention_context_embeds)
 
+  def encode_documents(self, page_contents, entity_page_mentions):
+    '''Runs the page level encoders once per document.'''
+    return (self.desc_encoder(page_contents),
+            self.mention_context_encoder.document_context_encoder(entity_page_mentions))
+
+  def encode_mentions(self, sentence_splits, document_encodings, mention_doc_idxs):
+    '''Same output as `forward`, with the page level encodings of
+    `encode_documents` looked up by each mention's document index.'''
+    desc_embeds, document_context_embeds = document_encodings
+    local_context_embeds = self.mention_context_encoder.local_context_encoder(sentence_splits)
+    mention_context_embeds = self.mention_context_encoder.combine(local_context_embeds,
+                                                                  document_context_embeds[mention_doc_idxs])
+    return (desc_embeds[mention_doc_idxs], mention_context_embeds)
+
 class Stacker(nn.Module):
   def __init__(self):
     super().__init__()
@@ -24,12 +39,15 @@ class Stacker(nn.Module):
     self.desc_linear = nn.Linear(self.num_features, 1)
 
   def forward(self, logits, str_sim):
-    men_lin_result = self.men_linear(torch.stack([logits[0], str_sim],
-                                                 2).reshape(-1, self.num_features))
-    # prior.reshape(-1)]))
-    desc_lin_result = self.desc_linear(torch.stack([logits[1], str_sim],
+    with full_precision(str_sim.device.type):
+      logits = [logits[0].float(), logits[1].float()]
+      str_sim = str_sim.float()
+      men_lin_result = self.men_linear(torch.stack([logits[0], str_sim],
                                                    2).reshape(-1, self.num_features))
-    # prior.reshape(-1)]))
+      # prior.reshape(-1)]))
+      desc_lin_result = self.desc_linear(torch.stack([logits[1], str_sim],
+                                                     2).reshape(-1, self.num_features))
+      # prior.reshape(-1)]))
     return men_lin_result.reshape(*logits[0].shape), desc_lin_result.reshape(*logits[1].shape)
 
 class JointModel(nn.Module):
@@ -43,7 +61,7 @@ class JointModel(nn.Module):
                dropout_drop_prob,
                entity_embeds,
                word_embedding,
-               pad_vector,
+               pad_token_idx,
                adaptive_logits,
                use_deep_network,
                use_lstm_local,
@@ -53,7 +71,8 @@ class JointModel(nn.Module):
     self.entity_embeds = entity_embeds
     self.desc_encoder = DescriptionEncoder(word_embed_len,
                                            entity_embeds,
-                                           pad_vector)
+                                           word_embedding,
+                                           pad_token_idx)
     self.mention_context_encoder = MentionContextEncoder(embed_len,
                                                          context_embed_len,
                                                          word_embed_len,
@@ -62,7 +81,8 @@ class JointModel(nn.Module):
                                                          num_lstm_layers,
                                                          dropout_drop_prob,
                                                          entity_embeds,
-                                                         pad_vector,
+                                                         word_embedding,
+                                                         pad_token_idx,
                                                          use_deep_network,
                                                          use_lstm_local,
                                                          num_cnn_local_filters,
@@ -17,6 +17,12 @@ args_with_values =  [{'name': 'batch_size'                 , 'for': 'train_param
                      {'name': 'num_epochs'                 , 'for': 'train_param', 'type': int},
                      {'name': 'min_mentions'               , 'for': 'train_param', 'type': int},
                      {'name': 'start_from_page_num'        , 'for': 'train_param', 'type': int},
+                     {'name': 'num_workers'                , 'for': 'train_param', 'type': int},
+                     {'name': 'prefetch_depth'             , 'for': 'train_param', 'type': int},
+                     {'name': 'bucket_window'              , 'for': 'train_param', 'type': int},
+                     {'name': 'checkpoint_every'           , 'for': 'train_param', 'type': int},
+                     {'name': 'eval_every'                 , 'for': 'train_param', 'type': int},
+                     {'name': 'precision'                  , 'for': 'train_param', 'type': str},
                      {'name': 'ablation'                   , 'for': 'model_param', 'type': lambda string: string.split(',')},
                      {'name': 'document_encoder_lstm_size' , 'for': 'model_param', 'type': int},
                      {'name': 'embed_len'                  , 'for': 'model_param', 'type': int},
@@ -27,8 +33,12 @@ args_with_values =  [{'name': 'batch_size'                 , 'for': 'train_param
                      {'name': 'word_embed_len'             , 'for': 'model_param', 'type': int},
                      {'name': 'word_embedding_set'         , 'for': 'model_param', 'type': str},
                      {'name': 'buffer_scale'               , 'for': 'run_param'  , 'type': int},
+                     {'name': 'num_retrieved'              , 'for': 'run_param'  , 'type': int},
+                     {'name': 'entity_index_num_probe'     , 'for': 'run_param'  , 'type': int},
                      {'name': 'adaptive_softmax_cutoffs'   , 'for': 'model_param', 'type': lambda string: [int(cutoff) for cutoff in string.split(',')]},
                      {'name': 'load_path'                  , 'for': 'run_param', 'type': lambda string: str(string) if string is not None else string},
+                     {'name': 'profile_batches'            , 'for': 'run_param', 'type': str},
+                     {'name': 'profiler'                   , 'for': 'run_param', 'type': str},
                      {'name': 'comments'                   , 'for': 'run_param', 'type': str}]
 
 runner = None
@@ -48,14 +58,20 @@ def main():
                    'dont_continue_training',
                    'cheat',
                    'use_conll',
-                   'use_wiki2vec']
+                   'use_wiki2vec',
+                   'use_entity_index',
+                   'resume',
+                   'profile_stages']
   args = getopt.getopt(_.tail(sys.argv), '', flag_argnames + [arg['name'] + '=' for arg in args_with_values])[0]
   flags = [_.head(arg) for arg in args]
   train_params = m(use_fast_sampler='--use_fast_sampler' in flags)
   run_params = m(load_model='--load_model' in flags,
                  cheat='--cheat' in flags,
                  continue_training='--dont_continue_training' not in flags,
-                 use_conll='--use_conll' in flags)
+                 use_conll='--use_conll' in flags,
+                 use_entity_index='--use_entity_index' in flags,
+                 resume='--resume' in flags,
+                 profile_stages='--profile_stages' in flags)
   model_params = m(use_adaptive_softmax='--use_adaptive_softmax' in flags,
                    use_hardcoded_cutoffs='--dont_use_hardcoded_cutoffs' not in flags,
                    use_ranking_loss='--use_ranking_loss' in flags,
@@ -65,7 +81,10 @@ def main():
                    freeze_word_embeddings='--dont_freeze_word_embeddings' not in flags,
                    use_wiki2vec='--use_wiki2vec' in flags)
   paths = m(lookups=os.getenv("LOOKUPS_PATH"),
-            page_id_order=os.getenv("PAGE_ID_ORDER_PATH"))
+            page_id_order=os.getenv("PAGE_ID_ORDER_PATH"),
+            page_token_corpus=os.getenv("PAGE_TOKEN_CORPUS_PATH"),
+            parse_cache=os.getenv("PARSE_CACHE_PATH"),
+            conll_cache=os.getenv("CONLL_CACHE_PATH"))
   for arg in args_with_values:
     name = arg['name']
     pair = _.find(args, lambda pair: name in pair[0])
@@ -1,14 +1,25 @@
 from random import shuffle
+import math
 import random
 from collections import defaultdict
 
 from torch.utils.data.sampler import Sampler
 import pydash as _
 
+from data_fetchers import fetch_by_ids
+
 
 class MentionContextBatchSampler(Sampler):
-  def __init__(self, cursor, page_id_order, batch_size, min_mentions, limit=None, use_fast_sampler=False):
-    super(MentionContextBatchSampler, self).__init__([])
+  def __init__(self,
+               cursor,
+               page_id_order,
+               batch_size,
+               min_mentions,
+               limit=None,
+               use_fast_sampler=False,
+               yield_page_ids=False,
+               bucket_window=0,
+               page_token_corpus=None):
     self.cursor = cursor
     self.page_id_order = page_id_order
     self.batch_size = batch_size
@@ -20,28 +31,104 @@ class MentionContextBatchSampler(Sampler):
     self._page_mention_ids = defaultdict(list)
     self.min_mentions = min_mentions
     self.use_fast_sampler = use_fast_sampler
+    self.yield_page_ids = yield_page_ids
+    self.bucket_window = bucket_window
+    self.page_token_corpus = page_token_corpus
+    if self.bucket_window > 0 and self.page_token_corpus is None:
+      raise ValueError('Bucketing by length needs a page token corpus')
+    self._bucketed_batches = []
+    self.num_windows = 0
+    self.num_batches = 0
+    self._states = {}
 
   def __len__(self):
     raise NotImplementedError
 
   def __iter__(self):
-    while self.page_ctr < len(self.page_id_order) or not _.is_empty(self.ids_from_last_page):
+    while self.page_ctr < len(self.page_id_order) or not _.is_empty(self.ids_from_last_page) or not _.is_empty(self._bucketed_batches):
       if self.use_fast_sampler: yield [None] * self.batch_size
       if (self.limit is not None) and (self.num_mentions_seen >= self.limit): return
-      batch = self._get_next_batch()
-      yield batch
+      batch = self._get_next_bucketed_batch() if self.bucket_window > 0 else self._get_next_batch()
       self.num_mentions_seen += len(batch)
+      self._states[self.num_batches] = self._snapshot()
+      self.num_batches += 1
+      yield batch
+
+  def _snapshot(self):
+    return {'batch_num': self.num_batches,
+            'page_ctr': self.page_ctr,
+            'ids_from_last_page': list(self.ids_from_last_page),
+            'num_mentions_seen': self.num_mentions_seen,
+            'num_windows': self.num_windows,
+            'bucketed_batches': [list(batch) for batch in self._bucketed_batches]}
+
+  def get_state(self, batch_num):
+    '''State right after `batch_num` was yielded. The DataLoader can draw
+    batches ahead of the one being trained on, so states are kept until
+    `release_states` is called past them.'''
+    return self._states.get(batch_num)
+
+  def release_states(self, batch_num):
+    '''Drops the states of batches before `batch_num`, which has been trained
+    on, since they can no longer be checkpointed.'''
+    for num in [num for num in self._states if num < batch_num]: del self._states[num]
+
+  def set_state(self, state):
+    self.num_batches = state['batch_num'] + 1
+    self.page_ctr = state['page_ctr']
+    self.ids_from_last_page = set(state['ids_from_last_page'])
+    self.num_mentions_seen = state['num_mentions_seen']
+    self.num_windows = state['num_windows']
+    self._bucketed_batches = [list(batch) for batch in state['bucketed_batches']]
+    self._page_mention_ids = defaultdict(list)
 
   def _get_page_mention_ids(self, page_id, page_ctr):
     if page_id in self._page_mention_ids:
       return self._page_mention_ids[page_id]
     else:
-      self.cursor.execute(f'select mention_id, entity_id, page_id from entity_mentions_text em join entities e on em.entity_id = e.id where e.num_mentions > {self.min_mentions} and page_id in (' + str(self.page_id_order[page_ctr : page_ctr + 10000])[1:-1] + ')')
       self._page_mention_ids = defaultdict(list)
-      for row in self.cursor.fetchall():
-        self._page_mention_ids[row['page_id']].append(row['mention_id'])
+      for row in fetch_by_ids(self.cursor,
+                              'select mention_id, entity_id, page_id from entity_mentions_text em join entities e on em.entity_id = e.id where e.num_mentions > %s and page_id in ({})',
+                              self.page_id_order[page_ctr : page_ctr + 10000],
+                              args=[self.min_mentions]):
+        if self.yield_page_ids:
+          self._page_mention_ids[row['page_id']].append((row['page_id'], row['mention_id']))
+        else:
+          self._page_mention_ids[row['page_id']].append(row['mention_id'])
       return self._page_mention_ids[page_id]
 
+  def _get_lengths(self, idx):
+    mention_id = idx[1] if isinstance(idx, tuple) else idx
+    return self.page_token_corpus.get_mention_lengths(mention_id)
+
+  def _bucket(self, ids, lengths):
+    '''Halves `ids` on the length field that spans the most tokens until the
+    parts are batch sized. A batch is padded to its longest left split, right
+    split and page mentions, so every field has to be bucketed, not only the
+    first one.'''
+    if len(ids) <= self.batch_size: return [ids] if ids else []
+    field = max(range(len(lengths[ids[0]])),
+                key=lambda field: max(lengths[idx][field] for idx in ids) - min(lengths[idx][field] for idx in ids))
+    ids = sorted(ids, key=lambda idx: (lengths[idx][field], random.random()))
+    half = math.ceil(len(ids) / self.batch_size / 2) * self.batch_size
+    return self._bucket(ids[:half], lengths) + self._bucket(ids[half:], lengths)
+
+  def _get_next_bucketed_batch(self):
+    '''Page ids carry the number of their window so the dataset keeps the
+    window's pages loaded until every batch drawn from it is served.'''
+    if _.is_empty(self._bucketed_batches):
+      ids = []
+      for batch_num in range(self.bucket_window):
+        if self.page_ctr >= len(self.page_id_order) and _.is_empty(self.ids_from_last_page): break
+        ids.extend(self._get_next_batch())
+      self._bucketed_batches = self._bucket(ids, {idx: self._get_lengths(idx) for idx in ids})
+      if self.yield_page_ids:
+        self._bucketed_batches = [[(page_id, mention_id, self.num_windows) for page_id, mention_id in batch]
+                                  for batch in self._bucketed_batches]
+      self.num_windows += 1
+      shuffle(self._bucketed_batches)
+    return self._bucketed_batches.pop()
+
   def _get_next_batch(self):
     ids = []
     if len(self.ids_from_last_page) > self.batch_size:
@@ -56,8 +143,8 @@ class MentionContextBatchSampler(Sampler):
         if self.page_ctr > len(self.page_id_order):
           return ids
       for page_id in self.page_id_order[self.page_ctr:]:
-        self.page_ctr += 1
         page_mention_ids = self._get_page_mention_ids(page_id, self.page_ctr)
+        self.page_ctr += 1
         ids.extend(page_mention_ids)
         if len(ids) >= self.batch_size:
           self.ids_from_last_page = set(ids[self.batch_size:])
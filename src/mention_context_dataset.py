@@ -1,15 +1,21 @@
-import Levenshtein
+import threading
 from collections import defaultdict
 
-from torch.utils.data import Dataset
+import Levenshtein
+
+import numpy as np
+
+from torch.utils.data import Dataset, get_worker_info
 import torch
 
 import pydash as _
 
-from data_transformers import get_mention_sentence_splits, embed_page_content, get_bag_of_nouns, tokens_to_embeddings
-from data_fetchers import get_candidate_ids, get_p_prior, get_candidate_strs
+from data_transformers import get_mention_sentence_splits, page_content_to_token_idx_tensor, get_bag_of_nouns
+from data_fetchers import fetch_by_ids, get_candidate_strs, get_connection, get_cursor, get_page_mention_counts
+from candidate_table import CandidateTable
 from parsers import parse_for_sentence_spans
-import utils as u
+from prefetcher import Prefetcher
+from profiling import stage_timer
 
 
 class MentionContextDataset(Dataset):
@@ -28,7 +34,12 @@ class MentionContextDataset(Dataset):
                min_mentions=1,
                use_fast_sampler=False,
                use_wiki2vec=False,
-               start_from_page_num=0):
+               start_from_page_num=0,
+               page_token_corpus=None,
+               candidate_table=None,
+               candidate_mention_sim=None,
+               page_mention_counts=None,
+               prefetch_depth=0):
     self.page_id_order = page_id_order
     self.entity_candidates_prior = entity_candidates_prior
     self.entity_label_lookup = _.map_values(entity_label_lookup, torch.tensor)
@@ -36,92 +47,128 @@ class MentionContextDataset(Dataset):
     self.embedding = embedding
     self.token_idx_lookup = token_idx_lookup
     self.cursor = cursor
+    self._db_connection = None
+    self._producer_thread = None
+    self._producer_connection = None
+    self._producer_cursor = None
     self.batch_size = batch_size
     self.num_entities = num_entities
     self.num_candidates = num_candidates
     self._sentence_spans_lookup = {}
     self._page_content_lookup = {}
-    self._embedded_page_content_lookup = {}
+    self._page_token_idxs_lookup = {}
     self._entity_page_mentions_lookup = {}
     self._mentions_per_page_ctr = {}
+    self._page_windows = {}
     self._mention_infos = {}
-    self._candidate_strs_lookup = {}
     self._bag_of_nouns_lookup = {}
     self.page_ctr = start_from_page_num
+    self._buffers = []
+    self._applied_page_ctr = start_from_page_num
+    self._consumed_mention_ids = set()
     self.cheat = cheat
     self.buffer_scale = buffer_scale
     self.min_mentions = min_mentions
     self.use_fast_sampler = use_fast_sampler
     self.use_wiki2vec = use_wiki2vec
+    self.page_token_corpus = page_token_corpus
+    self.candidate_table = candidate_table if candidate_table is not None else CandidateTable(entity_candidates_prior)
+    self.candidate_mention_sim = candidate_mention_sim
+    self._page_mention_cumsum = np.cumsum(page_mention_counts) if page_mention_counts is not None else None
+    self.prefetch_depth = prefetch_depth
+    self._prefetcher = None
     # if self.use_fast_sampler: assert not self.use_wiki2vec, 'train wiki2vec locally'
+    self.valid_entity_ids = None
     if self.min_mentions > 1:
       query = 'select id from entities where num_mentions >= ' + str(self.min_mentions)
       cursor.execute(query)
       self.valid_entity_ids = set(row['id'] for row in cursor.fetchall())
 
-  def _get_candidate_ids(self, mention, label):
-    return get_candidate_ids(self.entity_candidates_prior,
-                             self.num_entities,
-                             self.num_candidates,
-                             mention,
-                             label,
-                             cheat=self.cheat)
-
   def __len__(self):
     raise NotImplementedError
 
-  def _getitem(self, idx):
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    state['cursor'] = None
+    state['_db_connection'] = None
+    state['_prefetcher'] = None
+    state['_producer_thread'] = None
+    state['_producer_connection'] = None
+    state['_producer_cursor'] = None
+    return state
+
+  def open_cursor(self):
+    self._db_connection = get_connection()
+    self.cursor = get_cursor(self._db_connection)
+
+  def _get_cursor(self):
+    '''The prefetch producer thread queries through its own connection since
+    db cursors are not thread safe.'''
+    if threading.current_thread() is not self._producer_thread: return self.cursor
+    if self._producer_cursor is None:
+      self._producer_connection = get_connection()
+      self._producer_cursor = get_cursor(self._producer_connection)
+    return self._producer_cursor
+
+  def _close_producer_connection(self):
+    if self._producer_connection is not None: self._producer_connection.close()
+    self._producer_connection = None
+    self._producer_cursor = None
+
+  def _resolve_idx(self, idx):
+    if isinstance(idx, tuple):
+      page_id, mention_id = idx[0], idx[1]
+      if mention_id not in self._mention_infos:
+        self._load_pages([page_id])
+      return mention_id
     if self.use_fast_sampler:
       if len(self._mention_infos) == 0: self._next_batch()
-      idx = next(iter(self._mention_infos.keys()))
-    if idx not in self._mention_infos:
-      self._next_batch()
+      return next(iter(self._mention_infos.keys()))
+    while idx not in self._mention_infos:
+      if not self._next_batch(): break
+    return idx
+
+  def _evict_page(self, page_id):
+    self._mentions_per_page_ctr.pop(page_id, None)
+    self._page_windows.pop(page_id, None)
+    self._sentence_spans_lookup.pop(page_id, None)
+    self._page_content_lookup.pop(page_id, None)
+    self._page_token_idxs_lookup.pop(page_id, None)
+    self._entity_page_mentions_lookup.pop(page_id, None)
+    self._bag_of_nouns_lookup.pop(page_id, None)
+
+  def _getitem(self, idx):
+    idx = self._resolve_idx(idx)
     mention_info = self._mention_infos.pop(idx)
-    sentence_spans = self._sentence_spans_lookup[mention_info['page_id']]
-    page_content = self._page_content_lookup[mention_info['page_id']]
     label = self.entity_label_lookup[mention_info['entity_id']]
-    candidate_ids = self._get_candidate_ids(mention_info['mention'], label)
-    p_prior = get_p_prior(self.entity_candidates_prior, mention_info['mention'], candidate_ids)
-    candidates = self._get_candidate_strs(candidate_ids.tolist())
-    sample = {'sentence_splits': get_mention_sentence_splits(page_content,
-                                                             sentence_spans,
-                                                             mention_info),
+    candidate_ids = mention_info['candidate_ids']
+    sample = {'mention': mention_info['mention'],
+              'sentence_splits': self._get_sentence_splits(mention_info),
               'label': label,
-              'embedded_page_content': self._embedded_page_content_lookup[mention_info['page_id']],
+              'page_content': self._page_token_idxs_lookup[mention_info['page_id']],
               'entity_page_mentions': self._entity_page_mentions_lookup[mention_info['page_id']],
-              'p_prior': p_prior,
+              'p_prior': mention_info['p_prior'],
               'candidate_ids': candidate_ids,
-              'candidate_mention_sim': torch.tensor([Levenshtein.ratio(mention_info['mention'], candidate)
-                                                     for candidate in candidates])}
+              'candidate_mention_sim': self._get_candidate_mention_sim(mention_info)}
     self._mentions_per_page_ctr[mention_info['page_id']] -= 1
     if self._mentions_per_page_ctr[mention_info['page_id']] == 0:
-      self._sentence_spans_lookup.pop(mention_info['page_id'])
-      self._page_content_lookup.pop(mention_info['page_id'])
-      self._embedded_page_content_lookup.pop(mention_info['page_id'])
-      self._entity_page_mentions_lookup.pop(mention_info['page_id'])
+      self._evict_page(mention_info['page_id'])
     return sample
 
   def _wiki2vec_getitem(self, idx):
-    if self.use_fast_sampler:
-      if len(self._mention_infos) == 0: self._next_batch()
-      idx = next(iter(self._mention_infos.keys()))
-    if idx not in self._mention_infos:
-      self._next_batch()
+    idx = self._resolve_idx(idx)
     mention_info = self._mention_infos.pop(idx)
     bag_of_nouns = self._bag_of_nouns_lookup[mention_info['page_id']]
     label = self.entity_label_lookup[mention_info['entity_id']]
-    candidate_ids = self._get_candidate_ids(mention_info['mention'], label)
-    p_prior = get_p_prior(self.entity_candidates_prior, mention_info['mention'], candidate_ids)
-    candidates = self._get_candidate_strs(candidate_ids.tolist())
+    candidate_ids = mention_info['candidate_ids']
     sample = {'bag_of_nouns': bag_of_nouns,
               'label': label,
-              'p_prior': p_prior,
+              'p_prior': mention_info['p_prior'],
               'candidate_ids': candidate_ids,
-              'candidate_mention_sim': torch.tensor([Levenshtein.ratio(mention_info['mention'], candidate)
-                                                     for candidate in candidates])}
+              'candidate_mention_sim': self._get_candidate_mention_sim(mention_info)}
     self._mentions_per_page_ctr[mention_info['page_id']] -= 1
     if self._mentions_per_page_ctr[mention_info['page_id']] == 0:
-      self._bag_of_nouns_lookup.pop(mention_info['page_id'])
+      self._evict_page(mention_info['page_id'])
     return sample
 
   def __getitem__(self, idx):
@@ -130,39 +177,78 @@ class MentionContextDataset(Dataset):
     else:
       return self._getitem(idx)
 
-  def _get_candidate_strs(self, candidate_ids):
-    return [self._candidate_strs_lookup[candidate_id]
-            if candidate_id in self._candidate_strs_lookup else ''
-            for candidate_id in candidate_ids]
+  def __getitems__(self, idxs):
+    if all(isinstance(idx, tuple) for idx in idxs):
+      batch_page_ids = set(idx[0] for idx in idxs)
+      window = idxs[0][2] if len(idxs[0]) > 2 else None
+      keep_page_ids = set(batch_page_ids)
+      if window is not None:
+        keep_page_ids.update(page_id for page_id, page_window in self._page_windows.items() if page_window == window)
+      for page_id in set(self._mentions_per_page_ctr.keys()) - keep_page_ids:
+        self._evict_page(page_id)
+      self._mention_infos = {mention_id: mention_info
+                             for mention_id, mention_info in self._mention_infos.items()
+                             if mention_info['page_id'] in keep_page_ids}
+      missing_page_ids = list(set(idx[0] for idx in idxs if idx[1] not in self._mention_infos))
+      if not _.is_empty(missing_page_ids): self._load_pages(missing_page_ids)
+      if window is not None:
+        self._page_windows.update((page_id, window) for page_id in batch_page_ids)
+    return [self[idx] for idx in idxs]
+
+  def _get_candidate_mention_sim(self, mention_info):
+    if self.candidate_mention_sim is not None:
+      return self.candidate_mention_sim(mention_info['mention'], mention_info['candidate_ids'])
+    return torch.tensor([Levenshtein.ratio(mention_info['mention'], candidate)
+                         for candidate in mention_info['candidate_strs']])
+
+  def _get_sentence_splits(self, mention_info):
+    if self.page_token_corpus is not None:
+      return self.page_token_corpus.get_sentence_split_token_idxs(mention_info['mention_id'])
+    return get_mention_sentence_splits(self._page_content_lookup[mention_info['page_id']],
+                                       self._sentence_spans_lookup[mention_info['page_id']],
+                                       mention_info)
 
   def _get_mention_infos_by_page_id(self, page_ids):
-    self.cursor.execute('select mention, page_id, entity_id, mention_id, offset from entity_mentions_text where page_id in (' + str(page_ids)[1:-1] + ')')
-    rows = self.cursor.fetchall()
+    if self.page_token_corpus is not None:
+      rows = [mention_info
+              for page_id in page_ids
+              for mention_info in self.page_token_corpus.get_page_mention_infos(page_id)]
+    else:
+      rows = fetch_by_ids(self._get_cursor(),
+                          'select mention, page_id, entity_id, mention_id, offset from entity_mentions_text where page_id in ({})',
+                          page_ids)
     result = defaultdict(list)
     for row in rows:
-      if row['entity_id'] in self.valid_entity_ids:
+      if self.valid_entity_ids is None or row['entity_id'] in self.valid_entity_ids:
         result[row['page_id']].append(row)
     return dict(result)
 
   def _get_batch_mention_infos(self, closeby_page_ids):
-    self._candidate_strs_lookup = {}
     mention_infos = {}
-    mentions_covered = set()
+    mentions_per_page_ctr = {}
     mentions_by_page_id = self._get_mention_infos_by_page_id(closeby_page_ids)
-    candidate_ids = []
     for page_id, mentions in mentions_by_page_id.items():
-      for mention_info in mentions:
-        if mention_info['mention'] in mentions_covered: continue
-        mentions_covered.add(mention_info['mention'])
-        label = self.entity_label_lookup[mention_info['entity_id']]
-        candidate_ids.extend(self._get_candidate_ids(mention_info['mention'], label).tolist())
-      self._mentions_per_page_ctr[page_id] = len(mentions)
+      mentions_per_page_ctr[page_id] = len(mentions)
       mention_infos.update({mention['mention_id']: mention for mention in mentions})
-    self._candidate_strs_lookup.update(dict(zip(candidate_ids,
-                                                u.chunk_apply_at_lim(lambda ids: get_candidate_strs(self.cursor, ids),
-                                                                     [self.entity_id_lookup[cand_id] for cand_id in candidate_ids],
-                                                                     10000))))
-    return mention_infos
+    if _.is_empty(mention_infos): return mention_infos, mentions_per_page_ctr
+    batch_mention_infos = list(mention_infos.values())
+    batch_candidate_ids, batch_p_prior = self.candidate_table.get_batch_candidate_ids_and_p_prior([mention_info['mention'] for mention_info in batch_mention_infos],
+                                                                                                 [self.entity_label_lookup[mention_info['entity_id']] for mention_info in batch_mention_infos],
+                                                                                                 self.num_entities,
+                                                                                                 self.num_candidates,
+                                                                                                 cheat=self.cheat)
+    for mention_info, candidate_ids, p_prior in zip(batch_mention_infos, batch_candidate_ids, batch_p_prior):
+      mention_info['candidate_ids'] = candidate_ids
+      mention_info['p_prior'] = p_prior
+    if self.candidate_mention_sim is not None: return mention_infos, mentions_per_page_ctr
+    candidate_ids = torch.unique(batch_candidate_ids).tolist()
+    candidate_strs_lookup = dict(zip(candidate_ids,
+                                     get_candidate_strs(self._get_cursor(),
+                                                        [self.entity_id_lookup[cand_id] for cand_id in candidate_ids])))
+    for mention_info in batch_mention_infos:
+      mention_info['candidate_strs'] = [candidate_strs_lookup[candidate_id]
+                                        for candidate_id in mention_info['candidate_ids'].tolist()]
+    return mention_infos, mentions_per_page_ctr
 
   def _to_sentence_spans_lookup(self, content_lookup):
     lookup = {}
@@ -178,65 +264,153 @@ class MentionContextDataset(Dataset):
 
   def _get_batch_page_content_lookup(self, page_ids):
     lookup = {}
-    self.cursor.execute('select id, content from pages where id in (' + str(page_ids)[1:-1] + ')')
-    for row in self.cursor.fetchall():
+    for row in fetch_by_ids(self._get_cursor(), 'select id, content from pages where id in ({})', page_ids):
       lookup[row['id']] = row['content']
     return lookup
 
-  def _get_batch_entity_page_mentions_lookup(self, page_ids):
+  def _get_batch_entity_page_mentions_lookup(self, page_ids, mention_infos):
     lookup = {}
     page_mention_infos_lookup = defaultdict(list)
-    for mention_info in self._mention_infos.values():
+    for mention_info in mention_infos.values():
       page_mention_infos_lookup[mention_info['page_id']].append(mention_info)
     for page_id in page_ids:
       page_mention_infos = page_mention_infos_lookup[page_id]
       content = ' '.join([mention_info['mention'] for mention_info in page_mention_infos])
       if _.is_empty(page_mention_infos):
-        lookup[page_id] = torch.tensor([])
+        lookup[page_id] = torch.tensor([], dtype=torch.int32)
       else:
-        lookup[page_id] = embed_page_content(self.embedding,
-                                             self.token_idx_lookup,
-                                             content,
-                                             page_mention_infos)
+        lookup[page_id] = page_content_to_token_idx_tensor(self.token_idx_lookup,
+                                                           content,
+                                                           page_mention_infos)
     return lookup
 
-  def _get_batch_embedded_page_content_lookup(self, page_ids):
+  def _get_batch_page_token_idxs_lookup(self, page_ids, page_content_lookup):
     lookup = {}
     for page_id in page_ids:
-      page_content = self._page_content_lookup[page_id]
+      page_content = page_content_lookup[page_id]
       if len(page_content.strip()) > 5:
-        lookup[page_id] = embed_page_content(self.embedding,
-                                             self.token_idx_lookup,
-                                             page_content)
+        lookup[page_id] = page_content_to_token_idx_tensor(self.token_idx_lookup, page_content)
     return lookup
 
+  def _get_page_mention_cumsum(self):
+    if self._page_mention_cumsum is None:
+      self._page_mention_cumsum = np.cumsum(get_page_mention_counts(self._get_cursor(),
+                                                                    self.page_id_order,
+                                                                    self.min_mentions))
+    return self._page_mention_cumsum
+
   def _next_page_id_batch(self):
-    num_mentions_in_batch = 0
-    page_ids = []
-    num_page_batch_size = 10000
-    while num_mentions_in_batch < self.batch_size * self.buffer_scale and self.page_ctr < len(self.page_id_order):
-      if self.min_mentions > 1:
-        page_ids_to_add = self.page_id_order[self.page_ctr : self.page_ctr + num_page_batch_size]
-        self.cursor.execute(f'select count(*) from (select 1 from mentions m inner join entity_mentions em on m.id = em.mention_id inner join entities e on e.id = em.entity_id where m.page_id in ({str(page_ids_to_add)[1:-1]}) and e.num_mentions > {self.min_mentions}) tab')
-        num_mentions_in_batch += self.cursor.fetchone()['count(*)']
-        page_ids.extend(page_ids_to_add)
-        self.page_ctr += num_page_batch_size
-      else:
-        page_id_to_add = self.page_id_order[self.page_ctr]
-        self.cursor.execute('select count(*) from mentions where page_id = %s', page_id_to_add)
-        num_mentions_in_batch += self.cursor.fetchone()['count(*)']
-        page_ids.append(page_id_to_add)
-        self.page_ctr += 1
+    if self.page_ctr >= len(self.page_id_order): return []
+    cumsum = self._get_page_mention_cumsum()
+    num_seen = cumsum[self.page_ctr - 1] if self.page_ctr > 0 else 0
+    end = int(np.searchsorted(cumsum, num_seen + self.batch_size * self.buffer_scale)) + 1
+    page_ids = self.page_id_order[self.page_ctr : min(end, len(self.page_id_order))]
+    self.page_ctr += len(page_ids)
     return page_ids
 
+  def _get_batch_corpus_lookups(self, page_ids):
+    page_token_idxs_lookup = {}
+    entity_page_mentions_lookup = {}
+    for page_id in page_ids:
+      page_content_token_idxs = self.page_token_corpus.get_page_content_token_idxs(page_id)
+      if len(page_content_token_idxs) > 0:
+        page_token_idxs_lookup[page_id] = page_content_token_idxs
+      entity_page_mentions_lookup[page_id] = self.page_token_corpus.get_entity_page_mention_token_idxs(page_id)
+    return page_token_idxs_lookup, entity_page_mentions_lookup
+
+  def _produce_pages(self):
+    start = self.page_ctr
+    page_ids = self._next_page_id_batch()
+    if _.is_empty(page_ids): return None
+    with stage_timer.time('build_pages'):
+      return start, self.page_ctr, self._build_pages(page_ids)
+
+  def _prefetch_pages(self):
+    self._producer_thread = threading.current_thread()
+    produced = self._produce_pages()
+    if produced is None: self._close_producer_connection()
+    return produced
+
+  def get_prefetch_metrics(self):
+    if self._prefetcher is None: return {'producer_stall_time': 0.0, 'consumer_wait_time': 0.0}
+    return self._prefetcher.get_metrics()
+
   def _next_batch(self):
-    closeby_page_ids = self._next_page_id_batch()
+    if self.prefetch_depth > 0:
+      if self._prefetcher is None: self._prefetcher = Prefetcher(self._prefetch_pages, self.prefetch_depth)
+      produced = self._prefetcher.get()
+    else:
+      produced = self._produce_pages()
+    if produced is None: return False
+    start, end, pages = produced
+    self._prune_buffers()
+    self._buffers.append((start, list(pages['_mention_infos'].keys())))
+    self._applied_page_ctr = end
+    self._drop_consumed(pages)
+    self._apply_pages(pages)
+    return True
+
+  def _drop_consumed(self, pages):
+    consumed = self._consumed_mention_ids.intersection(pages['_mention_infos'].keys())
+    self._consumed_mention_ids -= consumed
+    for mention_id in consumed:
+      page_id = pages['_mention_infos'].pop(mention_id)['page_id']
+      pages['_mentions_per_page_ctr'][page_id] -= 1
+      if pages['_mentions_per_page_ctr'][page_id] == 0:
+        for name, lookup in pages.items():
+          if name != '_mention_infos': lookup.pop(page_id, None)
+
+  def _prune_buffers(self):
+    self._buffers = [(start, ids) for start, ids in self._buffers
+                     if any(mention_id in self._mention_infos for mention_id in ids)]
+
+  def get_state(self):
+    '''Where to pick up the sequential page order: the first buffer that still
+    has unconsumed mentions is reloaded and the mentions already served from
+    it are dropped.'''
+    self._prune_buffers()
+    if _.is_empty(self._buffers):
+      return {'page_ctr': self._applied_page_ctr, 'consumed_mention_ids': []}
+    return {'page_ctr': self._buffers[0][0],
+            'consumed_mention_ids': [mention_id
+                                     for start, ids in self._buffers
+                                     for mention_id in ids
+                                     if mention_id not in self._mention_infos]}
+
+  def set_state(self, state):
+    self.page_ctr = state['page_ctr']
+    self._applied_page_ctr = state['page_ctr']
+    self._consumed_mention_ids = set(state['consumed_mention_ids'])
+
+  def _build_pages(self, closeby_page_ids):
+    mention_infos, mentions_per_page_ctr = self._get_batch_mention_infos(closeby_page_ids)
+    pages = {'_mention_infos': mention_infos,
+             '_mentions_per_page_ctr': mentions_per_page_ctr}
+    if self.page_token_corpus is not None and not self.use_wiki2vec:
+      page_token_idxs_lookup, entity_page_mentions_lookup = self._get_batch_corpus_lookups(closeby_page_ids)
+      pages['_page_token_idxs_lookup'] = page_token_idxs_lookup
+      pages['_entity_page_mentions_lookup'] = entity_page_mentions_lookup
+      return pages
     page_content = self._get_batch_page_content_lookup(closeby_page_ids)
     if not self.use_wiki2vec:
-      self._page_content_lookup.update(page_content)
-      self._sentence_spans_lookup.update(self._to_sentence_spans_lookup(page_content))
-      self._entity_page_mentions_lookup.update(self._get_batch_entity_page_mentions_lookup(closeby_page_ids))
-      self._embedded_page_content_lookup.update(self._get_batch_embedded_page_content_lookup(closeby_page_ids))
+      pages['_page_content_lookup'] = page_content
+      pages['_sentence_spans_lookup'] = self._to_sentence_spans_lookup(page_content)
+      pages['_entity_page_mentions_lookup'] = self._get_batch_entity_page_mentions_lookup(closeby_page_ids, mention_infos)
+      pages['_page_token_idxs_lookup'] = self._get_batch_page_token_idxs_lookup(closeby_page_ids, page_content)
     else:
-      self._bag_of_nouns_lookup.update(self._get_batch_bag_of_nouns_lookup(page_content))
-    self._mention_infos.update(self._get_batch_mention_infos(closeby_page_ids))
+      pages['_bag_of_nouns_lookup'] = self._get_batch_bag_of_nouns_lookup(page_content)
+    return pages
+
+  def _apply_pages(self, pages):
+    for name, lookup in pages.items():
+      getattr(self, name).update(lookup)
+
+  def _load_pages(self, closeby_page_ids):
+    with stage_timer.time('build_pages'):
+      pages = self._build_pages(closeby_page_ids)
+    self._apply_pages(pages)
+
+def mention_context_worker_init_fn(worker_id):
+  dataset = get_worker_info().dataset
+  if isinstance(dataset, MentionContextDataset):
+    dataset.open_cursor()
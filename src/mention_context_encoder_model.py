@@ -14,7 +14,8 @@ class MentionContextEncoder(nn.Module):
                num_lstm_layers,
                dropout_drop_prob,
                entity_embeds,
-               pad_vector,
+               word_embedding,
+               pad_token_idx,
                use_deep_network,
                use_lstm_local,
                num_cnn_local_filters,
@@ -31,7 +32,8 @@ class MentionContextEncoder(nn.Module):
     self.document_context_encoder = DocumentContextEncoder(document_encoder_lstm_size,
                                                            word_embed_len,
                                                            context_embed_len,
-                                                           pad_vector,
+                                                           word_embedding,
+                                                           pad_token_idx,
                                                            use_deep_network)
     self.projection = nn.Linear(2 * context_embed_len, embed_len)
     self.relu = nn.ReLU()
@@ -41,6 +43,9 @@ class MentionContextEncoder(nn.Module):
     entity_page_mentions = data[2]
     local_context_embeds = self.local_context_encoder(sentence_splits)
     document_context_embeds = self.document_context_encoder(entity_page_mentions)
-    context_embeds = torch.cat((local_context_embeds, document_context_embeds), 1)
+    return self.combine(local_context_embeds, document_context_embeds)
+
+  def combine(self, local_context_embeds, document_context_embeds):
+    context_embeds = torch.cat((local_context_embeds, document_context_embeds), 1).float()
     unit_context_embeds = context_embeds / torch.norm(context_embeds, 2, 1).unsqueeze(1)
     return self.relu(self.projection(unit_context_embeds))
@@ -0,0 +1,87 @@
+import queue
+import threading
+import time
+
+import numpy as np
+
+class LatencyStats(object):
+  def __init__(self, max_size=100000):
+    self.max_size = max_size
+    self._lock = threading.Lock()
+    self._latencies = []
+    self._num_items = 0
+    self._start_time = time.perf_counter()
+
+  def record(self, latency, num_items):
+    with self._lock:
+      self._latencies.append(latency)
+      if len(self._latencies) > self.max_size: self._latencies = self._latencies[-self.max_size:]
+      self._num_items += num_items
+
+  def summary(self):
+    with self._lock:
+      latencies = np.array(self._latencies) * 1000
+      elapsed = time.perf_counter() - self._start_time
+      return {'num_requests': len(latencies),
+              'num_mentions': self._num_items,
+              'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+              'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+              'mentions_per_sec': self._num_items / elapsed}
+
+class MicroBatcher(object):
+  def __init__(self, predict_batch, max_batch_size=100, max_latency=0.01):
+    self.predict_batch = predict_batch
+    self.max_batch_size = max_batch_size
+    self.max_latency = max_latency
+    self.batch_sizes = []
+    self._queue = queue.Queue()
+    self._held = None
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+
+  def submit(self, items):
+    '''Requests larger than `max_batch_size` are split so that no batch
+    grows past it.'''
+    requests = [{'items': items[start : start + self.max_batch_size], 'done': threading.Event(), 'result': None, 'error': None}
+                for start in range(0, len(items), self.max_batch_size)]
+    for request in requests: self._queue.put(request)
+    results = []
+    for request in requests:
+      request['done'].wait()
+      if request['error'] is not None: raise request['error']
+      results.extend(request['result'])
+    return results
+
+  def _collect(self):
+    requests = [self._held or self._queue.get()]
+    self._held = None
+    num_items = len(requests[0]['items'])
+    deadline = time.perf_counter() + self.max_latency
+    while num_items < self.max_batch_size:
+      timeout = deadline - time.perf_counter()
+      if timeout <= 0: break
+      try:
+        request = self._queue.get(timeout=timeout)
+      except queue.Empty:
+        break
+      if num_items + len(request['items']) > self.max_batch_size:
+        self._held = request
+        break
+      requests.append(request)
+      num_items += len(request['items'])
+    return requests
+
+  def _run(self):
+    while True:
+      requests = self._collect()
+      items = [item for request in requests for item in request['items']]
+      self.batch_sizes.append(len(items))
+      try:
+        results = self.predict_batch(items) if items else []
+        start = 0
+        for request in requests:
+          request['result'] = results[start : start + len(request['items'])]
+          start += len(request['items'])
+      except Exception as error: # pylint: disable=broad-except
+        for request in requests: request['error'] = error
+      for request in requests: request['done'].set()
@@ -0,0 +1,196 @@
+import os
+import pickle
+from collections import defaultdict
+
+import numpy as np
+import torch
+from progressbar import progressbar
+
+from data_fetchers import fetch_by_ids
+from data_transformers import get_mention_sentence_splits, page_content_to_token_idxs, tokens_to_idxs
+from parsers import parse_batch
+
+_ragged_names = ['content', 'page_mentions', 'sentence_spans', 'splits']
+
+def _get_page_contents(cursor, page_ids):
+  return {row['id']: row['content']
+          for row in fetch_by_ids(cursor, 'select id, content from pages where id in ({})', page_ids)}
+
+def _get_mention_infos_by_page_id(cursor, page_ids):
+  result = defaultdict(list)
+  for row in fetch_by_ids(cursor,
+                          'select mention, page_id, entity_id, mention_id, offset from entity_mentions_text where page_id in ({})',
+                          page_ids):
+    result[row['page_id']].append(row)
+  return result
+
+def _get_valid_entity_ids(cursor, min_mentions):
+  if min_mentions <= 1: return None
+  cursor.execute('select id from entities where num_mentions >= ' + str(min_mentions))
+  return set(row['id'] for row in cursor.fetchall())
+
+class _RaggedWriter(object):
+  def __init__(self, path, name):
+    self.path = path
+    self.name = name
+    self.file_handle = open(os.path.join(path, name + '.bin'), 'wb')
+    self.offsets = [0]
+
+  def append(self, values):
+    values = np.asarray(values, dtype=np.int32)
+    self.file_handle.write(values.tobytes())
+    self.offsets.append(self.offsets[-1] + values.size)
+
+  def close(self):
+    self.file_handle.close()
+    np.save(os.path.join(self.path, self.name + '_offsets.npy'),
+            np.array(self.offsets, dtype=np.int64))
+
+class PageTokenCorpusWriter(object):
+  def __init__(self, path, min_mentions=1):
+    self.path = path
+    self.min_mentions = min_mentions
+    os.makedirs(path, exist_ok=True)
+    self.writers = {name: _RaggedWriter(path, name) for name in _ragged_names}
+    self.page_ids = []
+    self.page_mention_offsets = [0]
+    self.mention_ids = []
+    self.mention_entity_ids = []
+    self.mention_char_offsets = []
+    self.mentions = []
+
+  def add_page(self, page_id, content_idxs, page_mention_idxs, sentence_spans, page_mention_infos, splits):
+    self.page_ids.append(page_id)
+    self.writers['content'].append(content_idxs)
+    self.writers['page_mentions'].append(page_mention_idxs)
+    self.writers['sentence_spans'].append(np.array(sentence_spans, dtype=np.int32).reshape(-1))
+    for mention_info, (left_split, right_split) in zip(page_mention_infos, splits):
+      self.writers['splits'].append(left_split)
+      self.writers['splits'].append(right_split)
+      self.mention_ids.append(mention_info['mention_id'])
+      self.mention_entity_ids.append(mention_info['entity_id'])
+      self.mention_char_offsets.append(mention_info['offset'])
+      self.mentions.append(mention_info['mention'])
+    self.page_mention_offsets.append(len(self.mention_ids))
+
+  def close(self):
+    for writer in self.writers.values():
+      writer.close()
+    path = self.path
+    np.save(os.path.join(path, 'page_ids.npy'), np.array(self.page_ids, dtype=np.int64))
+    np.save(os.path.join(path, 'page_mention_offsets.npy'), np.array(self.page_mention_offsets, dtype=np.int64))
+    np.save(os.path.join(path, 'mention_ids.npy'), np.array(self.mention_ids, dtype=np.int64))
+    np.save(os.path.join(path, 'mention_entity_ids.npy'), np.array(self.mention_entity_ids, dtype=np.int64))
+    np.save(os.path.join(path, 'mention_char_offsets.npy'), np.array(self.mention_char_offsets, dtype=np.int64))
+    np.save(os.path.join(path, 'min_mentions.npy'), np.array(self.min_mentions, dtype=np.int64))
+    with open(os.path.join(path, 'mentions.pkl'), 'wb') as f:
+      pickle.dump(self.mentions, f)
+
+def write_page_token_corpus(cursor, page_ids, token_idx_lookup, path, chunk_size=1000, num_workers=1, min_mentions=1):
+  '''Keeps only the mentions of entities with at least `min_mentions`
+  mentions, as the dataset does when it reads pages from the db, so both
+  featurize a page's mentions the same way.'''
+  writer = PageTokenCorpusWriter(path, min_mentions=min_mentions)
+  valid_entity_ids = _get_valid_entity_ids(cursor, min_mentions)
+  for start in progressbar(range(0, len(page_ids), chunk_size)):
+    chunk = page_ids[start : start + chunk_size]
+    contents = _get_page_contents(cursor, chunk)
+    mention_infos_by_page_id = _get_mention_infos_by_page_id(cursor, chunk)
+    chunk_contents = [contents.get(page_id, '') for page_id in chunk]
+    chunk_sentence_spans = parse_batch('sentence_spans', chunk_contents, num_workers=num_workers)
+    chunk_tokens = parse_batch('text_tokens', chunk_contents, num_workers=num_workers)
+    for page_id, content, sentence_spans, tokens in zip(chunk, chunk_contents, chunk_sentence_spans, chunk_tokens):
+      page_mention_infos = [mention_info for mention_info in mention_infos_by_page_id[page_id]
+                            if valid_entity_ids is None or mention_info['entity_id'] in valid_entity_ids]
+      if len(content.strip()) > 5:
+        content_idxs = tokens_to_idxs(token_idx_lookup, tokens)
+      else:
+        content_idxs = []
+      if page_mention_infos:
+        page_mention_idxs = page_content_to_token_idxs(token_idx_lookup,
+                                                       ' '.join([mention_info['mention'] for mention_info in page_mention_infos]),
+                                                       page_mention_infos)
+      else:
+        page_mention_idxs = []
+      splits = []
+      for mention_info in page_mention_infos:
+        left_split, right_split = get_mention_sentence_splits(content, sentence_spans, mention_info)
+        splits.append((tokens_to_idxs(token_idx_lookup, left_split),
+                       tokens_to_idxs(token_idx_lookup, right_split)))
+      writer.add_page(page_id, content_idxs, page_mention_idxs, sentence_spans, page_mention_infos, splits)
+  writer.close()
+
+class PageTokenCorpus(object):
+  def __init__(self, path):
+    self._load(path)
+
+  def __getstate__(self):
+    return {'path': self.path}
+
+  def __setstate__(self, state):
+    self._load(state['path'])
+
+  def _load(self, path):
+    self.path = path
+    self._values = {}
+    self._offsets = {}
+    for name in _ragged_names:
+      self._offsets[name] = np.load(os.path.join(path, name + '_offsets.npy'))
+      if self._offsets[name][-1] == 0:
+        self._values[name] = np.zeros(0, dtype=np.int32)
+      else:
+        self._values[name] = np.memmap(os.path.join(path, name + '.bin'), dtype=np.int32, mode='r')
+    self.page_ids = np.load(os.path.join(path, 'page_ids.npy'))
+    self.page_mention_offsets = np.load(os.path.join(path, 'page_mention_offsets.npy'))
+    self.mention_ids = np.load(os.path.join(path, 'mention_ids.npy'))
+    self.mention_entity_ids = np.load(os.path.join(path, 'mention_entity_ids.npy'))
+    self.mention_char_offsets = np.load(os.path.join(path, 'mention_char_offsets.npy'))
+    min_mentions_path = os.path.join(path, 'min_mentions.npy')
+    self.min_mentions = int(np.load(min_mentions_path)) if os.path.exists(min_mentions_path) else 1
+    with open(os.path.join(path, 'mentions.pkl'), 'rb') as f:
+      self.mentions = pickle.load(f)
+    self._page_row_lookup = dict(zip(self.page_ids.tolist(), range(len(self.page_ids))))
+    self._mention_row_lookup = dict(zip(self.mention_ids.tolist(), range(len(self.mention_ids))))
+
+  def _get_row(self, name, row):
+    offsets = self._offsets[name]
+    return self._values[name][offsets[row] : offsets[row + 1]]
+
+  def _to_tensor(self, values):
+    return torch.from_numpy(values.astype(np.int32))
+
+  def has_page(self, page_id):
+    return page_id in self._page_row_lookup
+
+  def get_page_mention_infos(self, page_id):
+    page_row = self._page_row_lookup[page_id]
+    return [{'mention': self.mentions[row],
+             'page_id': page_id,
+             'entity_id': int(self.mention_entity_ids[row]),
+             'mention_id': int(self.mention_ids[row]),
+             'offset': int(self.mention_char_offsets[row])}
+            for row in range(self.page_mention_offsets[page_row], self.page_mention_offsets[page_row + 1])]
+
+  def get_page_content_token_idxs(self, page_id):
+    return self._to_tensor(self._get_row('content', self._page_row_lookup[page_id]))
+
+  def get_entity_page_mention_token_idxs(self, page_id):
+    return self._to_tensor(self._get_row('page_mentions', self._page_row_lookup[page_id]))
+
+  def get_sentence_spans(self, page_id):
+    spans = self._get_row('sentence_spans', self._page_row_lookup[page_id]).reshape(-1, 2)
+    return [tuple(span) for span in spans.tolist()]
+
+  def get_mention_lengths(self, mention_id):
+    mention_row = self._mention_row_lookup[mention_id]
+    page_row = np.searchsorted(self.page_mention_offsets, mention_row, side='right') - 1
+    split_offsets = self._offsets['splits']
+    page_mention_offsets = self._offsets['page_mentions']
+    return (int(split_offsets[2 * mention_row + 1] - split_offsets[2 * mention_row]),
+            int(split_offsets[2 * mention_row + 2] - split_offsets[2 * mention_row + 1]),
+            int(page_mention_offsets[page_row + 1] - page_mention_offsets[page_row]))
+
+  def get_sentence_split_token_idxs(self, mention_id):
+    mention_row = self._mention_row_lookup[mention_id]
+    return [self._to_tensor(self._get_row('splits', 2 * mention_row)),
+            self._to_tensor(self._get_row('splits', 2 * mention_row + 1))]
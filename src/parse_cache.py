@@ -0,0 +1,91 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+
+from utils import LRUCache
+
+def content_key(kind, text):
+  return hashlib.sha1((kind + '\0' + text).encode('utf-8')).hexdigest()
+
+class ParseCache(object):
+  '''Parse results keyed by a hash of the parser name and the text. Keeps the
+  most recent `max_size` results in memory and, when given a `path`, every
+  result in a sqlite file so later runs start warm. The connection is
+  reopened after a fork so DataLoader and pool workers can read from the
+  cache, but only the process that created it writes to the file. Reads
+  and writes hold a lock since server threads share one cache.'''
+  def __init__(self, max_size=1000, path=None, commit_every=1000):
+    self.path = path
+    self.commit_every = commit_every
+    self._memory = LRUCache(max_size)
+    self._connection = None
+    self._pid = None
+    self._owner_pid = os.getpid()
+    self._num_pending = 0
+    self._lock = threading.Lock()
+
+  def __getstate__(self):
+    return {'max_size': self._memory.max_size, 'path': self.path, 'commit_every': self.commit_every}
+
+  def __setstate__(self, state):
+    self.__init__(**state)
+
+  def _get_connection(self):
+    if self.path is None: return None
+    if self._pid != os.getpid():
+      self._connection = sqlite3.connect(self.path, check_same_thread=False)
+      self._connection.execute('create table if not exists parses (key text primary key, value blob)')
+      self._connection.commit()
+      self._pid = os.getpid()
+      self._num_pending = 0
+    return self._connection
+
+  def get(self, kind, text, default=None):
+    key = content_key(kind, text)
+    with self._lock:
+      if key in self._memory: return self._memory.get(key)
+      connection = self._get_connection()
+      if connection is None: return default
+      row = connection.execute('select value from parses where key = ?', (key,)).fetchone()
+      if row is None: return default
+      value = pickle.loads(row[0])
+      self._memory.set(key, value)
+      return value
+
+  def set(self, kind, text, value):
+    key = content_key(kind, text)
+    with self._lock:
+      self._memory.set(key, value)
+      if self._owner_pid != os.getpid(): return
+      connection = self._get_connection()
+      if connection is None: return
+      connection.execute('insert or replace into parses (key, value) values (?, ?)',
+                         (key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+      self._num_pending += 1
+      if self._num_pending >= self.commit_every: self._flush()
+
+  def get_or_compute(self, kind, text, compute):
+    value = self.get(kind, text)
+    if value is None:
+      value = compute(text)
+      self.set(kind, text, value)
+    return value
+
+  def _flush(self):
+    if self._connection is not None and self._pid == os.getpid():
+      self._connection.commit()
+      self._num_pending = 0
+
+  def flush(self):
+    with self._lock:
+      self._flush()
+
+  def close(self):
+    with self._lock:
+      self._flush()
+      if self._connection is not None and self._pid == os.getpid():
+        self._connection.close()
+      self._connection = None
+      self._pid = None
@@ -1,10 +1,12 @@
 # coding: utf-8
 
+import multiprocessing
 import re
-import pydash as _
 from nltk.data              import load
 from nltk.tokenize.treebank import TreebankWordTokenizer
 
+from profiling import stage_timer
+
 _treebank_word_tokenizer = TreebankWordTokenizer()
 
 improved_open_quote_regex = re.compile(u'([«“‘„]|[`]+)', re.U)
@@ -18,21 +20,75 @@ _treebank_word_tokenizer.STARTING_QUOTES.insert(0, (other_improved_open_quote_re
 _treebank_word_tokenizer.ENDING_QUOTES.insert(0, (other_improved_close_quote_regex, r' \1 '))
 _treebank_word_tokenizer.PUNCTUATION.insert(0, (improved_punct_regex, r'\1 \2 \3 '))
 
+_sentence_tokenizer = None
+
+def _get_sentence_tokenizer():
+  global _sentence_tokenizer
+  if _sentence_tokenizer is None:
+    _sentence_tokenizer = load('tokenizers/punkt/{0}.pickle'.format('english'))
+  return _sentence_tokenizer
+
+parse_cache = None
+
+def set_parse_cache(cache):
+  global parse_cache
+  parse_cache = cache
+
+def _sentence_spans(text):
+  return list(_get_sentence_tokenizer().span_tokenize(text))
+
+def _sentences(text):
+  return list(_get_sentence_tokenizer().tokenize(text))
+
+def _tokens(sentence):
+  return [piece
+          for token in _treebank_word_tokenizer.tokenize(sentence)
+          for piece in _split_token_on(token, '-')]
+
+def _text_tokens(text):
+  return [token for sentence in _sentences(text) for token in _tokens(sentence)]
+
+_parsers = {'sentence_spans': _sentence_spans,
+            'sentences': _sentences,
+            'text_tokens': _text_tokens}
+
+def _parse(kind, text):
+  if parse_cache is None: return _parsers[kind](text)
+  return parse_cache.get_or_compute(kind, text, _parsers[kind])
+
 def parse_for_sentence_spans(page_content):
-  tokenizer = load('tokenizers/punkt/{0}.pickle'.format('english'))
-  return list(tokenizer.span_tokenize(page_content))
+  with stage_timer.time('nltk_sentences'):
+    return _parse('sentence_spans', page_content)
 
 def parse_for_sentences(page_content):
-  tokenizer = load('tokenizers/punkt/{0}.pickle'.format('english'))
-  return list(tokenizer.tokenize(page_content))
+  with stage_timer.time('nltk_sentences'):
+    return _parse('sentences', page_content)
 
 def _split_token_on(token, char):
-  split = token.split(char)
-  return [elem for elem in _.interleave(split, [char] * (len(split) - 1)) if not _.is_empty(elem)]
+  return [elem for elem in re.split('(' + re.escape(char) + ')', token) if elem]
 
 def parse_for_tokens(sentence):
-  return sum([_split_token_on(token, '-') for token in _treebank_word_tokenizer.tokenize(sentence)], [])
+  with stage_timer.time('nltk_tokens'):
+    return _tokens(sentence)
 
 def parse_text_for_tokens(text):
-  sentences = parse_for_sentences(text)
-  return _.flatten([parse_for_tokens(sentence) for sentence in sentences])
+  with stage_timer.time('nltk_text_tokens'):
+    return _parse('text_tokens', text)
+
+def parse_batch(kind, texts, num_workers=1, chunksize=16):
+  '''Runs the `kind` parser (sentence_spans, sentences or text_tokens) over
+  `texts`, reusing cached results and spreading the rest over a pool of
+  `num_workers` processes. Each worker loads punkt once.'''
+  if kind not in _parsers: raise ValueError('Unknown parser ' + str(kind) + ', expected one of ' + ', '.join(_parsers))
+  results = [parse_cache.get(kind, text) if parse_cache is not None else None for text in texts]
+  misses = [i for i, result in enumerate(results) if result is None]
+  miss_texts = [texts[i] for i in misses]
+  if num_workers > 1 and len(miss_texts) > chunksize:
+    with multiprocessing.Pool(num_workers) as pool:
+      parsed = pool.map(_parsers[kind], miss_texts, chunksize=chunksize)
+  else:
+    parsed = [_parsers[kind](text) for text in miss_texts]
+  for i, text, result in zip(misses, miss_texts, parsed):
+    results[i] = result
+    if parse_cache is not None: parse_cache.set(kind, text, result)
+  return results
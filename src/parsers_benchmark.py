@@ -0,0 +1,88 @@
+import getopt
+import os
+import sys
+import tempfile
+import time
+
+from dotenv import load_dotenv
+from nltk.data import load
+import pydash as _
+
+from data_fetchers import fetch_by_ids, get_connection, load_page_id_order
+from parse_cache import ParseCache
+import parsers
+
+def _legacy_parse_for_sentence_spans(page_content):
+  tokenizer = load('tokenizers/punkt/{0}.pickle'.format('english'))
+  return list(tokenizer.span_tokenize(page_content))
+
+def _legacy_parse_for_sentences(page_content):
+  tokenizer = load('tokenizers/punkt/{0}.pickle'.format('english'))
+  return list(tokenizer.tokenize(page_content))
+
+def _legacy_split_token_on(token, char):
+  split = token.split(char)
+  return [elem for elem in _.interleave(split, [char] * (len(split) - 1)) if not _.is_empty(elem)]
+
+def _legacy_parse_for_tokens(sentence):
+  return sum([_legacy_split_token_on(token, '-') for token in parsers._treebank_word_tokenizer.tokenize(sentence)], [])
+
+def _legacy_parse_text_for_tokens(text):
+  return _.flatten([_legacy_parse_for_tokens(sentence) for sentence in _legacy_parse_for_sentences(text)])
+
+def _get_page_contents(cursor, page_ids):
+  contents = {row['id']: row['content']
+              for row in fetch_by_ids(cursor, 'select id, content from pages where id in ({})', page_ids)}
+  return [contents[page_id] for page_id in page_ids if page_id in contents]
+
+def _per_page(parse_for_sentence_spans, parse_text_for_tokens):
+  return lambda contents: [(parse_for_sentence_spans(content), parse_text_for_tokens(content)) for content in contents]
+
+def _batched(num_workers):
+  return lambda contents: list(zip(parsers.parse_batch('sentence_spans', contents, num_workers=num_workers),
+                                   parsers.parse_batch('text_tokens', contents, num_workers=num_workers)))
+
+def _run(name, parse_pages, contents, expected, cache=None):
+  parsers.set_parse_cache(cache)
+  start = time.perf_counter()
+  result = parse_pages(contents)
+  seconds = time.perf_counter() - start
+  if cache is not None: cache.flush()
+  parsers.set_parse_cache(None)
+  print('{}: {:.2f}s, {:.1f} pages/s, {}'.format(name,
+                                                 seconds,
+                                                 len(contents) / seconds,
+                                                 'matches legacy' if result == expected else 'DIFFERS FROM LEGACY'))
+
+def main():
+  load_dotenv(dotenv_path='.env')
+  args = dict(getopt.getopt(_.tail(sys.argv), '', ['num_pages=', 'num_workers=', 'cache_path='])[0])
+  num_pages = int(args.get('--num_pages', 1000))
+  num_workers = int(args.get('--num_workers', os.cpu_count()))
+  cache_path = args.get('--cache_path') or os.path.join(tempfile.mkdtemp(), 'parse_cache.db')
+  page_ids = load_page_id_order(os.getenv("PAGE_ID_ORDER_PATH"))[:num_pages]
+  db_connection = get_connection()
+  try:
+    with db_connection.cursor() as cursor:
+      contents = _get_page_contents(cursor, page_ids)
+  finally:
+    db_connection.close()
+  legacy = _per_page(_legacy_parse_for_sentence_spans, _legacy_parse_text_for_tokens)
+  start = time.perf_counter()
+  expected = legacy(contents)
+  seconds = time.perf_counter() - start
+  print('legacy: {:.2f}s, {:.1f} pages/s'.format(seconds, len(contents) / seconds))
+  per_page = _per_page(parsers.parse_for_sentence_spans, parsers.parse_text_for_tokens)
+  _run('punkt loaded once, no cache', per_page, contents, expected)
+  cache = ParseCache(max_size=2 * len(contents), path=cache_path)
+  _run('cold cache', per_page, contents, expected, cache)
+  _run('warm memory cache', per_page, contents, expected, cache)
+  cache.close()
+  cache = ParseCache(max_size=2 * len(contents), path=cache_path)
+  _run('warm disk cache', per_page, contents, expected, cache)
+  cache.close()
+  _run('batch, {} workers'.format(num_workers), _batched(num_workers), contents, expected)
+
+
+if __name__ == "__main__":
+  main()
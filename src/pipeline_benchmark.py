@@ -0,0 +1,171 @@
+import getopt
+import json
+import sys
+import tempfile
+import time
+
+import pydash as _
+import torch
+import torch.nn as nn
+
+from candidate_table import CandidateMentionSim
+from data_transformers import embed_and_pack_batch
+from inference import predict_deep_el
+from mention_context_dataset import MentionContextDataset
+from synthetic_corpus import calc_loss, get_calc_logits, get_synthetic_model, write_synthetic_corpus
+from tester import collate_deep_el as collate_deep_el_with_prior
+from trainer import collate_deep_el
+
+local_encoder_variants = {'lstm': {'use_lstm_local': True, 'use_cnn_local': False},
+                          'cnn': {'use_lstm_local': False, 'use_cnn_local': True},
+                          'bag': {'use_lstm_local': False, 'use_cnn_local': False}}
+
+def _timed(fn):
+  start = time.perf_counter()
+  result = fn()
+  return result, time.perf_counter() - start
+
+def _result(stage, batch_size, num_mentions, seconds, **details):
+  return _.assign({'stage': stage,
+                   'batch_size': batch_size,
+                   'num_mentions': num_mentions,
+                   'seconds': seconds,
+                   'mentions_per_sec': num_mentions / seconds if seconds > 0 else None},
+                  details)
+
+def _get_dataset(corpus, word_embedding, batch_size, num_candidates):
+  return MentionContextDataset(None,
+                               corpus['page_id_order'],
+                               corpus['entity_candidates_prior'],
+                               corpus['entity_label_lookup'],
+                               word_embedding,
+                               corpus['token_idx_lookup'],
+                               batch_size,
+                               corpus['num_entities'],
+                               num_candidates,
+                               page_token_corpus=corpus['page_token_corpus'],
+                               candidate_mention_sim=CandidateMentionSim(corpus['entity_text_by_label']),
+                               page_mention_counts=corpus['page_mention_counts'])
+
+def _get_model(corpus, word_embedding, args, variant):
+  torch.manual_seed(0)
+  return get_synthetic_model(corpus['num_entities'],
+                             word_embedding,
+                             args['embed_len'],
+                             lstm_size=args['lstm_size'],
+                             num_lstm_layers=args['num_lstm_layers'],
+                             use_lstm_local=local_encoder_variants[variant]['use_lstm_local'],
+                             num_cnn_local_filters=args['num_cnn_local_filters'],
+                             use_cnn_local=local_encoder_variants[variant]['use_cnn_local'],
+                             pad_token_idx=corpus['token_idx_lookup']['<PAD>'])
+
+def _bench_model(model, token_idx_lookup, batches, batch_size, variant):
+  optimizer = torch.optim.Adam(param for param in model.parameters() if param.requires_grad)
+  calc_logits = get_calc_logits(model)
+  forward_seconds = 0
+  backward_seconds = 0
+  for batch in batches:
+    model.train()
+    optimizer.zero_grad()
+    start = time.perf_counter()
+    labels = (batch['label'].unsqueeze(1) == batch['candidate_ids']).nonzero()[:, 1]
+    left_splits, right_splits = embed_and_pack_batch(model.word_embedding,
+                                                     token_idx_lookup,
+                                                     batch['sentence_splits'])
+    encoded = model.encoder(((left_splits, right_splits),
+                             batch['page_content'],
+                             batch['entity_page_mentions']))
+    scores = model.calc_scores(calc_logits(encoded, batch['candidate_ids']),
+                               batch['candidate_mention_sim'])
+    loss = calc_loss(scores, labels)
+    forward_seconds += time.perf_counter() - start
+    start = time.perf_counter()
+    loss.backward()
+    optimizer.step()
+    backward_seconds += time.perf_counter() - start
+  num_mentions = sum(len(batch['label']) for batch in batches)
+  return [_result('forward', batch_size, num_mentions, forward_seconds, variant=variant),
+          _result('backward_and_step', batch_size, num_mentions, backward_seconds, variant=variant)]
+
+def _bench_predict(model, token_idx_lookup, batches, batch_size, variant):
+  def run():
+    with torch.no_grad():
+      for batch in batches:
+        predict_deep_el(model.word_embedding,
+                        token_idx_lookup,
+                        batch['p_prior'],
+                        model,
+                        batch,
+                        ['prior', 'local_context', 'document_context'],
+                        model.entity_embeds)
+  __, seconds = _timed(run)
+  return [_result('predict_deep_el', batch_size, sum(len(batch['label']) for batch in batches), seconds, variant=variant)]
+
+def run_benchmarks(corpus, args):
+  torch.manual_seed(0)
+  word_embedding = nn.Embedding.from_pretrained(torch.randn(len(corpus['token_idx_lookup']), args['word_embed_len']))
+  token_idx_lookup = corpus['token_idx_lookup']
+  mention_ids = corpus['page_token_corpus'].mention_ids.tolist()
+  results = []
+  for batch_size in args['batch_sizes']:
+    num_mentions = min(batch_size * args['num_batches'], len(mention_ids))
+    dataset = _get_dataset(corpus, word_embedding, batch_size, args['num_candidates'])
+    samples, seconds = _timed(lambda: [dataset[mention_id] for mention_id in mention_ids[:num_mentions]])
+    results.append(_result('dataset_getitem', batch_size, num_mentions, seconds))
+    sample_batches = [samples[start : start + batch_size] for start in range(0, len(samples), batch_size)]
+    batches, seconds = _timed(lambda: [collate_deep_el(batch) for batch in sample_batches])
+    results.append(_result('collate_deep_el', batch_size, num_mentions, seconds))
+    __, seconds = _timed(lambda: [embed_and_pack_batch(word_embedding, token_idx_lookup, batch['sentence_splits'])
+                                  for batch in batches])
+    results.append(_result('embed_and_pack_batch', batch_size, num_mentions, seconds))
+    test_batches = [collate_deep_el_with_prior(batch) for batch in sample_batches]
+    for variant in args['variants']:
+      model = _get_model(corpus, word_embedding, args, variant)
+      results.extend(_bench_model(model, token_idx_lookup, batches, batch_size, variant))
+      results.extend(_bench_predict(model, token_idx_lookup, test_batches, batch_size, variant))
+  return results
+
+def main():
+  args = dict(getopt.getopt(_.tail(sys.argv),
+                            '',
+                            ['output=', 'corpus_path=', 'batch_sizes=', 'num_batches=', 'variants=',
+                             'num_pages=', 'mentions_per_page=', 'num_entities=', 'vocab_size=',
+                             'num_candidates=', 'embed_len=', 'word_embed_len=', 'lstm_size=',
+                             'num_lstm_layers=', 'num_cnn_local_filters=', 'num_threads='])[0])
+  config = {'batch_sizes': [int(batch_size) for batch_size in args.get('--batch_sizes', '32,100').split(',')],
+            'num_batches': int(args.get('--num_batches', 10)),
+            'variants': args.get('--variants', 'lstm,cnn,bag').split(','),
+            'num_pages': int(args.get('--num_pages', 200)),
+            'mentions_per_page': int(args.get('--mentions_per_page', 10)),
+            'num_entities': int(args.get('--num_entities', 10000)),
+            'vocab_size': int(args.get('--vocab_size', 20000)),
+            'num_candidates': int(args.get('--num_candidates', 30)),
+            'embed_len': int(args.get('--embed_len', 100)),
+            'word_embed_len': int(args.get('--word_embed_len', 100)),
+            'lstm_size': int(args.get('--lstm_size', 100)),
+            'num_lstm_layers': int(args.get('--num_lstm_layers', 2)),
+            'num_cnn_local_filters': int(args.get('--num_cnn_local_filters', 50)),
+            'num_threads': int(args.get('--num_threads', torch.get_num_threads()))}
+  for variant in config['variants']:
+    if variant not in local_encoder_variants: raise ValueError('Unknown local encoder variant ' + variant)
+  torch.set_num_threads(config['num_threads'])
+  corpus_path = args.get('--corpus_path') or tempfile.mkdtemp()
+  corpus = write_synthetic_corpus(corpus_path,
+                                  num_pages=config['num_pages'],
+                                  mentions_per_page=config['mentions_per_page'],
+                                  num_entities=config['num_entities'],
+                                  vocab_size=config['vocab_size'])
+  report = {'config': config,
+            'torch_version': torch.__version__,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': run_benchmarks(corpus, config)}
+  output = json.dumps(report, indent=2)
+  if '--output' in args:
+    with open(args['--output'], 'w') as f:
+      f.write(output)
+  else:
+    print(output)
+
+
+if __name__ == "__main__":
+  main()
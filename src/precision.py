@@ -0,0 +1,21 @@
+import contextlib
+
+import torch
+
+precisions = ['float32', 'bfloat16', 'float16']
+
+def get_autocast(device, precision):
+  if precision not in precisions:
+    raise ValueError('Unknown precision ' + str(precision) + ', expected one of ' + ', '.join(precisions))
+  if precision == 'float32': return contextlib.nullcontext()
+  if precision == 'float16' and device.type != 'cuda':
+    raise ValueError('float16 autocast needs a cuda device, use bfloat16 on cpu')
+  return torch.autocast(device_type=device.type, dtype=getattr(torch, precision))
+
+def get_grad_scaler(device, precision):
+  '''Only float16 needs loss scaling, other precisions step without a scaler.'''
+  if precision != 'float16': return None
+  return torch.amp.GradScaler(device.type)
+
+def full_precision(device_type):
+  return torch.autocast(device_type=device_type, enabled=False)
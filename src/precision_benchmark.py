@@ -0,0 +1,131 @@
+import getopt
+import multiprocessing
+import resource
+import sys
+
+import numpy as np
+import pydash as _
+import torch
+import torch.nn as nn
+
+from inference import predict
+from precision import precisions
+from synthetic_corpus import calc_loss, get_calc_logits, get_synthetic_model
+from tester import collate_deep_el
+from trainer import Trainer
+
+class _StepTimes(object):
+  def __init__(self):
+    self.step_times = []
+
+  def update_epoch(self, epoch_num): pass
+
+  def record_metrics(self, metrics, batch_num=None):
+    self.step_times.append(metrics['step_time'])
+
+def _get_samples(num_samples, num_entities, num_candidates, vocab_size, seed):
+  generator = torch.Generator().manual_seed(seed)
+  rand_idxs = lambda length: torch.randint(1, vocab_size, (length,), generator=generator, dtype=torch.int32)
+  rand_len = lambda low, high: int(torch.randint(low, high, (1,), generator=generator))
+  samples = []
+  for i in range(num_samples):
+    candidate_ids = torch.randperm(num_entities, generator=generator)[:num_candidates]
+    label_position = rand_len(0, num_candidates)
+    candidate_mention_sim = torch.rand(num_candidates, generator=generator)
+    candidate_mention_sim[label_position] += 0.5
+    samples.append({'sentence_splits': [rand_idxs(rand_len(1, 30)), rand_idxs(rand_len(1, 30))],
+                    'label': int(candidate_ids[label_position]),
+                    'page_content': rand_idxs(rand_len(10, 200)),
+                    'entity_page_mentions': rand_idxs(rand_len(1, 100)),
+                    'candidate_ids': candidate_ids,
+                    'p_prior': torch.zeros(num_candidates),
+                    'candidate_mention_sim': candidate_mention_sim.tolist()})
+  return samples
+
+def _get_model(args):
+  torch.manual_seed(0)
+  word_embedding = nn.Embedding(args['vocab_size'], args['word_embed_len'], padding_idx=0)
+  word_embedding.weight.requires_grad = False
+  return get_synthetic_model(args['num_entities'], word_embedding, args['embed_len'])
+
+def _run(precision, args, results):
+  torch.set_num_threads(args['num_threads'])
+  device = torch.device('cpu')
+  model = _get_model(args)
+  train_samples = _get_samples(args['num_batches'] * args['batch_size'], args['num_entities'], args['num_candidates'], args['vocab_size'], 1)
+  test_samples = _get_samples(args['num_test'], args['num_entities'], args['num_candidates'], args['vocab_size'], 2)
+  step_times = _StepTimes()
+  trainer = Trainer(device=device,
+                    embedding=model.word_embedding,
+                    token_idx_lookup={'<PAD>': 0},
+                    model=model,
+                    get_dataset=lambda: train_samples,
+                    get_batch_sampler=lambda: [list(range(start, start + args['batch_size']))
+                                               for start in range(0, len(train_samples), args['batch_size'])],
+                    num_epochs=1,
+                    experiment=step_times,
+                    calc_loss=calc_loss,
+                    calc_logits=get_calc_logits(model),
+                    logits_and_softmax=None,
+                    adaptive_logits={'desc': None, 'mention': None},
+                    use_adaptive_softmax=False,
+                    clip_grad=0.01,
+                    precision=precision)
+  trainer.train()
+  with torch.no_grad():
+    batch = collate_deep_el(test_samples)
+    predictions = predict(embedding=model.word_embedding,
+                          token_idx_lookup={'<PAD>': 0},
+                          p_prior=batch['p_prior'],
+                          model=model,
+                          batch=batch,
+                          ablation=['prior', 'local_context', 'document_context'],
+                          entity_embeds=model.entity_embeds,
+                          precision=precision)
+  labels = (batch['label'].unsqueeze(1) == batch['candidate_ids']).nonzero()[:, 1]
+  results.put({'precision': precision,
+               'step_time_ms': 1000 * float(np.median(step_times.step_times[args['num_warmup']:])),
+               'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+               'accuracy': float((predictions == labels).float().mean()),
+               'predictions': predictions.tolist()})
+
+def main():
+  args = dict(getopt.getopt(_.tail(sys.argv),
+                            '',
+                            ['precisions=', 'batch_size=', 'num_batches=', 'num_warmup=', 'num_test=',
+                             'num_entities=', 'num_candidates=', 'vocab_size=', 'embed_len=',
+                             'word_embed_len=', 'num_threads='])[0])
+  args = {'precisions': args.get('--precisions', 'float32,bfloat16').split(','),
+          'batch_size': int(args.get('--batch_size', 100)),
+          'num_batches': int(args.get('--num_batches', 20)),
+          'num_warmup': int(args.get('--num_warmup', 3)),
+          'num_test': int(args.get('--num_test', 1000)),
+          'num_entities': int(args.get('--num_entities', 10000)),
+          'num_candidates': int(args.get('--num_candidates', 30)),
+          'vocab_size': int(args.get('--vocab_size', 20000)),
+          'embed_len': int(args.get('--embed_len', 100)),
+          'word_embed_len': int(args.get('--word_embed_len', 100)),
+          'num_threads': int(args.get('--num_threads', torch.get_num_threads()))}
+  for precision in args['precisions']:
+    if precision not in precisions: raise ValueError('Unknown precision ' + precision)
+  context = multiprocessing.get_context('spawn')
+  results = []
+  for precision in args['precisions']:
+    queue = context.Queue()
+    process = context.Process(target=_run, args=(precision, args, queue))
+    process.start()
+    results.append(queue.get())
+    process.join()
+  baseline = results[0]['predictions']
+  for result in results:
+    agreement = np.mean(np.array(result['predictions']) == np.array(baseline))
+    print('{}: step {:.1f}ms, peak rss {:.0f}MB, accuracy {:.3f}, agreement with {} {:.3f}'.format(result['precision'],
+                                                                                                 result['step_time_ms'],
+                                                                                                 result['peak_rss_mb'],
+                                                                                                 result['accuracy'],
+                                                                                                 results[0]['precision'],
+                                                                                                 agreement))
+
+
+if __name__ == "__main__":
+  main()
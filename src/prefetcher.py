@@ -0,0 +1,50 @@
+import queue
+import threading
+import time
+
+from profiling import stage_timer
+
+class Prefetcher(object):
+  def __init__(self, produce, depth=1):
+    self.produce = produce
+    self.depth = depth
+    self._queue = queue.Queue(maxsize=depth)
+    self._lock = threading.Lock()
+    self._producer_stall_time = 0.0
+    self._consumer_wait_time = 0.0
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+
+  def _put(self, item):
+    start = time.perf_counter()
+    self._queue.put(item)
+    with self._lock:
+      self._producer_stall_time += time.perf_counter() - start
+
+  def _run(self):
+    try:
+      while True:
+        item = self.produce()
+        self._put((item, None))
+        if item is None: return
+    except Exception as error: # pylint: disable=broad-except
+      self._put((None, error))
+
+  def get(self):
+    start = time.perf_counter()
+    item, error = self._queue.get()
+    elapsed = time.perf_counter() - start
+    stage_timer.record('prefetch_wait', elapsed)
+    with self._lock:
+      self._consumer_wait_time += elapsed
+    if error is not None: raise error
+    if item is None: self._queue.put((None, None))
+    return item
+
+  def get_metrics(self):
+    with self._lock:
+      metrics = {'producer_stall_time': self._producer_stall_time,
+                 'consumer_wait_time': self._consumer_wait_time}
+      self._producer_stall_time = 0.0
+      self._consumer_wait_time = 0.0
+    return metrics
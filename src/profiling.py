@@ -0,0 +1,131 @@
+import contextlib
+import cProfile
+import pstats
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+import torch
+
+_null_context = contextlib.nullcontext()
+
+class _Timing(object):
+  def __init__(self, stage_timer, name):
+    self.stage_timer = stage_timer
+    self.name = name
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *args):
+    self.stage_timer.record(self.name, time.perf_counter() - self.start)
+
+class StageTimer(object):
+  '''Collects per stage wall times and counters. Disabled by default, in
+  which case `time` hands back a shared no-op context.'''
+  def __init__(self, enabled=False, max_samples=100000):
+    self.enabled = enabled
+    self.max_samples = max_samples
+    self._lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    with self._lock:
+      self._totals = defaultdict(float)
+      self._num_calls = defaultdict(int)
+      self._samples = defaultdict(list)
+      self._counters = defaultdict(int)
+
+  def time(self, name):
+    if not self.enabled: return _null_context
+    return _Timing(self, name)
+
+  def record(self, name, elapsed):
+    if not self.enabled: return
+    with self._lock:
+      self._totals[name] += elapsed
+      self._num_calls[name] += 1
+      if len(self._samples[name]) < self.max_samples: self._samples[name].append(elapsed)
+
+  def count(self, name, num=1):
+    if not self.enabled: return
+    with self._lock:
+      self._counters[name] += num
+
+  def report(self):
+    with self._lock:
+      stages = {}
+      for name, total in self._totals.items():
+        samples = np.array(self._samples[name])
+        stages[name] = {'num_calls': self._num_calls[name],
+                        'total': total,
+                        'mean': total / self._num_calls[name],
+                        'p50': float(np.percentile(samples, 50)),
+                        'p90': float(np.percentile(samples, 90)),
+                        'p99': float(np.percentile(samples, 99))}
+      return {'stages': stages, 'counters': dict(self._counters)}
+
+stage_timer = StageTimer()
+
+def timed_call(name, fn, *args):
+  with stage_timer.time(name):
+    return fn(*args)
+
+def timed_iter(name, iterable):
+  iterator = iter(iterable)
+  while True:
+    with stage_timer.time(name):
+      item = next(iterator, None)
+    if item is None: return
+    yield item
+
+class ProfileWindow(object):
+  '''Runs torch.profiler or cProfile for batches `start_batch` to
+  `end_batch` inclusive and writes the result next to `path`.'''
+  def __init__(self, start_batch, end_batch, profiler, path, log=print):
+    if profiler not in ['torch', 'cprofile']:
+      raise ValueError('Unknown profiler ' + str(profiler) + ', expected torch or cprofile')
+    self.start_batch = start_batch
+    self.end_batch = end_batch
+    self.profiler = profiler
+    self.path = path
+    self.log = log
+    self._profile = None
+    self._done = False
+
+  def _start(self):
+    if self.profiler == 'torch':
+      activities = [torch.profiler.ProfilerActivity.CPU]
+      if torch.cuda.is_available(): activities.append(torch.profiler.ProfilerActivity.CUDA)
+      self._profile = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True)
+      self._profile.__enter__()
+    else:
+      self._profile = cProfile.Profile()
+      self._profile.enable()
+
+  def _stop(self):
+    if self.profiler == 'torch':
+      self._profile.__exit__(None, None, None)
+      self._profile.export_chrome_trace(self.path + '.json')
+      self.log(self._profile.key_averages().table(sort_by='self_cpu_time_total', row_limit=30))
+    else:
+      self._profile.disable()
+      self._profile.dump_stats(self.path + '.prof')
+      pstats.Stats(self._profile).sort_stats('cumulative').print_stats(30)
+    self._profile = None
+    self._done = True
+
+  def step(self, batch_num):
+    if batch_num == self.start_batch and self._profile is None and not self._done:
+      self._start()
+    elif batch_num == self.end_batch + 1 and self._profile is not None:
+      self._stop()
+
+  def close(self):
+    if self._profile is not None: self._stop()
+
+def parse_batch_range(batch_range):
+  start, end = batch_range.split(',')
+  return int(start), int(end)
@@ -1,5 +1,6 @@
 from typing import Optional
 import math
+import os
 from collections import defaultdict
 
 from experiment import Experiment
@@ -10,20 +11,26 @@ import torch.nn as nn
 from torch.nn.modules.adaptive import AdaptiveLogSoftmaxWithLoss
 from torch.utils.data.sampler import BatchSampler, RandomSampler
 
-from data_fetchers import get_connection, get_embedding_dict, get_num_entities, load_page_id_order, load_entity_candidate_ids_and_label_lookup, get_entity_text
+from data_fetchers import get_connection, get_embedding_store, get_num_entities, load_page_id_order, load_entity_candidate_ids_and_label_lookup, get_entity_text, get_page_mention_counts, query_timer
 from default_params import default_train_params, default_model_params, default_run_params, default_paths
 from joint_model import JointModel, SimpleJointModel
 from logits import Logits
 from mention_context_batch_sampler import MentionContextBatchSampler
 from mention_context_dataset import MentionContextDataset
+from candidate_table import CandidateTable, CandidateMentionSim
+from checkpoint import Checkpointer, load_checkpoint, load_model_state
+from page_token_corpus import PageTokenCorpus
+from profiling import ProfileWindow, parse_batch_range, stage_timer
 from softmax import Softmax
 from tester import Tester
 from trainer import Trainer
-from parsers import parse_for_tokens
-from data_transformers import pad_batch_list
+from parse_cache import ParseCache
+from parsers import parse_for_tokens, set_parse_cache
+from data_transformers import pad_batch_list_to_tensor
 from conll_dataset import CoNLLDataset
 from wiki2vec_context_encoder import ContextEncoder
 from wiki2vec_helpers import load_wiki2vec
+from entity_index import build_entity_index, load_entity_index
 
 from fire_extinguisher import BatchRepeater
 
@@ -39,6 +46,9 @@ class Runner(object):
     self.run_params = m().update(default_run_params).update(run_params)
     self.paths = m().update(default_paths).update(paths)
     self.experiment = Experiment(self.train_params.update(self.run_params).update(self.model_params))
+    stage_timer.enabled = self.run_params.profile_stages
+    self.parse_cache = ParseCache(path=self.paths.parse_cache)
+    set_parse_cache(self.parse_cache)
     self.log = self.experiment.log
     self.lookups = m()
     self.device = device
@@ -59,6 +69,7 @@ class Runner(object):
     self.use_conll = self.run_params.use_conll
     self.context_encoder = None
     self.wiki2vec = None
+    self._page_mention_counts = {}
 
   def _get_word_embedding_path(self):
     dim = self.model_params.word_embed_len
@@ -74,6 +85,21 @@ class Runner(object):
     return [row['entity_id'] for row in sorted_rows]
 
   def load_caches(self, cursor):
+    self.load_entity_caches(cursor)
+    self.log.status('Getting page id order')
+    self.page_id_order = load_page_id_order(self.paths.page_id_order)
+    self.num_train_pages = int(len(self.page_id_order) * self.train_params.train_size)
+    self.page_id_order_train = self.page_id_order[:self.num_train_pages]
+    self.page_id_order_test = self.page_id_order[self.num_train_pages:]
+    if self.paths.page_token_corpus is not None:
+      self.log.status('Loading page token corpus')
+      page_token_corpus = PageTokenCorpus(self.paths.page_token_corpus)
+      if page_token_corpus.min_mentions != self.train_params.min_mentions:
+        raise ValueError('Page token corpus was built with min_mentions={}, rebuild it with --min_mentions={}'.format(page_token_corpus.min_mentions,
+                                                                                                                    self.train_params.min_mentions))
+      self.lookups = self.lookups.set('page_token_corpus', page_token_corpus)
+
+  def load_entity_caches(self, cursor, get_entity_text_fn=get_entity_text):
     self.log.status('Loading entity candidate_ids lookup')
     lookups = load_entity_candidate_ids_and_label_lookup(self.paths.lookups, self.train_params.train_size)
     if not hasattr(self.model_params, 'num_entities'):
@@ -94,41 +120,42 @@ class Runner(object):
         lookups = {'entity_candidates_prior': new_prior, 'entity_labels': new_labels}
       self.model_params = self.model_params.set('num_entities',
                                                 len(lookups['entity_labels']))
+    self.log.status('Building candidate table')
+    self.lookups = self.lookups.set('candidate_table',
+                                    CandidateTable(lookups['entity_candidates_prior']))
     self.log.status('Loading word embedding lookup')
-    embedding_dict = get_embedding_dict(self.paths.word_embedding,
-                                        embedding_dim=self.model_params.word_embed_len)
-    token_idx_lookup = dict(zip(embedding_dict.keys(),
-                                range(len(embedding_dict))))
-    embedding = nn.Embedding.from_pretrained(torch.stack([embedding_dict[token] for token in token_idx_lookup]).to(self.device),
+    token_idx_lookup, embedding_weights = get_embedding_store(self.paths.word_embedding,
+                                                              embedding_dim=self.model_params.word_embed_len)
+    embedding = nn.Embedding.from_pretrained(embedding_weights.to(self.device),
                                              freeze=self.model_params.freeze_word_embeddings)
     self.lookups = self.lookups.update({'entity_candidates_prior': lookups['entity_candidates_prior'],
                                         'entity_labels': lookups['entity_labels'],
                                         'embedding': embedding,
                                         'token_idx_lookup': token_idx_lookup})
-    self.log.status('Getting page id order')
-    self.page_id_order = load_page_id_order(self.paths.page_id_order)
-    self.num_train_pages = int(len(self.page_id_order) * self.train_params.train_size)
-    self.page_id_order_train = self.page_id_order[:self.num_train_pages]
-    self.page_id_order_test = self.page_id_order[self.num_train_pages:]
+    self.log.status('Loading entity text')
+    entity_text_by_label = self._get_entity_text_by_label(self.model_params.num_entities,
+                                                          get_entity_text_fn)
+    self.lookups = self.lookups.update({'entity_text_by_label': entity_text_by_label,
+                                        'candidate_mention_sim': CandidateMentionSim(entity_text_by_label)})
+
+  def _get_entity_text_by_label(self, num_entities, get_entity_text_fn=get_entity_text):
+    entity_text_by_label = [None] * num_entities
+    for entity_id, text in get_entity_text_fn().items():
+      if entity_id in self.lookups.entity_labels:
+        entity_text_by_label[self.lookups.entity_labels[entity_id]] = text
+    return entity_text_by_label
 
   def _get_entity_tokens(self, num_entities):
     mapper = lambda token: self.lookups.token_idx_lookup[token] if token in self.lookups.token_idx_lookup else self.lookups.token_idx_lookup['<UNK>']
-    entity_indexed_tokens = {self.lookups.entity_labels[entity_id]: _.map_(parse_for_tokens(text), mapper)
-                             for entity_id, text in get_entity_text().items()
-                             if entity_id in self.lookups.entity_labels}
-    entity_indexed_tokens_list = [entity_indexed_tokens[i]
-                                  if i in entity_indexed_tokens else [1]
-                                  for i in range(num_entities)]
-    return torch.tensor(pad_batch_list(0, entity_indexed_tokens_list),
-                        device=self.device)
+    entity_indexed_tokens_list = [_.map_(parse_for_tokens(text), mapper)
+                                  if text is not None else [1]
+                                  for text in self.lookups.entity_text_by_label[:num_entities]]
+    return pad_batch_list_to_tensor(0, entity_indexed_tokens_list).to(self.device)
 
   def _get_entity_wikivecs(self, num_entities):
-    vecs_by_label = {self.lookups.entity_labels[entity_id]: self.wiki2vec.get_entity_vector(text)
-                     for entity_id, text in get_entity_text().items()
-                     if entity_id in self.lookups.entity_labels}
-    vecs_in_order = [vecs_by_label[i]
-                     if i in vecs_by_label else torch.randn(self.model_params.embed_len)
-                     for i in range(num_entities)]
+    vecs_in_order = [self.wiki2vec.get_entity_vector(text)
+                     if text is not None else torch.randn(self.model_params.embed_len)
+                     for text in self.lookups.entity_text_by_label[:num_entities]]
     return torch.tensor(vecs_in_order, device=self.device)
 
   def _sum_in_batches(self, by_token):
@@ -158,6 +185,14 @@ class Runner(object):
                                       self.model_params.embed_len,
                                       _weight=entity_embed_weights).to(self.device)
 
+  def _get_page_mention_counts(self, cursor, is_test):
+    if is_test not in self._page_mention_counts:
+      page_ids = self.page_id_order_test if is_test else self.page_id_order_train
+      self._page_mention_counts[is_test] = get_page_mention_counts(cursor,
+                                                                   page_ids,
+                                                                   self.train_params.min_mentions)
+    return self._page_mention_counts[is_test]
+
   def _get_dataset(self, cursor, is_test, use_fast_sampler=False):
     page_ids = self.page_id_order_test if is_test else self.page_id_order_train
     if self.use_conll:
@@ -167,7 +202,10 @@ class Runner(object):
                           self.lookups.token_idx_lookup,
                           self.model_params.num_entities,
                           self.model_params.num_candidates,
-                          self.lookups.entity_labels)
+                          self.lookups.entity_labels,
+                          candidate_mention_sim=self.lookups.candidate_mention_sim,
+                          cache_path=self.paths.conll_cache,
+                          num_workers=self.train_params.num_workers)
     else:
       return MentionContextDataset(cursor,
                                    page_ids,
@@ -183,7 +221,12 @@ class Runner(object):
                                    min_mentions=self.train_params.min_mentions,
                                    use_fast_sampler=use_fast_sampler,
                                    use_wiki2vec=self.model_params.use_wiki2vec,
-                                   start_from_page_num=self.train_params.start_from_page_num)
+                                   start_from_page_num=self.train_params.start_from_page_num,
+                                   page_token_corpus=self.lookups.get('page_token_corpus'),
+                                   candidate_table=self.lookups.candidate_table,
+                                   candidate_mention_sim=self.lookups.candidate_mention_sim,
+                                   page_mention_counts=self._get_page_mention_counts(cursor, is_test),
+                                   prefetch_depth=0 if is_test else self.train_params.prefetch_depth)
 
   def _get_sampler(self, cursor, is_test, limit=None, use_fast_sampler=False):
     if self.use_conll:
@@ -197,7 +240,10 @@ class Runner(object):
                                         self.train_params.batch_size,
                                         self.train_params.min_mentions,
                                         limit=limit,
-                                        use_fast_sampler=use_fast_sampler)
+                                        use_fast_sampler=use_fast_sampler,
+                                        yield_page_ids=not is_test and (self.train_params.num_workers > 0 or self.train_params.bucket_window > 0),
+                                        bucket_window=0 if is_test else self.train_params.bucket_window,
+                                        page_token_corpus=self.lookups.get('page_token_corpus'))
 
   def _calc_logits(self, encoded, candidate_entity_ids):
     if self.model_params.use_wiki2vec:
@@ -249,9 +295,46 @@ class Runner(object):
                             adaptive_logits=self.adaptive_logits,
                             use_adaptive_softmax=self.model_params.use_adaptive_softmax,
                             clip_grad=self.train_params.clip_grad,
-                            use_wiki2vec=self.model_params.use_wiki2vec)
+                            use_wiki2vec=self.model_params.use_wiki2vec,
+                            num_workers=self.train_params.num_workers,
+                            record_prefetch_metrics=self._use_prefetch(),
+                            checkpointer=Checkpointer(self._get_checkpoint_path(),
+                                                      self.train_params.checkpoint_every),
+                            resume_state=self._get_resume_state(),
+                            eval_every=self.train_params.eval_every,
+                            precision=self.train_params.precision,
+                            profile_window=self._get_profile_window())
     return self._trainer
 
+  def _get_profile_window(self):
+    if self.run_params.profile_batches is None: return None
+    start_batch, end_batch = parse_batch_range(self.run_params.profile_batches)
+    return ProfileWindow(start_batch,
+                         end_batch,
+                         self.run_params.profiler,
+                         './profile_' + self.experiment.run_name,
+                         log=self.log.status)
+
+  def _record_stages(self):
+    if not self.run_params.profile_stages: return
+    self.experiment.record_stages(_.assign(stage_timer.report(), {'queries': query_timer.report()}))
+    stage_timer.reset()
+
+  def _get_checkpoint_path(self):
+    return './' + self.experiment.model_name + '_checkpoint'
+
+  def _get_resume_state(self):
+    if not self.run_params.resume: return None
+    resume_state = load_checkpoint(self._get_checkpoint_path(), self.device)
+    if resume_state is None:
+      self.log.status('No checkpoint to resume from, starting from scratch')
+    else:
+      self.log.status('Resuming from epoch ' + str(resume_state['epoch_num']) + ' batch ' + str(resume_state['batch_num'] + 1))
+    return resume_state
+
+  def _use_prefetch(self):
+    return self.train_params.prefetch_depth > 0 and self.train_params.num_workers == 0 and not self.use_conll
+
   def _get_logits_and_softmax(self):
     def get_calc(context):
       if self.model_params.use_adaptive_softmax:
@@ -265,6 +348,16 @@ class Runner(object):
       return calc
     return {context: get_calc(context) for context in ['desc', 'mention']}
 
+  def _get_entity_index(self):
+    path = './' + self.experiment.model_name + '_entity_index'
+    entity_index = load_entity_index(path, self.entity_embeds.weight) if os.path.exists(path) else None
+    if entity_index is not None: return entity_index
+    self.log.status('Building entity index')
+    entity_index = build_entity_index(self.entity_embeds.weight,
+                                      num_probe=self.run_params.entity_index_num_probe)
+    entity_index.save(path)
+    return entity_index
+
   def _get_tester(self, cursor, model):
     logits_and_softmax = self._get_logits_and_softmax()
     test_dataset = self._get_dataset(cursor, is_test=True)
@@ -280,7 +373,12 @@ class Runner(object):
                   experiment=self.experiment,
                   ablation=self.model_params.ablation,
                   use_adaptive_softmax=self.model_params.use_adaptive_softmax,
-                  use_wiki2vec=self.model_params.use_wiki2vec)
+                  use_wiki2vec=self.model_params.use_wiki2vec,
+                  entity_index=self._get_entity_index() if self.run_params.use_entity_index else None,
+                  num_retrieved=self.run_params.num_retrieved,
+                  candidate_table=self.lookups.candidate_table,
+                  candidate_mention_sim=self.lookups.candidate_mention_sim,
+                  precision=self.train_params.precision)
 
   def _get_adaptive_calc_logits(self):
     def get_calc(context):
@@ -295,54 +393,69 @@ class Runner(object):
     calc = get_calc('desc_and_mention')
     return {context: calc for context in ['desc', 'mention']}
 
+  def _get_joint_model(self):
+    self.adaptive_logits = self._get_adaptive_calc_logits()
+    return JointModel(self.model_params.embed_len,
+                      self.model_params.context_embed_len,
+                      self.model_params.word_embed_len,
+                      self.model_params.local_encoder_lstm_size,
+                      self.model_params.document_encoder_lstm_size,
+                      self.model_params.num_lstm_layers,
+                      self.train_params.dropout_drop_prob,
+                      self.entity_embeds,
+                      self.lookups.embedding,
+                      self.lookups.token_idx_lookup['<PAD>'],
+                      self.adaptive_logits,
+                      self.model_params.use_deep_network,
+                      self.model_params.use_lstm_local,
+                      self.model_params.num_cnn_local_filters,
+                      self.model_params.use_cnn_local)
+
+  def load_model_for_inference(self, path, get_entity_text_fn=get_entity_text):
+    self.load_entity_caches(None, get_entity_text_fn)
+    self.entity_embeds = nn.Embedding(self.model_params.num_entities,
+                                      self.model_params.embed_len).to(self.device)
+    self.encoder = self._get_joint_model()
+    load_model_state(self.encoder, torch.load(path, map_location=self.device))
+    self.encoder = self.encoder.to(self.device)
+    self.encoder.eval()
+    return self.encoder
+
   def run_deep_el(self):
     try:
       db_connection = get_connection()
       with db_connection.cursor() as cursor:
         self.load_caches(cursor)
-        pad_vector = self.lookups.embedding(torch.tensor([self.lookups.token_idx_lookup['<PAD>']],
-                                                         device=self.lookups.embedding.weight.device)).squeeze()
         self.init_entity_embeds_deep_el()
         entity_ids_by_freq = self._get_entity_ids_by_freq(cursor)
         if self.model_params.use_adaptive_softmax:
           self.lookups = self.lookups.set('entity_labels',
                                           _.from_pairs(zip(entity_ids_by_freq,
                                                            range(len(entity_ids_by_freq)))))
-        self.adaptive_logits = self._get_adaptive_calc_logits()
-        self.encoder = JointModel(self.model_params.embed_len,
-                                  self.model_params.context_embed_len,
-                                  self.model_params.word_embed_len,
-                                  self.model_params.local_encoder_lstm_size,
-                                  self.model_params.document_encoder_lstm_size,
-                                  self.model_params.num_lstm_layers,
-                                  self.train_params.dropout_drop_prob,
-                                  self.entity_embeds,
-                                  self.lookups.embedding,
-                                  pad_vector,
-                                  self.adaptive_logits,
-                                  self.model_params.use_deep_network,
-                                  self.model_params.use_lstm_local,
-                                  self.model_params.num_cnn_local_filters,
-                                  self.model_params.use_cnn_local)
+        self.encoder = self._get_joint_model()
         if self.run_params.load_model:
           path = self.experiment.model_name if self.run_params.load_path is None else self.run_params.load_path
-          self.encoder.load_state_dict(torch.load(path))
+          load_model_state(self.encoder, torch.load(path))
           self.encoder = nn.DataParallel(self.encoder)
           self.encoder = self.encoder.to(self.device).module
         if self.run_params.continue_training:
           if self.model_params.use_wiki2vec:
-            fields = ['context_error', 'loss']
+            fields = ['context_error', 'loss', 'step_time']
           else:
-            fields = ['mention_context_error', 'document_context_error', 'loss']
+            fields = ['mention_context_error', 'document_context_error', 'loss', 'step_time', 'padding_ratio']
+            if self._use_prefetch(): fields += ['producer_stall_time', 'consumer_wait_time']
           with self.experiment.train(fields):
             self.log.status('Training')
             trainer = self._get_trainer(cursor, self.encoder)
             trainer.train()
             torch.save(self.encoder.state_dict(), './' + self.experiment.model_name)
+            self.log.report('query timings', query_timer.report())
+            self._record_stages()
         with self.experiment.test(['accuracy', 'TP', 'num_samples']):
           self.log.status('Testing')
           tester = self._get_tester(cursor, self.encoder)
           tester.test()
+          self._record_stages()
     finally:
       db_connection.close()
 
@@ -356,11 +469,12 @@ class Runner(object):
         self.context_encoder = ContextEncoder(self.wiki2vec, self.lookups.token_idx_lookup, self.device)
         self.encoder = SimpleJointModel(self.context_encoder)
         if not self.run_params.load_model:
-          with self.experiment.train(['error', 'loss']):
+          with self.experiment.train(['error', 'loss', 'step_time']):
             self.log.status('Training')
             trainer = self._get_trainer(cursor, self.encoder)
             trainer.train()
             torch.save(self.encoder.state_dict(), './' + self.experiment.model_name)
+            self._record_stages()
         else:
           path = self.experiment.model_name if self.run_params.load_path is None else self.run_params.load_path
           self.encoder.load_state_dict(torch.load(path))
@@ -370,9 +484,13 @@ class Runner(object):
           self.log.status('Testing')
           tester = self._get_tester(cursor, self.context_encoder)
           tester.test()
+          self._record_stages()
     finally:
       db_connection.close()
 
   def run(self):
-    if self.model_params.use_wiki2vec: self.run_wiki2vec()
-    else: self.run_deep_el()
+    try:
+      if self.model_params.use_wiki2vec: self.run_wiki2vec()
+      else: self.run_deep_el()
+    finally:
+      self.parse_cache.close()
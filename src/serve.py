@@ -0,0 +1,161 @@
+import getopt
+import json
+import os
+import pickle
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+import numpy as np
+from pyrsistent import m
+import pydash as _
+import torch
+
+from data_fetchers import get_entity_text
+from data_transformers import get_mention_sentence_splits, page_content_to_token_idx_tensor
+from inference import predict
+from micro_batcher import LatencyStats, MicroBatcher
+from parsers import parse_for_sentence_spans
+from runner import Runner
+from tester import collate_deep_el
+import utils as u
+
+class EntityLinker(object):
+  def __init__(self, runner, model):
+    self.runner = runner
+    self.model = model
+    self.lookups = runner.lookups
+    self.entity_id_lookup = {label: entity_id for entity_id, label in self.lookups.entity_labels.items()}
+
+  def featurize(self, text, mention_offsets):
+    mention_infos = [{'mention': text[offset : offset + length], 'offset': offset}
+                     for offset, length in mention_offsets]
+    if _.is_empty(mention_infos): return []
+    sentence_spans = parse_for_sentence_spans(text)
+    page_content = page_content_to_token_idx_tensor(self.lookups.token_idx_lookup, text)
+    entity_page_mentions = page_content_to_token_idx_tensor(self.lookups.token_idx_lookup,
+                                                            ' '.join([mention_info['mention'] for mention_info in mention_infos]),
+                                                            mention_infos)
+    return [{'mention': mention_info['mention'],
+             'sentence_splits': get_mention_sentence_splits(text, sentence_spans, mention_info),
+             'page_content': page_content,
+             'entity_page_mentions': entity_page_mentions}
+            for mention_info in mention_infos]
+
+  def predict_batch(self, samples):
+    mentions = [sample['mention'] for sample in samples]
+    candidate_ids, p_prior = self.lookups.candidate_table.get_batch_candidate_ids_and_p_prior(mentions,
+                                                                                             [-1] * len(mentions),
+                                                                                             self.runner.model_params.num_entities,
+                                                                                             self.runner.model_params.num_candidates)
+    batch = collate_deep_el([_.assign({'label': -1,
+                                       'candidate_ids': sample_candidate_ids,
+                                       'p_prior': sample_p_prior,
+                                       'candidate_mention_sim': self.lookups.candidate_mention_sim(sample['mention'],
+                                                                                                   sample_candidate_ids)},
+                                      sample)
+                             for sample, sample_candidate_ids, sample_p_prior in zip(samples, candidate_ids, p_prior)])
+    batch = u.tensors_to_device(batch, self.runner.device)
+    with torch.no_grad():
+      predictions = predict(embedding=self.lookups.embedding,
+                            token_idx_lookup=self.lookups.token_idx_lookup,
+                            p_prior=batch['p_prior'],
+                            model=self.model,
+                            batch=batch,
+                            ablation=self.runner.model_params.ablation,
+                            entity_embeds=self.model.entity_embeds)
+    labels = torch.gather(batch['candidate_ids'], 1, predictions.unsqueeze(1)).squeeze(1).tolist()
+    return [{'mention': mention,
+             'entity_id': self.entity_id_lookup.get(label),
+             'entity_text': self.lookups.entity_text_by_label[label]}
+            for mention, label in zip(mentions, labels)]
+
+def _get_handler(linker, batcher, stats):
+  class Handler(BaseHTTPRequestHandler):
+    def _respond(self, code, obj):
+      body = json.dumps(obj).encode('utf-8')
+      self.send_response(code)
+      self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def do_GET(self):
+      if self.path == '/stats':
+        self._respond(200, _.assign(stats.summary(),
+                                    {'mean_batch_size': float(np.mean(batcher.batch_sizes)) if batcher.batch_sizes else None}))
+      else:
+        self._respond(404, {'error': 'not found'})
+
+    def do_POST(self):
+      if self.path != '/link':
+        self._respond(404, {'error': 'not found'})
+        return
+      start = time.perf_counter()
+      try:
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        samples = linker.featurize(request['text'], request['mentions'])
+      except (ValueError, KeyError, TypeError, IndexError) as error:
+        self._respond(400, {'error': repr(error)})
+        return
+      try:
+        results = batcher.submit(samples)
+      except Exception as error: # pylint: disable=broad-except
+        self._respond(500, {'error': repr(error)})
+        return
+      stats.record(time.perf_counter() - start, len(samples))
+      self._respond(200, {'results': results})
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+      pass
+  return Handler
+
+def _get_cached_entity_text_fn(path):
+  def get_cached_entity_text():
+    if path is not None and os.path.exists(path):
+      with open(path, 'rb') as f:
+        return pickle.load(f)
+    entity_text = get_entity_text()
+    if path is not None:
+      with open(path, 'wb') as f:
+        pickle.dump(entity_text, f)
+    return entity_text
+  return get_cached_entity_text
+
+def main():
+  load_dotenv(dotenv_path='.env')
+  args = dict(getopt.getopt(_.tail(sys.argv),
+                            '',
+                            ['model_path=', 'host=', 'port=', 'max_batch_size=', 'max_latency_ms=',
+                             'entity_text_path=', 'train_size=', 'embed_len=', 'word_embed_len=',
+                             'num_candidates=', 'ablation='])[0])
+  device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+  model_params = m()
+  for name in ['embed_len', 'word_embed_len', 'num_candidates']:
+    if '--' + name in args: model_params = model_params.set(name, int(args['--' + name]))
+  if '--ablation' in args: model_params = model_params.set('ablation', args['--ablation'].split(','))
+  train_params = m(train_size=float(args.get('--train_size', 0.8)))
+  runner = Runner(device=device,
+                  paths=m(lookups=os.getenv("LOOKUPS_PATH")),
+                  train_params=train_params,
+                  model_params=model_params)
+  model = runner.load_model_for_inference(args['--model_path'],
+                                          _get_cached_entity_text_fn(args.get('--entity_text_path',
+                                                                              os.getenv("ENTITY_TEXT_PATH"))))
+  linker = EntityLinker(runner, model)
+  batcher = MicroBatcher(linker.predict_batch,
+                         max_batch_size=int(args.get('--max_batch_size', 100)),
+                         max_latency=float(args.get('--max_latency_ms', 10)) / 1000)
+  stats = LatencyStats()
+  server = ThreadingHTTPServer((args.get('--host', '127.0.0.1'), int(args.get('--port', 8000))),
+                               _get_handler(linker, batcher, stats))
+  runner.log.status('Serving on ' + str(server.server_address))
+  try:
+    server.serve_forever()
+  finally:
+    runner.log.status(json.dumps(stats.summary()))
+
+
+if __name__ == "__main__":
+  main()
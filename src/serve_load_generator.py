@@ -0,0 +1,60 @@
+import getopt
+import json
+import sys
+import threading
+import time
+import urllib.request
+
+import numpy as np
+import pydash as _
+
+_example_request = {'text': 'Barack Obama was born in Honolulu. He served as president of the United States.',
+                    'mentions': [[0, 12], [25, 8], [63, 13]]}
+
+def _post(url, request):
+  data = json.dumps(request).encode('utf-8')
+  http_request = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+  with urllib.request.urlopen(http_request) as response:
+    return json.loads(response.read())
+
+def _load_requests(path):
+  if path is None: return [_example_request]
+  with open(path) as f:
+    return [json.loads(line) for line in f if line.strip()]
+
+def run_load(url, requests, num_clients, num_requests):
+  latencies = []
+  lock = threading.Lock()
+  def client(client_num):
+    for request_num in range(client_num, num_requests, num_clients):
+      request = requests[request_num % len(requests)]
+      start = time.perf_counter()
+      _post(url + '/link', request)
+      with lock:
+        latencies.append(time.perf_counter() - start)
+  start = time.perf_counter()
+  threads = [threading.Thread(target=client, args=(client_num,)) for client_num in range(num_clients)]
+  for thread in threads: thread.start()
+  for thread in threads: thread.join()
+  elapsed = time.perf_counter() - start
+  latencies = np.array(latencies) * 1000
+  num_mentions = sum(len(requests[request_num % len(requests)]['mentions']) for request_num in range(num_requests))
+  return {'p50_ms': float(np.percentile(latencies, 50)),
+          'p99_ms': float(np.percentile(latencies, 99)),
+          'requests_per_sec': num_requests / elapsed,
+          'mentions_per_sec': num_mentions / elapsed}
+
+def main():
+  args = dict(getopt.getopt(_.tail(sys.argv), '', ['url=', 'requests_path=', 'num_clients=', 'num_requests='])[0])
+  url = args.get('--url', 'http://127.0.0.1:8000')
+  report = run_load(url,
+                    _load_requests(args.get('--requests_path')),
+                    int(args.get('--num_clients', 16)),
+                    int(args.get('--num_requests', 1000)))
+  print(json.dumps(report))
+  with urllib.request.urlopen(url + '/stats') as response:
+    print(response.read().decode('utf-8'))
+
+
+if __name__ == "__main__":
+  main()
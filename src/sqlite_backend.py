@@ -0,0 +1,81 @@
+import sqlite3
+
+def _dict_factory(cursor, row):
+  return {column[0]: value for column, value in zip(cursor.description, row)}
+
+def _to_sqlite_query(query):
+  return query.replace('%s', '?')
+
+def _to_sqlite_args(args):
+  if args is None: return ()
+  if isinstance(args, (list, tuple)): return tuple(args)
+  return (args,)
+
+class SQLiteCursor(object):
+  def __init__(self, connection):
+    self._cursor = connection.cursor()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  @property
+  def description(self):
+    return self._cursor.description
+
+  def execute(self, query, args=None):
+    if query.strip().lower().startswith('set '): return 0
+    self._cursor.execute(_to_sqlite_query(query), _to_sqlite_args(args))
+    return self._cursor.rowcount
+
+  def executemany(self, query, seq_of_args):
+    self._cursor.executemany(_to_sqlite_query(query), [_to_sqlite_args(args) for args in seq_of_args])
+    return self._cursor.rowcount
+
+  def fetchone(self):
+    return self._cursor.fetchone()
+
+  def fetchmany(self, size=None):
+    return self._cursor.fetchmany(size) if size is not None else self._cursor.fetchmany()
+
+  def fetchall(self):
+    return self._cursor.fetchall()
+
+  def close(self):
+    self._cursor.close()
+
+class SQLiteConnection(object):
+  def __init__(self, path):
+    self.path = path
+    self._connection = sqlite3.connect(path, check_same_thread=False)
+    self._connection.row_factory = _dict_factory
+
+  def cursor(self):
+    return SQLiteCursor(self._connection)
+
+  def commit(self):
+    self._connection.commit()
+
+  def close(self):
+    self._connection.close()
+
+def _get_column_type(value):
+  if isinstance(value, bool) or isinstance(value, int): return 'INTEGER'
+  if isinstance(value, float): return 'REAL'
+  if isinstance(value, bytes): return 'BLOB'
+  return 'TEXT'
+
+def create_table_for_row(cursor, table_name, row):
+  columns = [name + ' ' + _get_column_type(value) + (' PRIMARY KEY' if name == 'id' else '')
+             for name, value in row.items()]
+  cursor.execute(f'create table if not exists {table_name} ({", ".join(columns)})')
+
+def insert_rows(cursor, table_name, column_names, rows):
+  placeholders = ', '.join(['%s'] * len(column_names))
+  cursor.executemany(f'insert into {table_name} ({", ".join(column_names)}) values ({placeholders})',
+                     [[row[name] for name in column_names] for row in rows])
+
+def create_index(cursor, table_name, column_name):
+  cursor.execute(f'create index if not exists {table_name}_{column_name}_idx on {table_name} ({column_name})')
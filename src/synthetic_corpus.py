@@ -0,0 +1,127 @@
+import random
+
+import torch.nn as nn
+
+from joint_model import JointModel
+from logits import Logits
+from page_token_corpus import PageTokenCorpus, PageTokenCorpusWriter
+
+_special_tokens = ['<PAD>', '<UNK>', 'MENTION_START_HERE', 'MENTION_END_HERE', '.']
+
+def _get_token_idx_lookup(vocab_size):
+  tokens = _special_tokens + ['w' + str(i) for i in range(vocab_size)]
+  return dict(zip(tokens, range(len(tokens))))
+
+def _get_entity_texts(rand, vocab_size, num_entities):
+  entity_texts = []
+  seen = set()
+  while len(entity_texts) < num_entities:
+    text = ' '.join('w' + str(rand.randrange(vocab_size)) for i in range(rand.randint(1, 3)))
+    if text in seen: continue
+    seen.add(text)
+    entity_texts.append(text)
+  return entity_texts
+
+def write_synthetic_corpus(path,
+                           num_pages=500,
+                           mentions_per_page=10,
+                           num_entities=10000,
+                           vocab_size=20000,
+                           sentence_len=25,
+                           num_confusers=5,
+                           seed=0):
+  '''Writes a page token corpus of random sentences with one mention per
+  sentence, so the data pipeline can run without a db or NLTK. Returns the
+  lookups the runner would otherwise load.'''
+  rand = random.Random(seed)
+  token_idx_lookup = _get_token_idx_lookup(vocab_size)
+  entity_text_by_label = _get_entity_texts(rand, vocab_size, num_entities)
+  entity_candidates_prior = {}
+  for entity_id, text in enumerate(entity_text_by_label):
+    entity_candidates_prior[text] = {entity_id: rand.randint(10, 100)}
+    for confuser in rand.sample(range(num_entities), num_confusers):
+      entity_candidates_prior[text].setdefault(confuser, rand.randint(1, 20))
+  writer = PageTokenCorpusWriter(path)
+  page_mention_counts = []
+  mention_id = 0
+  for page_id in range(num_pages):
+    content = ''
+    content_idxs = []
+    sentence_spans = []
+    page_mention_infos = []
+    splits = []
+    for sentence_num in range(mentions_per_page):
+      entity_id = rand.randrange(num_entities)
+      mention_tokens = entity_text_by_label[entity_id].split(' ')
+      words = ['w' + str(rand.randrange(vocab_size)) for i in range(sentence_len)]
+      mention_position = rand.randrange(sentence_len)
+      tokens = words[:mention_position] + mention_tokens + words[mention_position:] + ['.']
+      sentence_start = len(content)
+      prefix = ' '.join(words[:mention_position])
+      page_mention_infos.append({'mention': entity_text_by_label[entity_id],
+                                 'page_id': page_id,
+                                 'entity_id': entity_id,
+                                 'mention_id': mention_id,
+                                 'offset': sentence_start + len(prefix) + (1 if prefix else 0)})
+      idxs = [token_idx_lookup[token] for token in tokens]
+      mention_end = mention_position + len(mention_tokens)
+      splits.append((idxs[:mention_end], idxs[mention_position:]))
+      content += ' '.join(tokens) + ' '
+      sentence_spans.append((sentence_start, len(content) - 1))
+      content_idxs.extend(idxs)
+      mention_id += 1
+    page_mention_idxs = []
+    for mention_info in page_mention_infos:
+      page_mention_idxs.append(token_idx_lookup['MENTION_START_HERE'])
+      page_mention_idxs.extend(token_idx_lookup[token] for token in mention_info['mention'].split(' '))
+      page_mention_idxs.append(token_idx_lookup['MENTION_END_HERE'])
+    writer.add_page(page_id, content_idxs, page_mention_idxs, sentence_spans, page_mention_infos, splits)
+    page_mention_counts.append(len(page_mention_infos))
+  writer.close()
+  return {'page_token_corpus': PageTokenCorpus(path),
+          'token_idx_lookup': token_idx_lookup,
+          'entity_candidates_prior': entity_candidates_prior,
+          'entity_label_lookup': dict(zip(range(num_entities), range(num_entities))),
+          'entity_text_by_label': entity_text_by_label,
+          'page_id_order': list(range(num_pages)),
+          'page_mention_counts': page_mention_counts,
+          'num_entities': num_entities}
+
+def get_synthetic_model(num_entities,
+                        word_embedding,
+                        embed_len,
+                        lstm_size=100,
+                        num_lstm_layers=2,
+                        use_lstm_local=False,
+                        num_cnn_local_filters=50,
+                        use_cnn_local=False,
+                        pad_token_idx=0):
+  '''The joint model the benchmarks train and time, with fresh entity
+  embeddings and no adaptive softmax.'''
+  entity_embeds = nn.Embedding(num_entities, embed_len)
+  return JointModel(embed_len,
+                    embed_len,
+                    word_embedding.embedding_dim,
+                    lstm_size,
+                    lstm_size,
+                    num_lstm_layers,
+                    0.4,
+                    entity_embeds,
+                    word_embedding,
+                    pad_token_idx,
+                    {'desc': None, 'mention': None},
+                    True,
+                    use_lstm_local,
+                    num_cnn_local_filters,
+                    use_cnn_local)
+
+def get_calc_logits(model):
+  logits = Logits()
+  def calc_logits(encoded, candidate_ids):
+    candidates = model.entity_embeds(candidate_ids)
+    return logits(encoded[0], candidates), logits(encoded[1], candidates)
+  return calc_logits
+
+def calc_loss(scores, labels):
+  criterion = nn.CrossEntropyLoss()
+  return criterion(scores[0], labels) + criterion(scores[1], labels)
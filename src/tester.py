@@ -1,15 +1,19 @@
+from functools import partial
+
 from torch.utils.data import DataLoader
 import torch
 import torch.nn as nn
 
 import utils as u
-from inference import predict
+from inference import predict, predict_deep_el_with_retrieval
 from data_transformers import pad_batch
+from profiling import stage_timer, timed_call, timed_iter
 
 def collate_deep_el(batch):
-  return {'sentence_splits': [sample['sentence_splits'] for sample in batch],
+  return {'mention': [sample.get('mention') for sample in batch],
+          'sentence_splits': [sample['sentence_splits'] for sample in batch],
           'label': torch.tensor([sample['label'] for sample in batch]),
-          'embedded_page_content': [sample['embedded_page_content'] for sample in batch],
+          'page_content': [sample['page_content'] for sample in batch],
           'entity_page_mentions': [sample['entity_page_mentions'] for sample in batch],
           'candidate_ids': torch.stack([sample['candidate_ids'] for sample in batch]),
           'p_prior': torch.stack([sample['p_prior'] for sample in batch]),
@@ -34,7 +38,12 @@ class Tester(object):
                experiment,
                ablation,
                use_adaptive_softmax,
-               use_wiki2vec=False):
+               use_wiki2vec=False,
+               entity_index=None,
+               num_retrieved=0,
+               candidate_table=None,
+               candidate_mention_sim=None,
+               precision='float32'):
     self.dataset = dataset
     self.model = nn.DataParallel(model)
     self.model = model.to(device)
@@ -47,6 +56,11 @@ class Tester(object):
     self.logits_and_softmax = logits_and_softmax
     self.use_adaptive_softmax = use_adaptive_softmax
     self.use_wiki2vec = use_wiki2vec
+    self.entity_index = entity_index
+    self.num_retrieved = num_retrieved
+    self.candidate_table = candidate_table
+    self.candidate_mention_sim = candidate_mention_sim
+    self.precision = precision
 
   def _get_labels_for_batch(self, labels, candidate_ids):
     device = labels.device
@@ -60,34 +74,52 @@ class Tester(object):
 
   def test(self):
     if self.use_wiki2vec:
-      self.test_wiki2vec()
+      return self.test_wiki2vec()
     else:
-      self.test_deep_el()
+      return self.test_deep_el()
 
   def test_deep_el(self):
     acc = 0
     n = 0
     dataloader = DataLoader(dataset=self.dataset,
                             batch_sampler=self.batch_sampler,
-                            collate_fn=collate_deep_el)
-    for batch_num, batch in enumerate(dataloader):
-      batch = u.tensors_to_device(batch, self.device)
-      labels_for_batch = self._get_labels_for_batch(batch['label'],
-                                                    batch['candidate_ids'])
-      predictions = predict(embedding=self.embedding,
-                            token_idx_lookup=self.token_idx_lookup,
-                            p_prior=0 if self.use_adaptive_softmax else batch['p_prior'],
-                            model=self.model,
-                            batch=batch,
-                            ablation=self.ablation,
-                            entity_embeds=self.model.entity_embeds,
-                            use_wiki2vec=self.use_wiki2vec)
+                            collate_fn=partial(timed_call, 'collate', collate_deep_el))
+    for batch_num, batch in enumerate(timed_iter('data_wait', dataloader)):
+      with stage_timer.time('to_device'):
+        batch = u.tensors_to_device(batch, self.device)
+      with stage_timer.time('forward'):
+        if self.entity_index is not None:
+          predictions, candidate_ids = predict_deep_el_with_retrieval(embedding=self.embedding,
+                                                                      token_idx_lookup=self.token_idx_lookup,
+                                                                      p_prior=0 if self.use_adaptive_softmax else batch['p_prior'],
+                                                                      model=self.model,
+                                                                      batch=batch,
+                                                                      ablation=self.ablation,
+                                                                      entity_embeds=self.model.entity_embeds,
+                                                                      entity_index=self.entity_index,
+                                                                      num_retrieved=self.num_retrieved,
+                                                                      candidate_table=self.candidate_table,
+                                                                      candidate_mention_sim=self.candidate_mention_sim,
+                                                                      precision=self.precision)
+        else:
+          candidate_ids = batch['candidate_ids']
+          predictions = predict(embedding=self.embedding,
+                                token_idx_lookup=self.token_idx_lookup,
+                                p_prior=0 if self.use_adaptive_softmax else batch['p_prior'],
+                                model=self.model,
+                                batch=batch,
+                                ablation=self.ablation,
+                                entity_embeds=self.model.entity_embeds,
+                                use_wiki2vec=self.use_wiki2vec,
+                                precision=self.precision)
+      labels_for_batch = self._get_labels_for_batch(batch['label'], candidate_ids)
       acc += int((labels_for_batch == predictions).sum())
       batch_size = len(predictions)
       n += batch_size
-      self.experiment.record_metrics({'accuracy': acc / n,
-                                      'TP': acc,
-                                      'num_samples': n})
+      with stage_timer.time('record_metrics'):
+        self.experiment.record_metrics({'accuracy': acc / n,
+                                        'TP': acc,
+                                        'num_samples': n})
     return acc, n
 
   def test_wiki2vec(self):
@@ -95,23 +127,27 @@ class Tester(object):
     n = 0
     dataloader = DataLoader(dataset=self.dataset,
                             batch_sampler=self.batch_sampler,
-                            collate_fn=collate_wiki2vec)
-    for batch_num, batch in enumerate(dataloader):
-      batch = u.tensors_to_device(batch, self.device)
+                            collate_fn=partial(timed_call, 'collate', collate_wiki2vec))
+    for batch_num, batch in enumerate(timed_iter('data_wait', dataloader)):
+      with stage_timer.time('to_device'):
+        batch = u.tensors_to_device(batch, self.device)
       labels_for_batch = self._get_labels_for_batch(batch['label'],
                                                     batch['candidate_ids'])
-      predictions = predict(embedding=self.embedding,
-                            token_idx_lookup=self.token_idx_lookup,
-                            p_prior=0 if self.use_adaptive_softmax else batch['p_prior'],
-                            model=self.model,
-                            batch=batch,
-                            ablation=self.ablation,
-                            entity_embeds=self.model.entity_embeds,
-                            use_wiki2vec=True)
+      with stage_timer.time('forward'):
+        predictions = predict(embedding=self.embedding,
+                              token_idx_lookup=self.token_idx_lookup,
+                              p_prior=0 if self.use_adaptive_softmax else batch['p_prior'],
+                              model=self.model,
+                              batch=batch,
+                              ablation=self.ablation,
+                              entity_embeds=self.model.entity_embeds,
+                              use_wiki2vec=True,
+                              precision=self.precision)
       acc += int((labels_for_batch == predictions).sum())
       batch_size = len(predictions)
       n += batch_size
-      self.experiment.record_metrics({'accuracy': acc / n,
-                                      'TP': acc,
-                                      'num_samples': n})
+      with stage_timer.time('record_metrics'):
+        self.experiment.record_metrics({'accuracy': acc / n,
+                                        'TP': acc,
+                                        'num_samples': n})
     return acc, n
@@ -1,4 +1,6 @@
+from functools import partial
 import itertools
+import time
 
 from torch.utils.data import DataLoader
 import torch
@@ -7,14 +9,19 @@ import torch.optim as optim
 
 import pydash as _
 
+from checkpoint import get_rng_state, set_rng_state
 from data_transformers import embed_and_pack_batch
+from mention_context_batch_sampler import MentionContextBatchSampler
+from mention_context_dataset import mention_context_worker_init_fn
+from precision import get_autocast, get_grad_scaler
+from profiling import stage_timer, timed_call, timed_iter
 
 from utils import tensors_to_device
 
 def collate_deep_el(batch):
   return {'sentence_splits': [sample['sentence_splits'] for sample in batch],
           'label': torch.tensor([sample['label'] for sample in batch]),
-          'embedded_page_content': [sample['embedded_page_content'] for sample in batch],
+          'page_content': [sample['page_content'] for sample in batch],
           'entity_page_mentions': [sample['entity_page_mentions'] for sample in batch],
           'candidate_ids': torch.stack([sample['candidate_ids'] for sample in batch]),
           'candidate_mention_sim': torch.stack([torch.tensor(sample['candidate_mention_sim']) for sample in batch])}
@@ -41,7 +48,14 @@ class Trainer(object):
                adaptive_logits,
                use_adaptive_softmax,
                clip_grad,
-               use_wiki2vec=False):
+               use_wiki2vec=False,
+               num_workers=0,
+               record_prefetch_metrics=False,
+               checkpointer=None,
+               resume_state=None,
+               eval_every=0,
+               precision='float32',
+               profile_window=None):
     self.device = device
     self.model = nn.DataParallel(model)
     self.model = model.to(self.device)
@@ -59,6 +73,15 @@ class Trainer(object):
     self.use_adaptive_softmax = use_adaptive_softmax
     self.clip_grad = clip_grad
     self.use_wiki2vec = use_wiki2vec
+    self.num_workers = num_workers
+    self.record_prefetch_metrics = record_prefetch_metrics
+    self.checkpointer = checkpointer
+    self.resume_state = resume_state
+    self.eval_every = eval_every
+    self.precision = precision
+    self.grad_scaler = get_grad_scaler(self.device, self.precision)
+    self.profile_window = profile_window
+    if self.resume_state is not None: self._load_resume_state()
 
   def _get_adaptive_logits_params(self):
     if self.adaptive_logits['desc'] is not None:
@@ -75,91 +98,205 @@ class Trainer(object):
     predictions = torch.argmax(logits, 1)
     return int(((predictions - labels) != 0).sum())
 
+  def _step(self, loss):
+    with stage_timer.time('backward'):
+      if self.grad_scaler is None: loss.backward()
+      else: self.grad_scaler.scale(loss).backward()
+    with stage_timer.time('optimizer_step'):
+      if self.grad_scaler is not None: self.grad_scaler.unscale_(self.optimizer)
+      torch.nn.utils.clip_grad_norm_(itertools.chain(self.model.parameters(),
+                                                     self._get_adaptive_logits_params()),
+                                     self.clip_grad)
+      if self.grad_scaler is None:
+        self.optimizer.step()
+      else:
+        self.grad_scaler.step(self.optimizer)
+        self.grad_scaler.update()
+
+  def _start_batch(self, batch_num, batch):
+    if self.profile_window is not None: self.profile_window.step(batch_num)
+    with stage_timer.time('to_device'):
+      return tensors_to_device(batch, self.device)
+
+  def _should_eval(self, batch_num):
+    return self.eval_every > 0 and (batch_num + 1) % self.eval_every == 0
+
   def _get_labels_for_batch(self, labels, candidate_ids):
     return (torch.unsqueeze(labels, 1) == candidate_ids).nonzero()[:, 1]
 
+  def _get_adaptive_logits_state(self):
+    if self.adaptive_logits['desc'] is None: return None
+    return _.map_values(self.adaptive_logits, lambda module: module.state_dict())
+
+  def _get_checkpoint_state(self, epoch_num, batch_num, batch_sampler=None):
+    return {'model': self.model.state_dict(),
+            'adaptive_logits': self._get_adaptive_logits_state(),
+            'optimizer': self.optimizer.state_dict(),
+            'grad_scaler': self.grad_scaler.state_dict() if self.grad_scaler is not None else None,
+            'rng': get_rng_state(),
+            'dataset': self._dataset.get_state() if isinstance(batch_sampler, MentionContextBatchSampler) else None,
+            'sampler': batch_sampler.get_state(batch_num) if isinstance(batch_sampler, MentionContextBatchSampler) else None,
+            'epoch_num': epoch_num,
+            'batch_num': batch_num}
+
+  def _load_resume_state(self):
+    self.model.load_state_dict(self.resume_state['model'])
+    if self.resume_state['adaptive_logits'] is not None:
+      for name, state in self.resume_state['adaptive_logits'].items():
+        self.adaptive_logits[name].load_state_dict(state)
+    self.optimizer.load_state_dict(self.resume_state['optimizer'])
+    if self.grad_scaler is not None and self.resume_state['grad_scaler'] is not None:
+      self.grad_scaler.load_state_dict(self.resume_state['grad_scaler'])
+    set_rng_state(self.resume_state['rng'])
+
+  def _start_epoch(self, epoch_num):
+    '''Without the sampler's state a resumed epoch starts over from its first
+    batch rather than replaying or skipping pages.'''
+    self.experiment.update_epoch(epoch_num)
+    self._dataset = self.get_dataset()
+    batch_sampler = self.get_batch_sampler()
+    start_batch_num = 0
+    if self.resume_state is not None and self.resume_state['epoch_num'] == epoch_num and self.resume_state['sampler'] is not None:
+      self._dataset.set_state(self.resume_state['dataset'])
+      batch_sampler.set_state(self.resume_state['sampler'])
+      start_batch_num = self.resume_state['batch_num'] + 1
+    return batch_sampler, start_batch_num
+
+  def _maybe_checkpoint(self, epoch_num, batch_num, batch_sampler):
+    if self.checkpointer is not None and self.checkpointer.should_save(batch_num):
+      self.checkpointer.save(self._get_checkpoint_state(epoch_num, batch_num, batch_sampler))
+    if isinstance(batch_sampler, MentionContextBatchSampler): batch_sampler.release_states(batch_num)
+
+  def _end_epoch(self, epoch_num):
+    if self.checkpointer is None: return
+    self.checkpointer.save(self._get_checkpoint_state(epoch_num + 1, -1))
+    if epoch_num + 1 == self.num_epochs: self.checkpointer.wait()
+
+  def _get_epoch_nums(self):
+    start_epoch_num = self.resume_state['epoch_num'] if self.resume_state is not None else 0
+    return range(start_epoch_num, self.num_epochs)
+
+  def _get_dataloader(self, collate_fn, batch_sampler):
+    return DataLoader(dataset=self._dataset,
+                      batch_sampler=batch_sampler,
+                      collate_fn=partial(timed_call, 'collate', collate_fn),
+                      num_workers=self.num_workers,
+                      pin_memory=self.num_workers > 0 and self.device.type == 'cuda',
+                      worker_init_fn=mention_context_worker_init_fn if self.num_workers > 0 else None)
+
+  def _get_padding_ratio(self, batch):
+    num_slots = 0
+    num_tokens = 0
+    for seqs in [[splits[0] for splits in batch['sentence_splits']],
+                 [splits[1] for splits in batch['sentence_splits']],
+                 batch['entity_page_mentions']]:
+      lengths = [len(seq) for seq in seqs]
+      num_slots += len(lengths) * max(lengths)
+      num_tokens += sum(lengths)
+    return 1 - num_tokens / num_slots if num_slots > 0 else 0.0
+
+  def _get_prefetch_metrics(self):
+    if not self.record_prefetch_metrics: return {}
+    return self._dataset.get_prefetch_metrics()
+
   def train(self):
-    if self.use_wiki2vec:
-      self.train_wiki2vec()
-    else:
-      self.train_deep_el()
+    try:
+      if self.use_wiki2vec:
+        self.train_wiki2vec()
+      else:
+        self.train_deep_el()
+    finally:
+      if self.profile_window is not None: self.profile_window.close()
 
   def train_deep_el(self):
-    for epoch_num in range(self.num_epochs):
-      self.experiment.update_epoch(epoch_num)
-      self._dataset = self.get_dataset()
-      dataloader = DataLoader(dataset=self._dataset,
-                              batch_sampler=self.get_batch_sampler(),
-                              collate_fn=collate_deep_el)
-      for batch_num, batch in enumerate(dataloader):
+    for epoch_num in self._get_epoch_nums():
+      batch_sampler, start_batch_num = self._start_epoch(epoch_num)
+      dataloader = self._get_dataloader(collate_deep_el, batch_sampler)
+      for batch_num, batch in enumerate(timed_iter('data_wait', dataloader), start_batch_num):
+        step_start = time.perf_counter()
         self.model.train()
         self.optimizer.zero_grad()
-        batch = tensors_to_device(batch, self.device)
+        batch = self._start_batch(batch_num, batch)
         if self.use_adaptive_softmax:
           labels = batch['label']
         else:
           labels = self._get_labels_for_batch(batch['label'], batch['candidate_ids'])
-        left_splits, right_splits = embed_and_pack_batch(self.embedding,
-                                                         self.token_idx_lookup,
-                                                         batch['sentence_splits'])
-        encoded = self.model.encoder(((left_splits, right_splits),
-                                      batch['embedded_page_content'],
-                                      batch['entity_page_mentions']))
-        logits = self.calc_logits(encoded, batch['candidate_ids'])
-        scores = self.model.calc_scores(logits,
-                                        batch['candidate_mention_sim'])
-                                        # batch['prior'])
-        loss = self.calc_loss(scores, labels)
-        loss.backward()
-        torch.nn.utils.clip_grad_norm_(itertools.chain(self.model.parameters(),
-                                                       self._get_adaptive_logits_params()),
-                                       self.clip_grad)
-        self.optimizer.step()
-        with torch.no_grad():
-          self.model.eval()
-          encoded_test = self.model.encoder(((left_splits, right_splits),
-                                             batch['embedded_page_content'],
-                                             batch['entity_page_mentions']))
-          logits_test = self.calc_logits(encoded_test, batch['candidate_ids'])
-          mention_probas, desc_probas = self.model.calc_scores(logits_test,
-                                                               batch['candidate_mention_sim'])
-          mention_context_error = self._classification_error(mention_probas, labels)
-          document_context_error = self._classification_error(desc_probas, labels)
-        self.experiment.record_metrics({'mention_context_error': mention_context_error,
-                                        'document_context_error': document_context_error,
-                                        'loss': loss.item()},
-                                       batch_num=batch_num)
+        with stage_timer.time('embed_and_pack'):
+          left_splits, right_splits = embed_and_pack_batch(self.embedding,
+                                                           self.token_idx_lookup,
+                                                           batch['sentence_splits'])
+        with stage_timer.time('forward'):
+          with get_autocast(self.device, self.precision):
+            encoded = self.model.encoder(((left_splits, right_splits),
+                                          batch['page_content'],
+                                          batch['entity_page_mentions']))
+            logits = self.calc_logits(encoded, batch['candidate_ids'])
+            scores = self.model.calc_scores(logits,
+                                            batch['candidate_mention_sim'])
+                                            # batch['prior'])
+          loss = self.calc_loss(scores, labels)
+        self._step(loss)
+        if self._should_eval(batch_num):
+          with torch.no_grad(), get_autocast(self.device, self.precision):
+            self.model.eval()
+            encoded_test = self.model.encoder(((left_splits, right_splits),
+                                               batch['page_content'],
+                                               batch['entity_page_mentions']))
+            logits_test = self.calc_logits(encoded_test, batch['candidate_ids'])
+            mention_probas, desc_probas = self.model.calc_scores(logits_test,
+                                                                 batch['candidate_mention_sim'])
+        else:
+          mention_probas, desc_probas = scores
+        mention_context_error = self._classification_error(mention_probas.detach(), labels)
+        document_context_error = self._classification_error(desc_probas.detach(), labels)
+        loss = loss.item()
+        step_time = time.perf_counter() - step_start
+        with stage_timer.time('record_metrics'):
+          self.experiment.record_metrics(_.assign({'mention_context_error': mention_context_error,
+                                                   'document_context_error': document_context_error,
+                                                   'loss': loss,
+                                                   'step_time': step_time,
+                                                   'padding_ratio': self._get_padding_ratio(batch)},
+                                                  self._get_prefetch_metrics()),
+                                         batch_num=batch_num)
+        self._maybe_checkpoint(epoch_num, batch_num, batch_sampler)
+      self._end_epoch(epoch_num)
 
   def train_wiki2vec(self):
-    for epoch_num in range(self.num_epochs):
-      self.experiment.update_epoch(epoch_num)
-      self._dataset = self.get_dataset()
-      dataloader = DataLoader(dataset=self._dataset,
-                              batch_sampler=self.get_batch_sampler(),
-                              collate_fn=collate_wiki2vec)
-      for batch_num, batch in enumerate(dataloader):
+    for epoch_num in self._get_epoch_nums():
+      batch_sampler, start_batch_num = self._start_epoch(epoch_num)
+      dataloader = self._get_dataloader(collate_wiki2vec, batch_sampler)
+      for batch_num, batch in enumerate(timed_iter('data_wait', dataloader), start_batch_num):
+        step_start = time.perf_counter()
         self.model.train()
         self.optimizer.zero_grad()
-        batch = tensors_to_device(batch, self.device)
+        batch = self._start_batch(batch_num, batch)
         labels = self._get_labels_for_batch(batch['label'], batch['candidate_ids'])
-        encoded = self.model.encoder(batch['bag_of_nouns'])
-        logits = self.calc_logits(encoded, batch['candidate_ids'])
-        scores = self.model.calc_scores((logits, torch.zeros_like(logits)),
-                                        batch['candidate_mention_sim'])
-                                        # batch['prior'])
-        loss = self.calc_loss(scores, labels)
-        loss.backward()
-        torch.nn.utils.clip_grad_norm_(itertools.chain(self.model.parameters(),
-                                                       self._get_adaptive_logits_params()),
-                                       self.clip_grad)
-        self.optimizer.step()
-        with torch.no_grad():
-          self.model.eval()
-          encoded_test = self.model.encoder(batch['bag_of_nouns'])
-          logits_test = self.calc_logits(encoded_test, batch['candidate_ids'])
-          mention_probas, __ = self.model.calc_scores((logits_test, torch.zeros_like(logits_test)),
-                                                      batch['candidate_mention_sim'])
-          context_error = self._classification_error(mention_probas, labels)
-        self.experiment.record_metrics({'mention_context_error': context_error,
-                                        'loss': loss.item()},
-                                       batch_num=batch_num)
+        with stage_timer.time('forward'):
+          with get_autocast(self.device, self.precision):
+            encoded = self.model.encoder(batch['bag_of_nouns'])
+            logits = self.calc_logits(encoded, batch['candidate_ids'])
+            scores = self.model.calc_scores((logits, torch.zeros_like(logits)),
+                                            batch['candidate_mention_sim'])
+                                            # batch['prior'])
+          loss = self.calc_loss(scores, labels)
+        self._step(loss)
+        if self._should_eval(batch_num):
+          with torch.no_grad(), get_autocast(self.device, self.precision):
+            self.model.eval()
+            encoded_test = self.model.encoder(batch['bag_of_nouns'])
+            logits_test = self.calc_logits(encoded_test, batch['candidate_ids'])
+            mention_probas, __ = self.model.calc_scores((logits_test, torch.zeros_like(logits_test)),
+                                                        batch['candidate_mention_sim'])
+        else:
+          mention_probas, __ = scores
+        context_error = self._classification_error(mention_probas.detach(), labels)
+        loss = loss.item()
+        step_time = time.perf_counter() - step_start
+        with stage_timer.time('record_metrics'):
+          self.experiment.record_metrics({'mention_context_error': context_error,
+                                          'loss': loss,
+                                          'step_time': step_time},
+                                         batch_num=batch_num)
+        self._maybe_checkpoint(epoch_num, batch_num, batch_sampler)
+      self._end_epoch(epoch_num)
@@ -1,10 +1,15 @@
+from collections import OrderedDict
+import time
+
 import torch
 
 import pydash as _
 
-def build_cursor_generator(cursor, buff_len=1000):
+def build_cursor_generator(cursor, buff_len=1000, on_fetch=None):
   while True:
+    start_time = time.perf_counter()
     results = cursor.fetchmany(buff_len)
+    if on_fetch is not None: on_fetch(time.perf_counter() - start_time, len(results))
     if not results: return
     for result in results: yield result
 
@@ -54,3 +59,25 @@ def chunk_apply_at_lim(fn, coll, lim):
     return chunk_apply(fn, coll, lim)
   else:
     return fn(coll)
+
+class LRUCache(object):
+  def __init__(self, max_size):
+    self.max_size = max_size
+    self._data = OrderedDict()
+
+  def __len__(self):
+    return len(self._data)
+
+  def __contains__(self, key):
+    return key in self._data
+
+  def get(self, key, default=None):
+    if key not in self._data: return default
+    self._data.move_to_end(key)
+    return self._data[key]
+
+  def set(self, key, val):
+    self._data[key] = val
+    self._data.move_to_end(key)
+    if len(self._data) > self.max_size:
+      self._data.popitem(last=False)
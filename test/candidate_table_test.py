@@ -0,0 +1,45 @@
+import torch
+
+import Levenshtein
+
+from candidate_table import CandidateTable, CandidateMentionSim
+
+def test_get_batch_candidate_ids_and_p_prior():
+  entity_candidates_prior = {'a': {1: 20}, 'b': {2: 12, 4: 4}, 'c': {3: 3, 5: 1, 6: 1, 7: 1}}
+  table = CandidateTable(entity_candidates_prior)
+  candidate_ids, p_prior = table.get_batch_candidate_ids_and_p_prior(['b', 'c', 'd'],
+                                                                     [2, 3, 9],
+                                                                     num_entities=300,
+                                                                     num_candidates=3)
+  assert candidate_ids.shape == torch.Size([3, 3])
+  assert p_prior.shape == torch.Size([3, 3])
+  assert all(len(set(row)) == 3 for row in candidate_ids.tolist())
+  assert {2, 4}.issubset(set(candidate_ids[0].tolist()))
+  for candidate_id, prior in zip(candidate_ids[0].tolist(), p_prior[0].tolist()):
+    assert abs(prior - {2: 0.75, 4: 0.25}.get(candidate_id, 0)) < 1e-6
+  assert 3 in candidate_ids[1].tolist()
+  assert set(candidate_ids[1].tolist()).issubset({3, 5, 6, 7})
+  assert abs(float(p_prior[1].sum()) - 1) < 1e-6
+  assert torch.equal(p_prior[2], torch.zeros(3))
+
+def test_get_candidate_ids_and_p_prior_cheat():
+  table = CandidateTable({'a': {1: 20}})
+  candidate_ids, p_prior = table.get_candidate_ids_and_p_prior('a', 8, 10, 10, cheat=True)
+  assert sorted(candidate_ids.tolist()) == list(range(10))
+  assert float(p_prior[candidate_ids.tolist().index(1)]) == 1.0
+
+def test_candidate_mention_sim():
+  entity_text_by_label = ['Germany', 'German language', None]
+  candidate_mention_sim = CandidateMentionSim(entity_text_by_label, max_cache_size=2)
+  sims = candidate_mention_sim('German', torch.tensor([1, 0, 2]))
+  assert torch.allclose(sims, torch.tensor([Levenshtein.ratio('German', 'German language'),
+                                            Levenshtein.ratio('German', 'Germany'),
+                                            0.0]))
+  assert len(candidate_mention_sim._cache) == 2
+  assert ('German', 2) in candidate_mention_sim._cache
+  assert ('German', 1) not in candidate_mention_sim._cache
+
+def test_get_batch_p_prior():
+  table = CandidateTable({'b': {2: 12, 4: 4}, 'c': {3: 3}})
+  p_prior = table.get_batch_p_prior(['b', 'c', 'd'], torch.tensor([[4, 9, 2], [1, 3, 2], [2, 3, 4]]))
+  assert torch.allclose(p_prior, torch.tensor([[0.25, 0, 0.75], [0, 1, 0], [0, 0, 0]]))
@@ -0,0 +1,46 @@
+import os
+import random
+
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+
+from checkpoint import Checkpointer, get_rng_state, load_checkpoint, load_model_state, set_rng_state
+
+def test_checkpointer_writes_a_copy_of_the_state(tmpdir):
+  path = os.path.join(str(tmpdir), 'checkpoint')
+  checkpointer = Checkpointer(path, every_n_batches=2)
+  assert [checkpointer.should_save(batch_num) for batch_num in range(4)] == [False, True, False, True]
+  weight = torch.zeros(3)
+  checkpointer.save({'model': {'weight': weight}, 'batch_num': 1})
+  weight.add_(1)
+  checkpointer.wait()
+  checkpoint = load_checkpoint(path)
+  assert torch.equal(checkpoint['model']['weight'], torch.zeros(3))
+  assert checkpoint['batch_num'] == 1
+  assert not os.path.exists(path + '.tmp')
+
+def test_load_checkpoint_missing(tmpdir):
+  assert load_checkpoint(os.path.join(str(tmpdir), 'missing')) is None
+
+def test_rng_state_roundtrip():
+  state = get_rng_state()
+  expected = (random.random(), np.random.random(), torch.rand(1))
+  set_rng_state(state)
+  assert (random.random(), np.random.random(), torch.rand(1)) == expected
+
+class WordEmbeddingModel(nn.Module):
+  def __init__(self):
+    super().__init__()
+    self.word_embedding = nn.Embedding(5, 2)
+    self.linear = nn.Linear(2, 2)
+
+def test_load_model_state_allows_missing_word_embedding():
+  torch.manual_seed(0)
+  saved = WordEmbeddingModel()
+  old_state = {key: value for key, value in saved.state_dict().items() if not key.startswith('word_embedding.')}
+  model = load_model_state(WordEmbeddingModel(), old_state)
+  assert torch.equal(model.linear.weight, saved.linear.weight)
+  with pytest.raises(AssertionError, match='linear.bias'):
+    load_model_state(WordEmbeddingModel(), {key: value for key, value in old_state.items() if key != 'linear.bias'})
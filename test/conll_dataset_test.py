@@ -1,6 +1,13 @@
 from collections import defaultdict
+from unittest.mock import Mock
 
-from conll_dataset import _get_documents, _get_mentions, _get_splits, _get_entity_page_ids, _get_doc_id_per_mention, _get_mentions_by_doc_id
+import Levenshtein
+import pytest
+import torch
+
+import conll_dataset
+from conll_dataset import _get_documents, _get_mentions, _get_splits, _get_entity_page_ids, _get_doc_id_per_mention, _get_mentions_by_doc_id, _from_page_ids_to_entity_ids
+import parsers
 
 class Vocab(defaultdict):
   def __missing__(self, key):
@@ -64,3 +71,66 @@ def test__get_splits():
                      ['German', 'call', 'to', 'boycott', 'British', 'lamb', '.']],
                     [['EU', 'rejects', 'German', 'call', 'to', 'boycott', 'British'],
                      ['British', 'lamb', '.']]]
+
+def get_mock_cursor(entity_id_by_page_id, text_by_entity_id={}):
+  cursor = Mock()
+  cursor._data = {}
+  def execute(query, args):
+    if 'from entities' in query:
+      cursor._data['rows'] = [{'id': entity_id, 'text': text_by_entity_id[entity_id]}
+                              for entity_id in set(args) if entity_id in text_by_entity_id]
+    else:
+      cursor._data['rows'] = [{'source_id': page_id, 'entity_id': entity_id_by_page_id[page_id]}
+                              for page_id in set(args) if page_id in entity_id_by_page_id]
+  def fetchmany(size):
+    rows, cursor._data['rows'] = cursor._data['rows'], []
+    return rows
+  cursor.execute = Mock(side_effect=execute)
+  cursor.fetchmany = fetchmany
+  return cursor
+
+def test__from_page_ids_to_entity_ids():
+  cursor = get_mock_cursor({11867: 0, 31717: 1})
+  assert _from_page_ids_to_entity_ids(cursor, [11867, 31717, 3708, 11867]) == [0, 1, -1, 0]
+  assert cursor.execute.call_count == 1
+
+def test_conll_dataset_cache(tmp_path, monkeypatch):
+  monkeypatch.setitem(parsers._parsers, 'sentence_spans', lambda text: [(0, len(text))])
+  monkeypatch.setitem(parsers._parsers, 'text_tokens', lambda text: text.split())
+  token_idx_lookup = {'<PAD>': 0, '<UNK>': 1, 'EU': 2, 'German': 3}
+  cursor = get_mock_cursor({11867: 0, 31717: 1})
+  cache_path = str(tmp_path / 'conll_features')
+  get_dataset = lambda: conll_dataset.CoNLLDataset(cursor, {}, None, token_idx_lookup, 2, 30, {0: 0, 1: 1},
+                                                   path='./test/fixtures/conll', cache_path=cache_path)
+  dataset = get_dataset()
+  assert dataset.mentions[:3] == ['German', 'British', 'BRUSSELS']
+  assert len(dataset.sentence_splits) == len(dataset.mentions)
+  assert dataset.labels[:3] == [0, 1, -1]
+  assert torch.equal(dataset.document_token_idxs[1][:3], torch.tensor([2, 1, 3], dtype=torch.int32))
+  monkeypatch.setattr(conll_dataset.CoNLLDataset, '_featurize', Mock(side_effect=RuntimeError))
+  cached = get_dataset()
+  assert cached.sentence_splits == dataset.sentence_splits
+  assert cached.labels == dataset.labels
+  monkeypatch.setattr(conll_dataset, '_features_version', conll_dataset._features_version + 1)
+  with pytest.raises(RuntimeError):
+    get_dataset()
+
+def test_conll_dataset_shares_doc_features(monkeypatch):
+  monkeypatch.setitem(parsers._parsers, 'sentence_spans', lambda text: [(0, len(text))])
+  monkeypatch.setitem(parsers._parsers, 'text_tokens', lambda text: text.split())
+  token_idx_lookup = {'<PAD>': 0, '<UNK>': 1, 'German': 2, 'British': 3}
+  cursor = get_mock_cursor({11867: 0, 31717: 1}, {0: 'Germany', 1: 'United Kingdom', 2: 'Brussels', 3: 'EU', 4: 'lamb'})
+  entity_candidates_prior = {'German': {0: 10, 2: 1}, 'British': {1: 10}}
+  dataset = conll_dataset.CoNLLDataset(cursor, entity_candidates_prior, None, token_idx_lookup, 5, 2,
+                                       {i: i for i in range(5)}, path='./test/fixtures/conll')
+  num_queries = cursor.execute.call_count
+  first, second = dataset[0], dataset[1]
+  assert cursor.execute.call_count == num_queries + 1
+  assert first['page_content'] is second['page_content']
+  assert first['entity_page_mentions'] is second['entity_page_mentions']
+  assert first['entity_page_mentions'][:2].tolist() == [2, 3]
+  assert sorted(first['candidate_ids'].tolist()) == [0, 2]
+  label_position = first['candidate_ids'].tolist().index(0)
+  assert first['candidate_mention_sim'][label_position] == Levenshtein.ratio('German', 'Germany')
+  assert first['p_prior'][label_position] == 10 / 11
+  assert 1 in second['candidate_ids'].tolist()
@@ -2,6 +2,7 @@ import torch
 import pydash as _
 
 import data_fetchers as df
+from sqlite_backend import SQLiteConnection
 
 def test_get_random_indexes():
   result = df.get_random_indexes(300, [2, 8], 298)
@@ -33,3 +34,28 @@ def test_get_candidate_ids():
   assert 2 in candidate_ids.tolist()
   assert len(candidate_ids) == num_candidates
   assert len(set(candidate_ids.tolist())) == num_candidates
+
+def test_get_embedding_store(tmp_path):
+  path = str(tmp_path / 'glove.test.2d.txt')
+  with open(path, 'w') as f:
+    f.write('the 0.5 -1.0\nlamb 2.0 3.0\n')
+  token_idx_lookup, weights = df.get_embedding_store(path, embedding_dim=2)
+  assert list(token_idx_lookup.keys()) == ['<PAD>', '<UNK>', '<MENTION_START_HERE>', '<MENTION_END_HERE>', 'the', 'lamb']
+  assert weights.dtype == torch.float32
+  assert torch.equal(weights[token_idx_lookup['<PAD>']], torch.zeros(2))
+  assert torch.equal(weights[token_idx_lookup['lamb']], torch.tensor([2.0, 3.0]))
+  reloaded_lookup, reloaded_weights = df.get_embedding_store(path, embedding_dim=2)
+  assert reloaded_lookup == token_idx_lookup
+  assert torch.equal(reloaded_weights, weights)
+
+def test_fetch_by_ids(tmpdir):
+  connection = SQLiteConnection(str(tmpdir.join('el.db')))
+  with connection.cursor() as cursor:
+    cursor.execute('create table entities (id integer primary key, text text, num_mentions integer)')
+    cursor.executemany('insert into entities values (%s, %s, %s)', [(i, 'e' + str(i), i) for i in range(10)])
+    query = 'select id, text from entities where num_mentions > %s and id in ({})'
+    rows = list(df.fetch_by_ids(cursor, query, [1, 2, 7, 8, 9], args=[1], chunk_size=2, buff_len=1))
+    assert sorted(row['id'] for row in rows) == [2, 7, 8, 9]
+    assert df.query_timer.report()[query]['num_queries'] == 3
+    assert df.query_timer.report()[query]['num_rows'] == 4
+  connection.close()
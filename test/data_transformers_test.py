@@ -48,6 +48,20 @@ def test_pad_batch_no_min():
                      torch.tensor([[[1], [0]],
                                    [[1], [2]]]))
 
+def test_pad_batch_max_len_and_lengths():
+  pad_vector = torch.tensor(0, dtype=torch.int32)
+  batch = [torch.tensor([1, 2, 3, 4], dtype=torch.int32), torch.tensor([5], dtype=torch.int32), torch.tensor([], dtype=torch.int32)]
+  padded, lengths = dt.pad_batch(pad_vector, batch, max_len=3, return_lengths=True)
+  assert torch.equal(padded, torch.tensor([[1, 2, 3], [5, 0, 0], [0, 0, 0]], dtype=torch.int32))
+  assert lengths.tolist() == [3, 1, 0]
+
+def test_pad_batch_list_to_tensor():
+  padded, lengths = dt.pad_batch_list_to_tensor(0, [[1, 2], [], [3, 4, 5]], min_len=4, return_lengths=True)
+  assert torch.equal(padded, torch.tensor([[1, 2, 0, 0], [0, 0, 0, 0], [3, 4, 5, 0]]))
+  assert lengths.tolist() == [2, 0, 3]
+  assert torch.equal(dt.pad_batch_list_to_tensor(0, [[1, 2], [3, 4, 5]], max_len=2),
+                     torch.tensor([[1, 2], [3, 4]]))
+
 def test_embed_and_pack_batch():
   embedding_dict = {'a': torch.tensor([1]), 'b': torch.tensor([2])}
   token_idx_lookup = dict(zip(embedding_dict.keys(),
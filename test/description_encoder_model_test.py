@@ -10,13 +10,15 @@ def test_description_encoder_forward():
   num_entities = 20
   batch_size = 2
   desc_len = 9
-  pad_vector = torch.randn((word_embed_len, ))
+  vocab_size = 50
+  word_embedding = torch.nn.Embedding(vocab_size, word_embed_len)
   desc_enc = DescriptionEncoder(word_embed_len,
                                 torch.nn.Embedding(num_entities,
                                                    embed_len,
                                                    _weight=torch.randn((num_entities, embed_len))),
-                                pad_vector)
-  descriptions = torch.randn((batch_size, desc_len, word_embed_len))
+                                word_embedding,
+                                0)
+  descriptions = torch.randint(1, vocab_size, (batch_size, desc_len), dtype=torch.int32)
   desc_embeds = desc_enc(descriptions)
   assert desc_embeds.shape == torch.Size([2, embed_len])
 
@@ -26,14 +28,16 @@ def test_description_encoder_loss():
   num_entities = 20
   batch_size = 2
   desc_len = 9
-  pad_vector = torch.randn((word_embed_len, ))
+  vocab_size = 50
+  word_embedding = torch.nn.Embedding(vocab_size, word_embed_len)
   entity_embeds = torch.nn.Embedding(num_entities,
                                      embed_len,
                                      _weight=torch.randn((num_entities, embed_len)))
   desc_enc = DescriptionEncoder(word_embed_len,
                                 entity_embeds,
-                                pad_vector)
-  descriptions = torch.randn((batch_size, desc_len, word_embed_len))
+                                word_embedding,
+                                0)
+  descriptions = torch.randint(1, vocab_size, (batch_size, desc_len), dtype=torch.int32)
   desc_embeds = desc_enc(descriptions)
   labels_for_batch = torch.arange(batch_size, dtype=torch.long)
   calc_logits = Logits()
@@ -0,0 +1,16 @@
+import torch
+from torch import nn
+
+from document_context_encoder_model import DocumentContextEncoder
+
+def test_document_context_encoder_ignores_padding():
+  torch.manual_seed(0)
+  word_embedding = nn.Embedding(20, 6)
+  encoder = DocumentContextEncoder(5, 6, 4, word_embedding, 0)
+  short = torch.tensor([3, 4], dtype=torch.int32)
+  long = torch.tensor([5, 6, 7, 8, 9], dtype=torch.int32)
+  empty = torch.tensor([], dtype=torch.int32)
+  alone = encoder([short])
+  batched = encoder([long, short, empty])
+  assert batched.shape == torch.Size([3, 4])
+  assert torch.allclose(alone[0], batched[1], atol=1e-6)
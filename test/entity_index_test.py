@@ -0,0 +1,50 @@
+import Levenshtein
+import torch
+
+from candidate_table import CandidateMentionSim, CandidateTable
+from entity_index import build_entity_index, load_entity_index
+from inference import merge_retrieved_candidates, score_candidates
+
+def test_entity_index_search():
+  torch.manual_seed(0)
+  entity_embeds_weight = torch.randn(500, 8)
+  entity_index = build_entity_index(entity_embeds_weight, num_clusters=10, num_probe=10)
+  queries = entity_embeds_weight[:4]
+  exact = torch.topk(torch.mm(queries, entity_embeds_weight.t()), 5, dim=1)[1]
+  assert torch.equal(entity_index.search(queries, 5), exact)
+
+def test_load_entity_index(tmpdir):
+  torch.manual_seed(0)
+  entity_embeds_weight = torch.randn(100, 8)
+  entity_index = build_entity_index(entity_embeds_weight, num_clusters=4, num_probe=2)
+  path = str(tmpdir.join('entity_index'))
+  entity_index.save(path)
+  loaded = load_entity_index(path, entity_embeds_weight)
+  queries = torch.randn(3, 8)
+  assert torch.equal(loaded.search(queries, 5), entity_index.search(queries, 5))
+  assert load_entity_index(path, entity_embeds_weight + 1) is None
+
+def test_entity_index_search_pads_rows():
+  torch.manual_seed(0)
+  entity_embeds_weight = torch.randn(3, 8)
+  entity_index = build_entity_index(entity_embeds_weight, num_clusters=2, num_probe=1)
+  retrieved = entity_index.search(torch.randn(2, 8), 5)
+  assert retrieved.shape == (2, 5)
+  assert all(sorted(set(row.tolist())) == [0, 1, 2] for row in retrieved)
+
+def test_merge_retrieved_candidates():
+  candidate_ids = torch.tensor([[1, 2], [3, 4]])
+  retrieved_ids = torch.tensor([[2, 5, 1, 6], [7, 8, 9, 3]])
+  assert torch.equal(merge_retrieved_candidates(candidate_ids, retrieved_ids, 2),
+                     torch.tensor([[1, 2, 5, 6], [3, 4, 7, 8]]))
+
+def test_score_candidates():
+  table = CandidateTable({'paris': {1: 30, 4: 10}})
+  candidate_mention_sim = CandidateMentionSim(['a', 'Paris, Texas', 'b', 'c', 'Paris'])
+  p_prior, sims = score_candidates(['paris', 'unknown'],
+                                   torch.tensor([[1, 0, 4], [2, 3, 4]]),
+                                   table,
+                                   candidate_mention_sim)
+  assert torch.allclose(p_prior, torch.tensor([[0.75, 0, 0.25], [0, 0, 0]]))
+  assert abs(float(sims[0, 2]) - Levenshtein.ratio('paris', 'Paris')) < 1e-6
+  assert abs(float(sims[1, 0]) - Levenshtein.ratio('unknown', 'b')) < 1e-6
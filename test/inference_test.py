@@ -0,0 +1,64 @@
+import torch
+import torch.nn as nn
+
+from data_transformers import embed_and_pack_batch
+from inference import group_documents, predict_deep_el, predict_document
+from joint_model import JointModel
+
+def get_model(vocab_size, num_entities):
+  torch.manual_seed(0)
+  word_embedding = nn.Embedding(vocab_size, 20, padding_idx=0)
+  entity_embeds = nn.Embedding(num_entities, 16)
+  model = JointModel(16, 16, 20, 8, 8, 2, 0.4, entity_embeds, word_embedding, 0,
+                     {'desc': None, 'mention': None}, True, True, 5, False)
+  model.eval()
+  return model
+
+def get_splits(vocab_size, num_mentions):
+  rand_len = lambda: int(torch.randint(1, 20, (1,)))
+  return [[torch.randint(1, vocab_size, (rand_len(),)), torch.randint(1, vocab_size, (rand_len(),))]
+          for i in range(num_mentions)]
+
+def test_group_documents():
+  first, second = torch.tensor([1, 2]), torch.tensor([3])
+  mentions = torch.tensor([4])
+  page_contents, entity_page_mentions, mention_doc_idxs = group_documents([first, second, first, first.clone()],
+                                                                          [mentions, mentions, mentions, mentions])
+  assert len(page_contents) == 3 and len(entity_page_mentions) == 3
+  assert page_contents[0] is first and page_contents[1] is second
+  assert mention_doc_idxs.tolist() == [0, 1, 0, 2]
+
+def test_encode_mentions_matches_forward():
+  vocab_size, num_mentions = 100, 6
+  model = get_model(vocab_size, 10)
+  page_contents = [torch.randint(1, vocab_size, (200,), dtype=torch.int32) for i in range(2)]
+  entity_page_mentions = [torch.randint(1, vocab_size, (30,), dtype=torch.int32) for i in range(2)]
+  mention_doc_idxs = torch.tensor([0, 1, 0, 0, 1, 1])
+  with torch.no_grad():
+    left, right = embed_and_pack_batch(model.word_embedding, {}, get_splits(vocab_size, num_mentions))
+    expected = model.encoder(((left, right),
+                              [page_contents[idx] for idx in mention_doc_idxs.tolist()],
+                              [entity_page_mentions[idx] for idx in mention_doc_idxs.tolist()]))
+    encoded = model.encoder.encode_mentions((left, right),
+                                            model.encoder.encode_documents(page_contents, entity_page_mentions),
+                                            mention_doc_idxs)
+  assert torch.allclose(encoded[0], expected[0], atol=1e-6)
+  assert torch.allclose(encoded[1], expected[1], atol=1e-6)
+
+def test_predict_document():
+  vocab_size, num_entities, num_mentions, num_candidates = 100, 20, 8, 5
+  model = get_model(vocab_size, num_entities)
+  document = {'page_content': torch.randint(1, vocab_size, (300,), dtype=torch.int32),
+              'entity_page_mentions': torch.randint(1, vocab_size, (40,), dtype=torch.int32),
+              'sentence_splits': get_splits(vocab_size, num_mentions),
+              'candidate_ids': torch.randint(0, num_entities, (num_mentions, num_candidates)),
+              'p_prior': torch.rand(num_mentions, num_candidates),
+              'candidate_mention_sim': torch.rand(num_mentions, num_candidates)}
+  ablation = ['prior', 'local_context', 'document_context']
+  batch = dict(document,
+               page_content=[document['page_content'].clone() for i in range(num_mentions)],
+               entity_page_mentions=[document['entity_page_mentions'].clone() for i in range(num_mentions)])
+  with torch.no_grad():
+    expected = predict_deep_el(model.word_embedding, {}, document['p_prior'], model, batch, ablation, model.entity_embeds)
+    predictions = predict_document(model.word_embedding, {}, model, document, ablation, model.entity_embeds)
+  assert torch.equal(predictions, expected)
@@ -62,3 +62,73 @@ def test_mention_context_batch_sampler_many_last_ids():
     batches_seen.append(batch_num)
   assert _.is_empty(_.difference(mentions_in_page_order, indexes_seen))
   assert batches_seen == [0, 1, 2]
+
+class FakeLengthCorpus():
+  def get_mention_lengths(self, mention_id):
+    return (mention_id % 3, 0, 0)
+
+def get_mock_fetch_cursor(rows):
+  cursor = Mock()
+  cursor._rows = []
+  def execute(query, args):
+    cursor._rows = [row for row in rows if row['page_id'] in args]
+  def fetchmany(size):
+    result, cursor._rows = cursor._rows, []
+    return result
+  cursor.execute = execute
+  cursor.fetchmany = fetchmany
+  return cursor
+
+def test_mention_context_batch_sampler_bucketed():
+  rows = [{'mention_id': mention_id, 'entity_id': 0, 'page_id': mention_id // 4} for mention_id in range(12)]
+  batch_sampler = MentionContextBatchSampler(get_mock_fetch_cursor(rows),
+                                             [0, 1, 2],
+                                             4,
+                                             1,
+                                             bucket_window=3,
+                                             yield_page_ids=True,
+                                             page_token_corpus=FakeLengthCorpus())
+  batches = [batch for batch in batch_sampler]
+  assert sorted(idx[:2] for batch in batches for idx in batch) == [(mention_id // 4, mention_id) for mention_id in range(12)]
+  assert all(len(set(mention_id % 3 for page_id, mention_id, window in batch)) == 1 for batch in batches)
+  assert all(window == 0 for batch in batches for page_id, mention_id, window in batch)
+
+class FakeRightLengthCorpus():
+  def get_mention_lengths(self, mention_id):
+    return (5, 10 * (mention_id % 3), 5)
+
+def test_mention_context_batch_sampler_buckets_every_length():
+  rows = [{'mention_id': mention_id, 'entity_id': 0, 'page_id': mention_id // 4} for mention_id in range(12)]
+  batch_sampler = MentionContextBatchSampler(get_mock_fetch_cursor(rows),
+                                             [0, 1, 2],
+                                             4,
+                                             1,
+                                             bucket_window=3,
+                                             page_token_corpus=FakeRightLengthCorpus())
+  batches = [batch for batch in batch_sampler]
+  assert sorted(_.flatten(batches)) == list(range(12))
+  assert all(len(set(mention_id % 3 for mention_id in batch)) == 1 for batch in batches)
+
+def test_mention_context_batch_sampler_resumes_from_state():
+  rows = [{'page_id': page_id, 'mention_id': page_id * 10 + i}
+          for page_id, num_mentions in [(0, 3), (1, 4), (2, 2)]
+          for i in range(num_mentions)]
+  batch_sampler = MentionContextBatchSampler(get_mock_fetch_cursor(rows), [0, 1, 2], 2, 0)
+  batches = [batch for batch in batch_sampler]
+  state = batch_sampler.get_state(1)
+  assert state['batch_num'] == 1
+  resumed = MentionContextBatchSampler(get_mock_fetch_cursor(rows), [0, 1, 2], 2, 0)
+  resumed.set_state(state)
+  remaining = [batch for batch in resumed]
+  assert sorted(_.flatten(batches[:2] + remaining)) == sorted(row['mention_id'] for row in rows)
+  assert resumed.get_state(resumed.num_batches - 1)['num_mentions_seen'] == len(rows)
+
+def test_mention_context_batch_sampler_keeps_states_until_released():
+  rows = [{'page_id': page_id, 'mention_id': page_id} for page_id in range(300)]
+  batch_sampler = MentionContextBatchSampler(get_mock_fetch_cursor(rows), list(range(300)), 2, 0)
+  batches = [batch for batch in batch_sampler]
+  assert len(batches) == 150
+  assert batch_sampler.get_state(0)['num_mentions_seen'] == 2
+  batch_sampler.release_states(149)
+  assert batch_sampler.get_state(148) is None
+  assert batch_sampler.get_state(149)['num_mentions_seen'] == 300
@@ -1,3 +1,7 @@
+import threading
+
+import Levenshtein
+import mention_context_dataset as mcd
 from mention_context_dataset import MentionContextDataset
 import torch
 import torch.nn as nn
@@ -5,12 +9,6 @@ from unittest.mock import Mock
 from utils import coll_compare_keys_by
 import pydash as _
 
-def get_mock_cursor():
-  cursor = Mock()
-  cursor.execute = lambda q, args: None
-  cursor.fetchone = lambda: {'count(*)': 5}
-  return cursor
-
 def compare_candidate_ids_tensor(expected, result):
   assert isinstance(result, torch.Tensor)
   expected_candidate_ids = set(expected.numpy())
@@ -20,8 +18,29 @@ def compare_candidate_ids_tensor(expected, result):
     assert generated_candidate not in expected_candidate_ids
   return True
 
+def get_mock_fetch_cursor(mention_rows, entity_texts):
+  cursor = Mock()
+  cursor._rows = []
+  def execute(query, args):
+    if 'entity_mentions_text' in query:
+      cursor._rows = [dict(row) for row in mention_rows if row['page_id'] in args]
+    else:
+      cursor._rows = [{'id': entity_id, 'text': text} for entity_id, text in entity_texts.items() if entity_id in args]
+  def fetchmany(size):
+    rows, cursor._rows = cursor._rows, []
+    return rows
+  cursor.execute = execute
+  cursor.fetchmany = fetchmany
+  return cursor
+
 def test_mention_context_dataset():
-  cursor = get_mock_cursor()
+  mention_rows = [{'mention': 'bb', 'offset': 9, 'page_id': 2, 'entity_id': 0, 'mention_id': 0},
+                  {'mention': 'aa', 'offset': 6, 'page_id': 2, 'entity_id': 1, 'mention_id': 1},
+                  {'mention': 'cc', 'offset': 0, 'page_id': 1, 'entity_id': 2, 'mention_id': 2},
+                  {'mention': 'bb', 'offset': 3, 'page_id': 1, 'entity_id': 0, 'mention_id': 3},
+                  {'mention': 'bb', 'offset': 3, 'page_id': 0, 'entity_id': 1, 'mention_id': 4}]
+  entity_texts = {0: 'bb', 1: 'aa', 2: 'cc', 3: 'dd', 4: 'ee'}
+  cursor = get_mock_fetch_cursor(mention_rows, entity_texts)
   page_id_order = [3, 1, 2]
   batch_size = 5
   entity_candidates_prior = {'aa': {1: 20},
@@ -47,62 +66,287 @@ def test_mention_context_dataset():
                                   batch_size,
                                   num_entities,
                                   num_candidates)
-  dataset._mention_infos = {0: {'mention': 'bb', 'offset': 9, 'page_id': 2, 'entity_id': 0, 'mention_id': 0},
-                            1: {'mention': 'aa', 'offset': 6, 'page_id': 2, 'entity_id': 1, 'mention_id': 1},
-                            2: {'mention': 'cc', 'offset': 0, 'page_id': 1, 'entity_id': 2, 'mention_id': 2},
-                            3: {'mention': 'bb', 'offset': 3, 'page_id': 1, 'entity_id': 0, 'mention_id': 3},
-                            4: {'mention': 'bb', 'offset': 3, 'page_id': 0, 'entity_id': 1, 'mention_id': 4}}
+  mention_infos, mentions_per_page_ctr = dataset._get_batch_mention_infos([2, 1, 0])
+  assert mentions_per_page_ctr == {2: 2, 1: 2, 0: 1}
+  assert all(mention_info['candidate_strs'] == [entity_texts[candidate_id] for candidate_id in mention_info['candidate_ids'].tolist()]
+             for mention_info in mention_infos.values())
+  dataset._mention_infos = mention_infos
   dataset._page_content_lookup = {2: 'a b c aa bb',
                                   1: 'cc bb c b a',
                                   0: 'dd bb a b c'}
   dataset._sentence_spans_lookup = {2: [(0, 5), (6, 11)],
                                     1: [(0, 5), (6, 11)],
                                     0: [(0, 5), (6, 11)]}
-  dataset._embedded_page_content_lookup = {2: [0, 1],
+  dataset._page_token_idxs_lookup = {2: [0, 1],
                                            1: [1, 2],
                                            0: [1]}
   dataset._entity_page_mentions_lookup = {2: [[0]],
                                           1: [[1]],
                                           0: [[1]]}
-  dataset._mentions_per_page_ctr = {2: 2,
-                                    1: 2,
-                                    0: 1}
-  expected_data = [{'sentence_splits': [['aa', 'bb'], ['bb']],
+  dataset._mentions_per_page_ctr = mentions_per_page_ctr
+  expected_data = [{'mention': 'bb',
+                    'sentence_splits': [['aa', 'bb'], ['bb']],
                     'label': 0,
-                    'embedded_page_content': [0, 1],
+                    'page_content': [0, 1],
                     'entity_page_mentions': [[0]],
                     'candidate_ids': torch.tensor([0, 1]),
                     'p_prior': torch.tensor([10/12, 2/12])},
-                   {'sentence_splits': [['aa'], ['aa', 'bb']],
+                   {'mention': 'aa',
+                    'sentence_splits': [['aa'], ['aa', 'bb']],
                     'label': 1,
-                    'embedded_page_content': [0, 1],
+                    'page_content': [0, 1],
                     'entity_page_mentions': [[0]],
                     'candidate_ids': torch.tensor([1]),
                     'p_prior': torch.tensor([1.0])},
-                   {'sentence_splits': [['cc'], ['cc', 'bb']],
+                   {'mention': 'cc',
+                    'sentence_splits': [['cc'], ['cc', 'bb']],
                     'label': 2,
-                    'embedded_page_content': [1, 2],
+                    'page_content': [1, 2],
                     'entity_page_mentions': [[1]],
                     'candidate_ids': torch.tensor([2]),
                     'p_prior': torch.tensor([1.0])},
-                   {'sentence_splits': [['cc', 'bb'], ['bb']],
+                   {'mention': 'bb',
+                    'sentence_splits': [['cc', 'bb'], ['bb']],
                     'label': 0,
-                    'embedded_page_content': [1, 2],
+                    'page_content': [1, 2],
                     'entity_page_mentions': [[1]],
                     'candidate_ids': torch.tensor([0, 1]),
                     'p_prior': torch.tensor([10/12, 2/12])},
-                   {'sentence_splits': [['dd', 'bb'], ['bb']],
+                   {'mention': 'bb',
+                    'sentence_splits': [['dd', 'bb'], ['bb']],
                     'label': 1,
-                    'embedded_page_content': [1],
+                    'page_content': [1],
                     'entity_page_mentions': [[1]],
                     'candidate_ids': torch.tensor([0, 1]),
                     'p_prior': torch.tensor([10/12, 2/12])}]
   iterator = iter(dataset)
   dataset_values = [next(iterator) for _ in range(len(expected_data))]
-  comparison = {'sentence_splits': _.is_equal,
+  comparison = {'mention': _.is_equal,
+                'sentence_splits': _.is_equal,
                 'label': _.is_equal,
-                'embedded_page_content': _.is_equal,
+                'page_content': _.is_equal,
                 'entity_page_mentions': _.is_equal,
                 'candidate_ids': compare_candidate_ids_tensor,
                 'p_prior': lambda a, b: len(a) == len(_.intersection(a.tolist(), b.tolist()))}
-  assert coll_compare_keys_by(expected_data, dataset_values, comparison)
+  assert coll_compare_keys_by(expected_data,
+                              [_.omit(sample, 'candidate_mention_sim') for sample in dataset_values],
+                              comparison)
+  for sample in dataset_values:
+    expected_sim = [Levenshtein.ratio(sample['mention'], entity_texts[candidate_id]) for candidate_id in sample['candidate_ids'].tolist()]
+    assert torch.allclose(sample['candidate_mention_sim'], torch.tensor(expected_sim))
+
+class FakePageTokenCorpus():
+  def __init__(self, mention_infos_by_page_id):
+    self.mention_infos_by_page_id = mention_infos_by_page_id
+
+  def get_page_mention_infos(self, page_id):
+    return [dict(mention_info) for mention_info in self.mention_infos_by_page_id[page_id]]
+
+  def get_page_content_token_idxs(self, page_id):
+    return torch.tensor([page_id, page_id])
+
+  def get_entity_page_mention_token_idxs(self, page_id):
+    return torch.tensor([page_id])
+
+  def get_sentence_split_token_idxs(self, mention_id):
+    return [torch.tensor([mention_id]), torch.tensor([mention_id])]
+
+def get_page_id_dataset():
+  cursor = Mock()
+  cursor._rows = []
+  def execute(query, args):
+    cursor._rows = [{'id': i, 'text': 'e' + str(i)} for i in range(5)]
+  def fetchmany(size):
+    rows, cursor._rows = cursor._rows, []
+    return rows
+  cursor.execute = execute
+  cursor.fetchmany = fetchmany
+  mention_infos_by_page_id = {1: [{'mention': 'aa', 'offset': 0, 'page_id': 1, 'entity_id': 1, 'mention_id': 10},
+                                  {'mention': 'bb', 'offset': 3, 'page_id': 1, 'entity_id': 0, 'mention_id': 11}],
+                              2: [{'mention': 'cc', 'offset': 0, 'page_id': 2, 'entity_id': 2, 'mention_id': 20}]}
+  embedding = nn.Embedding.from_pretrained(torch.arange(5, dtype=torch.float).unsqueeze(1))
+  dataset = MentionContextDataset(cursor,
+                                  [1, 2],
+                                  {'aa': {1: 20}, 'bb': {0: 10, 1: 2}, 'cc': {2: 3}},
+                                  dict(zip(range(5), range(5))),
+                                  embedding,
+                                  {'<PAD>': 0, '<UNK>': 1},
+                                  2,
+                                  5,
+                                  2,
+                                  page_token_corpus=FakePageTokenCorpus(mention_infos_by_page_id))
+  return dataset
+
+def test_mention_context_dataset_getitems_by_page_id():
+  dataset = get_page_id_dataset()
+  first = dataset.__getitems__([(1, 11), (2, 20)])
+  assert [int(sample['label']) for sample in first] == [0, 2]
+  assert torch.equal(first[1]['sentence_splits'][0], torch.tensor([20]))
+  assert torch.equal(first[1]['page_content'], torch.tensor([2, 2]))
+  assert 2 not in dataset._page_token_idxs_lookup
+  second = dataset.__getitems__([(1, 10)])
+  assert int(second[0]['label']) == 1
+  assert 1 in second[0]['candidate_ids'].tolist()
+  assert _.is_empty(dataset._mention_infos)
+
+def test_mention_context_dataset_getitems_keeps_window_pages():
+  dataset = get_page_id_dataset()
+  loaded = []
+  load_pages = dataset._load_pages
+  dataset._load_pages = lambda page_ids: loaded.extend(page_ids) or load_pages(page_ids)
+  dataset.__getitems__([(2, 20, 0), (1, 11, 0)])
+  assert 1 in dataset._page_token_idxs_lookup and 2 not in dataset._page_token_idxs_lookup
+  dataset.__getitems__([(2, 20, 1)])
+  assert 1 not in dataset._page_token_idxs_lookup
+  dataset.__getitems__([(1, 10, 1)])
+  assert sorted(loaded) == [1, 1, 2, 2]
+  dataset = get_page_id_dataset()
+  loaded = []
+  load_pages = dataset._load_pages
+  dataset._load_pages = lambda page_ids: loaded.extend(page_ids) or load_pages(page_ids)
+  dataset.__getitems__([(1, 11, 0)])
+  dataset.__getitems__([(2, 20, 0)])
+  second = dataset.__getitems__([(1, 10, 0)])
+  assert int(second[0]['label']) == 1
+  assert sorted(loaded) == [1, 2]
+  assert _.is_empty(dataset._mention_infos) and _.is_empty(dataset._page_windows)
+
+def test_next_page_id_batch_uses_page_mention_counts():
+  cursor = Mock()
+  cursor.execute = Mock(side_effect=AssertionError('no queries expected'))
+  embedding = nn.Embedding.from_pretrained(torch.arange(5, dtype=torch.float).unsqueeze(1))
+  dataset = MentionContextDataset(cursor,
+                                  [5, 6, 7, 8, 9],
+                                  {},
+                                  dict(zip(range(5), range(5))),
+                                  embedding,
+                                  {'<PAD>': 0, '<UNK>': 1},
+                                  3,
+                                  5,
+                                  2,
+                                  page_mention_counts=[2, 0, 1, 4, 1])
+  assert dataset._next_page_id_batch() == [5, 6, 7]
+  assert dataset._next_page_id_batch() == [8]
+  assert dataset._next_page_id_batch() == [9]
+  assert dataset._next_page_id_batch() == []
+
+def test_mention_context_dataset_prefetch():
+  cursor = Mock()
+  cursor.execute = Mock(side_effect=AssertionError('no queries expected'))
+  mention_infos_by_page_id = {1: [{'mention': 'aa', 'offset': 0, 'page_id': 1, 'entity_id': 1, 'mention_id': 0},
+                                  {'mention': 'bb', 'offset': 3, 'page_id': 1, 'entity_id': 0, 'mention_id': 1}],
+                              2: [{'mention': 'cc', 'offset': 0, 'page_id': 2, 'entity_id': 2, 'mention_id': 2}]}
+  embedding = nn.Embedding.from_pretrained(torch.arange(5, dtype=torch.float).unsqueeze(1))
+  dataset = MentionContextDataset(cursor,
+                                  [1, 2],
+                                  {'aa': {1: 20}, 'bb': {0: 10, 1: 2}, 'cc': {2: 3}},
+                                  dict(zip(range(5), range(5))),
+                                  embedding,
+                                  {'<PAD>': 0, '<UNK>': 1},
+                                  2,
+                                  5,
+                                  2,
+                                  page_token_corpus=FakePageTokenCorpus(mention_infos_by_page_id),
+                                  candidate_mention_sim=lambda mention, candidate_ids: torch.zeros(len(candidate_ids)),
+                                  page_mention_counts=[2, 1],
+                                  prefetch_depth=1)
+  samples = [dataset[idx] for idx in range(3)]
+  assert [int(sample['label']) for sample in samples] == [1, 0, 2]
+  assert torch.equal(samples[2]['page_content'], torch.tensor([2, 2]))
+  assert set(dataset.get_prefetch_metrics().keys()) == {'producer_stall_time', 'consumer_wait_time'}
+
+def test_mention_context_dataset_resumes_from_state():
+  cursor = Mock()
+  cursor.execute = Mock(side_effect=AssertionError('no queries expected'))
+  mention_infos_by_page_id = {1: [{'mention': 'aa', 'offset': 0, 'page_id': 1, 'entity_id': 1, 'mention_id': 0},
+                                  {'mention': 'bb', 'offset': 3, 'page_id': 1, 'entity_id': 0, 'mention_id': 1}],
+                              2: [{'mention': 'cc', 'offset': 0, 'page_id': 2, 'entity_id': 2, 'mention_id': 2}]}
+  embedding = nn.Embedding.from_pretrained(torch.arange(5, dtype=torch.float).unsqueeze(1))
+  get_dataset = lambda: MentionContextDataset(cursor,
+                                              [1, 2],
+                                              {'aa': {1: 20}, 'bb': {0: 10, 1: 2}, 'cc': {2: 3}},
+                                              dict(zip(range(5), range(5))),
+                                              embedding,
+                                              {'<PAD>': 0, '<UNK>': 1},
+                                              2,
+                                              5,
+                                              2,
+                                              page_token_corpus=FakePageTokenCorpus(mention_infos_by_page_id),
+                                              candidate_mention_sim=lambda mention, candidate_ids: torch.zeros(len(candidate_ids)),
+                                              page_mention_counts=[2, 1])
+  dataset = get_dataset()
+  dataset[0]
+  state = dataset.get_state()
+  assert state == {'page_ctr': 0, 'consumed_mention_ids': [0]}
+  resumed = get_dataset()
+  resumed.set_state(state)
+  assert [int(resumed[idx]['label']) for idx in [1, 2]] == [0, 2]
+  assert _.is_empty(resumed._mention_infos)
+  assert resumed.get_state() == {'page_ctr': 2, 'consumed_mention_ids': []}
+
+def test_mention_context_dataset_resumes_when_mention_id_matches_page_id():
+  cursor = Mock()
+  cursor.execute = Mock(side_effect=AssertionError('no queries expected'))
+  mention_infos_by_page_id = {7: [{'mention': 'aa', 'offset': 0, 'page_id': 7, 'entity_id': 1, 'mention_id': 70}],
+                              8: [{'mention': 'bb', 'offset': 0, 'page_id': 8, 'entity_id': 0, 'mention_id': 7},
+                                  {'mention': 'cc', 'offset': 3, 'page_id': 8, 'entity_id': 2, 'mention_id': 80}]}
+  embedding = nn.Embedding.from_pretrained(torch.arange(5, dtype=torch.float).unsqueeze(1))
+  get_dataset = lambda: MentionContextDataset(cursor,
+                                              [7, 8],
+                                              {'aa': {1: 20}, 'bb': {0: 10, 1: 2}, 'cc': {2: 3}},
+                                              dict(zip(range(5), range(5))),
+                                              embedding,
+                                              {'<PAD>': 0, '<UNK>': 1},
+                                              3,
+                                              5,
+                                              2,
+                                              page_token_corpus=FakePageTokenCorpus(mention_infos_by_page_id),
+                                              candidate_mention_sim=lambda mention, candidate_ids: torch.zeros(len(candidate_ids)),
+                                              page_mention_counts=[1, 2])
+  dataset = get_dataset()
+  dataset[70]
+  state = dataset.get_state()
+  assert state == {'page_ctr': 0, 'consumed_mention_ids': [70]}
+  resumed = get_dataset()
+  resumed.set_state(state)
+  assert [int(resumed[idx]['label']) for idx in [7, 80]] == [0, 2]
+  assert 7 not in resumed._page_token_idxs_lookup
+  assert _.is_empty(resumed._mention_infos)
+
+def test_mention_context_dataset_prefetch_uses_own_cursor(monkeypatch):
+  cursor = Mock()
+  cursor.execute = Mock(side_effect=AssertionError('the main cursor is not thread safe'))
+  producer_threads = []
+  producer_cursor = Mock()
+  def execute(query, args):
+    producer_threads.append(threading.current_thread())
+    producer_cursor._rows = [{'id': entity_id, 'text': 'e' + str(entity_id)} for entity_id in set(args)]
+  def fetchmany(size):
+    rows, producer_cursor._rows = producer_cursor._rows, []
+    return rows
+  producer_cursor.execute = execute
+  producer_cursor.fetchmany = fetchmany
+  producer_connection = Mock()
+  monkeypatch.setattr(mcd, 'get_connection', lambda: producer_connection)
+  monkeypatch.setattr(mcd, 'get_cursor', lambda connection: producer_cursor)
+  mention_infos_by_page_id = {1: [{'mention': 'aa', 'offset': 0, 'page_id': 1, 'entity_id': 1, 'mention_id': 0}],
+                              2: [{'mention': 'cc', 'offset': 0, 'page_id': 2, 'entity_id': 2, 'mention_id': 1}]}
+  embedding = nn.Embedding.from_pretrained(torch.arange(5, dtype=torch.float).unsqueeze(1))
+  dataset = MentionContextDataset(cursor,
+                                  [1, 2],
+                                  {'aa': {1: 20}, 'cc': {2: 3}},
+                                  dict(zip(range(5), range(5))),
+                                  embedding,
+                                  {'<PAD>': 0, '<UNK>': 1},
+                                  1,
+                                  5,
+                                  2,
+                                  page_token_corpus=FakePageTokenCorpus(mention_infos_by_page_id),
+                                  page_mention_counts=[1, 1],
+                                  prefetch_depth=1)
+  samples = [dataset[idx] for idx in range(2)]
+  assert [int(sample['label']) for sample in samples] == [1, 2]
+  assert len(producer_threads) == 2
+  assert all(thread is not threading.current_thread() for thread in producer_threads)
+  dataset._prefetcher._thread.join(1)
+  producer_connection.close.assert_called_once()
@@ -0,0 +1,66 @@
+import threading
+
+from micro_batcher import LatencyStats, MicroBatcher
+
+def test_micro_batcher_groups_concurrent_requests():
+  batches = []
+  def predict_batch(items):
+    batches.append(list(items))
+    return [item * 2 for item in items]
+  batcher = MicroBatcher(predict_batch, max_batch_size=100, max_latency=0.2)
+  results = {}
+  def submit(request_num):
+    results[request_num] = batcher.submit([request_num, request_num + 10])
+  threads = [threading.Thread(target=submit, args=(request_num,)) for request_num in range(4)]
+  for thread in threads: thread.start()
+  for thread in threads: thread.join()
+  assert results == {request_num: [request_num * 2, (request_num + 10) * 2] for request_num in range(4)}
+  assert len(batches) < 4
+  assert sum(len(batch) for batch in batches) == 8
+
+def test_micro_batcher_respects_max_batch_size():
+  batches = []
+  def predict_batch(items):
+    batches.append(list(items))
+    return items
+  batcher = MicroBatcher(predict_batch, max_batch_size=2, max_latency=0.2)
+  threads = [threading.Thread(target=batcher.submit, args=([request_num, request_num],)) for request_num in range(3)]
+  for thread in threads: thread.start()
+  for thread in threads: thread.join()
+  assert all(len(batch) == 2 for batch in batches)
+
+def test_micro_batcher_splits_large_requests():
+  batches = []
+  def predict_batch(items):
+    batches.append(list(items))
+    return items
+  batcher = MicroBatcher(predict_batch, max_batch_size=2, max_latency=0.2)
+  results = {}
+  def submit(request_num, items):
+    results[request_num] = batcher.submit(items)
+  requests = [[0], [1, 2, 3, 4, 5], [6]]
+  threads = [threading.Thread(target=submit, args=(request_num, items)) for request_num, items in enumerate(requests)]
+  for thread in threads: thread.start()
+  for thread in threads: thread.join()
+  assert results == dict(enumerate(requests))
+  assert all(len(batch) <= 2 for batch in batches)
+  assert sorted(item for batch in batches for item in batch) == list(range(7))
+
+def test_micro_batcher_raises_predict_errors():
+  def predict_batch(items):
+    raise RuntimeError('out of memory')
+  batcher = MicroBatcher(predict_batch, max_batch_size=2, max_latency=0.01)
+  try:
+    batcher.submit([1])
+    assert False
+  except RuntimeError as error:
+    assert str(error) == 'out of memory'
+
+def test_latency_stats():
+  stats = LatencyStats()
+  for latency in [0.001, 0.002, 0.003]:
+    stats.record(latency, 2)
+  summary = stats.summary()
+  assert summary['num_requests'] == 3
+  assert summary['num_mentions'] == 6
+  assert abs(summary['p50_ms'] - 2) < 1e-6
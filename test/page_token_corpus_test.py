@@ -0,0 +1,74 @@
+from unittest.mock import Mock
+
+import torch
+
+import data_transformers as dt
+import page_token_corpus as ptc
+import parsers
+
+def get_mock_cursor(contents, mention_infos, entity_num_mentions={}):
+  cursor = Mock()
+  cursor._data = {}
+  def execute(query, args=None):
+    if 'from entities' in query:
+      min_mentions = int(query.split('>= ')[1])
+      cursor._data['rows'] = [{'id': entity_id} for entity_id, num_mentions in entity_num_mentions.items()
+                              if num_mentions >= min_mentions]
+    else:
+      cursor._data['rows'] = [{'id': page_id, 'content': content} for page_id, content in contents.items()] \
+        if 'from pages' in query else mention_infos
+  def fetchmany(size):
+    rows, cursor._data['rows'] = cursor._data['rows'], []
+    return rows
+  def fetchall():
+    return fetchmany(None)
+  cursor.execute = execute
+  cursor.fetchmany = fetchmany
+  cursor.fetchall = fetchall
+  return cursor
+
+def test_page_token_corpus(tmp_path, monkeypatch):
+  monkeypatch.setattr(dt, 'parse_text_for_tokens', lambda text: text.split())
+  monkeypatch.setitem(parsers._parsers, 'text_tokens', lambda text: text.split())
+  monkeypatch.setitem(parsers._parsers, 'sentence_spans', lambda content: [(0, 5), (6, 11)] if content else [])
+  token_idx_lookup = {'<PAD>': 0, '<UNK>': 1, '<MENTION_START_HERE>': 2, '<MENTION_END_HERE>': 3,
+                      'a': 4, 'b': 5, 'c': 6, 'aa': 7, 'bb': 8}
+  contents = {2: 'a b c aa bb', 1: 'x'}
+  mention_infos = [{'mention': 'bb', 'offset': 9, 'page_id': 2, 'entity_id': 0, 'mention_id': 10},
+                   {'mention': 'aa', 'offset': 6, 'page_id': 2, 'entity_id': 1, 'mention_id': 11}]
+  path = str(tmp_path / 'corpus')
+  ptc.write_page_token_corpus(get_mock_cursor(contents, mention_infos), [2, 1], token_idx_lookup, path)
+  corpus = ptc.PageTokenCorpus(path)
+  assert corpus.min_mentions == 1
+  assert corpus.has_page(1) and corpus.has_page(2)
+  assert corpus.get_page_mention_infos(2) == mention_infos
+  assert corpus.get_page_mention_infos(1) == []
+  assert torch.equal(corpus.get_page_content_token_idxs(2), torch.tensor([4, 5, 6, 7, 8]))
+  assert len(corpus.get_page_content_token_idxs(1)) == 0
+  assert len(corpus.get_entity_page_mention_token_idxs(1)) == 0
+  assert corpus.get_sentence_spans(2) == [(0, 5), (6, 11)]
+  left, right = corpus.get_sentence_split_token_idxs(10)
+  assert torch.equal(left, torch.tensor([7, 8]))
+  assert torch.equal(right, torch.tensor([8]))
+  left, right = corpus.get_sentence_split_token_idxs(11)
+  assert torch.equal(left, torch.tensor([7]))
+  assert torch.equal(right, torch.tensor([7, 8]))
+  assert corpus.get_mention_lengths(10) == (2, 1, len(corpus.get_entity_page_mention_token_idxs(2)))
+  assert corpus.get_mention_lengths(11) == (1, 2, len(corpus.get_entity_page_mention_token_idxs(2)))
+
+def test_page_token_corpus_min_mentions(tmp_path, monkeypatch):
+  monkeypatch.setattr(dt, 'parse_text_for_tokens', lambda text: text.split())
+  monkeypatch.setitem(parsers._parsers, 'text_tokens', lambda text: text.split())
+  monkeypatch.setitem(parsers._parsers, 'sentence_spans', lambda content: [(0, 5), (6, 11)] if content else [])
+  token_idx_lookup = {'<PAD>': 0, '<UNK>': 1, '<MENTION_START_HERE>': 2, '<MENTION_END_HERE>': 3,
+                      'a': 4, 'b': 5, 'c': 6, 'aa': 7, 'bb': 8}
+  mention_infos = [{'mention': 'bb', 'offset': 9, 'page_id': 2, 'entity_id': 0, 'mention_id': 10},
+                   {'mention': 'aa', 'offset': 6, 'page_id': 2, 'entity_id': 1, 'mention_id': 11}]
+  cursor = get_mock_cursor({2: 'a b c aa bb'}, mention_infos, entity_num_mentions={0: 5, 1: 1})
+  path = str(tmp_path / 'corpus')
+  ptc.write_page_token_corpus(cursor, [2], token_idx_lookup, path, min_mentions=2)
+  corpus = ptc.PageTokenCorpus(path)
+  assert corpus.min_mentions == 2
+  assert corpus.get_page_mention_infos(2) == mention_infos[:1]
+  assert torch.equal(corpus.get_entity_page_mention_token_idxs(2),
+                     torch.tensor(dt.page_content_to_token_idxs(token_idx_lookup, 'bb', mention_infos[:1]), dtype=torch.int32))
@@ -0,0 +1,70 @@
+import threading
+
+import pydash as _
+
+from parse_cache import ParseCache
+import parsers
+
+def _legacy_split_token_on(token, char):
+  split = token.split(char)
+  return [elem for elem in _.interleave(split, [char] * (len(split) - 1)) if not _.is_empty(elem)]
+
+def _fake_sentence_spans(text):
+  return [(0, len(text))]
+
+def test_split_token_on():
+  for token in ['a-b', '--', '-a-', 'abc', 'a--b-']:
+    assert parsers._split_token_on(token, '-') == _legacy_split_token_on(token, '-')
+
+def test_parse_for_tokens():
+  assert parsers.parse_for_tokens('The well-known man said hi.') == ['The', 'well', '-', 'known', 'man', 'said', 'hi', '.']
+
+def test_parse_cache_memory():
+  cache = ParseCache(max_size=2)
+  calls = []
+  compute = lambda text: calls.append(text) or text.split()
+  assert cache.get_or_compute('tokens', 'a b', compute) == ['a', 'b']
+  assert cache.get_or_compute('tokens', 'a b', compute) == ['a', 'b']
+  assert calls == ['a b']
+  cache.get_or_compute('tokens', 'c', compute)
+  cache.get_or_compute('tokens', 'd', compute)
+  cache.get_or_compute('tokens', 'a b', compute)
+  assert calls == ['a b', 'c', 'd', 'a b']
+  assert cache.get('spans', 'c') is None
+
+def test_parse_cache_disk(tmp_path):
+  path = str(tmp_path / 'parse_cache.db')
+  cache = ParseCache(max_size=1, path=path)
+  cache.set('spans', 'one', [(0, 3)])
+  cache.set('spans', 'two', [(0, 3)])
+  assert cache.get('spans', 'one') == [(0, 3)]
+  cache.close()
+  cache = ParseCache(max_size=1, path=path)
+  assert cache.get('spans', 'two') == [(0, 3)]
+  assert cache.get('tokens', 'two') is None
+  cache.close()
+
+def test_parse_cache_threads(tmp_path):
+  cache = ParseCache(max_size=8, path=str(tmp_path / 'parse_cache.db'), commit_every=5)
+  texts = ['t' + str(i) for i in range(50)]
+  def run():
+    for text in texts: assert cache.get_or_compute('tokens', text, lambda text: [text]) == [text]
+  threads = [threading.Thread(target=run) for i in range(4)]
+  for thread in threads: thread.start()
+  for thread in threads: thread.join()
+  cache.close()
+  cache = ParseCache(max_size=8, path=str(tmp_path / 'parse_cache.db'))
+  assert all(cache.get('tokens', text) == [text] for text in texts)
+  cache.close()
+
+def test_parse_batch(monkeypatch):
+  monkeypatch.setitem(parsers._parsers, 'sentence_spans', _fake_sentence_spans)
+  texts = ['a' * i for i in range(40)]
+  expected = [_fake_sentence_spans(text) for text in texts]
+  assert parsers.parse_batch('sentence_spans', texts) == expected
+  assert parsers.parse_batch('sentence_spans', texts, num_workers=2, chunksize=4) == expected
+  cache = ParseCache(max_size=100)
+  monkeypatch.setattr(parsers, 'parse_cache', cache)
+  parsers.parse_batch('sentence_spans', texts[:10])
+  assert cache.get('sentence_spans', texts[5]) == expected[5]
+  assert parsers.parse_batch('sentence_spans', texts, num_workers=2, chunksize=4) == expected
@@ -0,0 +1,24 @@
+import pytest
+import torch
+
+from joint_model import Stacker
+from precision import get_autocast, get_grad_scaler
+
+def test_get_autocast_rejects_float16_on_cpu():
+  with pytest.raises(ValueError):
+    get_autocast(torch.device('cpu'), 'float16')
+  with pytest.raises(ValueError):
+    get_autocast(torch.device('cpu'), 'float64')
+
+def test_stacker_runs_in_float32_under_autocast():
+  stacker = Stacker()
+  logits = torch.randn(4, 3)
+  with get_autocast(torch.device('cpu'), 'bfloat16'):
+    assert torch.mm(logits, logits.t()).dtype == torch.bfloat16
+    men_scores, desc_scores = stacker((logits.bfloat16(), logits.bfloat16()), torch.rand(4, 3))
+  assert men_scores.dtype == torch.float32
+  assert desc_scores.dtype == torch.float32
+
+def test_grad_scaler_only_for_float16():
+  assert get_grad_scaler(torch.device('cpu'), 'float32') is None
+  assert get_grad_scaler(torch.device('cpu'), 'bfloat16') is None
@@ -0,0 +1,18 @@
+import pytest
+
+from prefetcher import Prefetcher
+
+def test_prefetcher():
+  items = iter([1, 2, 3])
+  prefetcher = Prefetcher(lambda: next(items, None), depth=2)
+  assert [prefetcher.get() for _ in range(5)] == [1, 2, 3, None, None]
+  metrics = prefetcher.get_metrics()
+  assert set(metrics.keys()) == {'producer_stall_time', 'consumer_wait_time'}
+  assert prefetcher.get_metrics() == {'producer_stall_time': 0.0, 'consumer_wait_time': 0.0}
+
+def test_prefetcher_reraises_producer_errors():
+  def produce():
+    raise ValueError('bad page')
+  prefetcher = Prefetcher(produce)
+  with pytest.raises(ValueError):
+    prefetcher.get()
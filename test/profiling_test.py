@@ -0,0 +1,35 @@
+import os
+
+from profiling import ProfileWindow, StageTimer, parse_batch_range
+
+def test_stage_timer_disabled_records_nothing():
+  stage_timer = StageTimer()
+  with stage_timer.time('forward'): pass
+  stage_timer.record('backward', 1.0)
+  stage_timer.count('rows', 3)
+  assert stage_timer.report() == {'stages': {}, 'counters': {}}
+
+def test_stage_timer_report():
+  stage_timer = StageTimer(enabled=True)
+  for elapsed in [1.0, 2.0, 3.0]:
+    stage_timer.record('forward', elapsed)
+  with stage_timer.time('backward'): pass
+  stage_timer.count('rows', 3)
+  stage_timer.count('rows', 2)
+  report = stage_timer.report()
+  assert report['stages']['forward']['num_calls'] == 3
+  assert report['stages']['forward']['total'] == 6.0
+  assert report['stages']['forward']['p50'] == 2.0
+  assert report['stages']['backward']['num_calls'] == 1
+  assert report['counters'] == {'rows': 5}
+  stage_timer.reset()
+  assert report != stage_timer.report()
+
+def test_profile_window_cprofile(tmpdir):
+  path = os.path.join(str(tmpdir), 'profile')
+  window = ProfileWindow(*parse_batch_range('1,2'), 'cprofile', path)
+  for batch_num in range(5):
+    window.step(batch_num)
+    sum(range(1000))
+  window.close()
+  assert os.path.exists(path + '.prof')
@@ -0,0 +1,19 @@
+from sqlite_backend import SQLiteConnection, create_index, create_table_for_row, insert_rows
+
+def test_sqlite_connection(tmpdir):
+  connection = SQLiteConnection(str(tmpdir.join('el.db')))
+  rows = [{'mention': 'aa', 'page_id': 1, 'entity_id': 3, 'mention_id': 10, 'offset': 0},
+          {'mention': 'bb', 'page_id': 1, 'entity_id': 4, 'mention_id': 11, 'offset': 3},
+          {'mention': 'cc', 'page_id': 2, 'entity_id': 3, 'mention_id': 12, 'offset': 5}]
+  with connection.cursor() as cursor:
+    create_table_for_row(cursor, 'entity_mentions_text', rows[0])
+    insert_rows(cursor, 'entity_mentions_text', list(rows[0].keys()), rows)
+    create_index(cursor, 'entity_mentions_text', 'page_id')
+    cursor.execute("SET NAMES utf8mb4;")
+    cursor.execute('select mention, page_id, entity_id, mention_id, offset from entity_mentions_text where page_id = %s', 1)
+    assert cursor.fetchall() == rows[:2]
+    cursor.execute('select entity_id, count(*) from entity_mentions_text group by `entity_id` order by count(*) desc')
+    assert cursor.fetchone() == {'entity_id': 3, 'count(*)': 2}
+    cursor.execute('select * from entity_mentions_text limit %s, %s', [1, 1])
+    assert cursor.fetchmany(5) == rows[1:2]
+  connection.close()
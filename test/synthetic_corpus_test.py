@@ -0,0 +1,30 @@
+import torch
+import torch.nn as nn
+
+from synthetic_corpus import calc_loss, get_calc_logits, get_synthetic_model, write_synthetic_corpus
+
+def test_write_synthetic_corpus(tmpdir):
+  corpus = write_synthetic_corpus(str(tmpdir), num_pages=3, mentions_per_page=2, num_entities=20, vocab_size=50, sentence_len=5)
+  page_token_corpus = corpus['page_token_corpus']
+  assert corpus['page_mention_counts'] == [2, 2, 2]
+  assert page_token_corpus.mention_ids.tolist() == list(range(6))
+  token_idx_lookup = corpus['token_idx_lookup']
+  for mention_info in page_token_corpus.get_page_mention_infos(1):
+    mention_idxs = [token_idx_lookup[token] for token in mention_info['mention'].split(' ')]
+    left, right = page_token_corpus.get_sentence_split_token_idxs(mention_info['mention_id'])
+    assert left.tolist()[-len(mention_idxs):] == mention_idxs
+    assert right.tolist()[:len(mention_idxs)] == mention_idxs
+    assert mention_info['entity_id'] in corpus['entity_candidates_prior'][mention_info['mention']]
+  assert len(page_token_corpus.get_page_content_token_idxs(0)) == 2 * 5 + sum(len(corpus['entity_text_by_label'][mention_info['entity_id']].split(' ')) + 1
+                                                                            for mention_info in page_token_corpus.get_page_mention_infos(0))
+
+def test_get_synthetic_model():
+  torch.manual_seed(0)
+  model = get_synthetic_model(20, nn.Embedding(50, 8, padding_idx=0), 6, lstm_size=4, num_lstm_layers=1)
+  encoded = (torch.randn(3, 6), torch.randn(3, 6))
+  candidate_ids = torch.randint(0, 20, (3, 4))
+  logits = get_calc_logits(model)(encoded, candidate_ids)
+  assert logits[0].shape == (3, 4) and logits[1].shape == (3, 4)
+  loss = calc_loss(logits, torch.tensor([0, 1, 2]))
+  loss.backward()
+  assert model.entity_embeds.weight.grad is not None
@@ -1,5 +1,4 @@
 from unittest.mock import Mock, create_autospec
-import pytest
 import string
 
 import pydash as _
@@ -15,37 +14,27 @@ from softmax import Softmax
 import tester as t
 
 
-@pytest.fixture()
-def myMock():
-  mock_call = Mock.__call__
-  yield Mock
-  Mock.__call__ = mock_call
-
-def get_mock_model(vector_to_return):
+def get_mock_model(entity_embeds, mention_embeds):
   model = Mock()
   model.to = lambda device: model
-  Mock.__call__ = lambda self, x: (None, vector_to_return)
+  model.eval = lambda: None
+  model.entity_embeds = entity_embeds
+  model.encoder.encode_documents = lambda page_contents, entity_page_mentions: None
+  model.encoder.encode_mentions = lambda splits, document_encodings, mention_doc_idxs: (mention_embeds, None)
+  model.calc_scores = lambda logits, candidate_mention_sim: (torch.softmax(logits[0], 1), logits[1])
   return model
 
-def test_tester(monkeypatch, myMock):
-  dataset = [{'label': 0,
-              'sentence_splits': [['a', 'b', 'c'], ['c', 'd']],
-              'candidate_ids': torch.tensor([0, 1]),
-              'embedded_page_content': torch.tensor([[1], [-2], [2], [3], [-3], [4]]),
-              'entity_page_mentions': torch.tensor([[1], [-2], [0], [3], [0], [4]]),
-              'p_prior': torch.tensor([0.1, 0.9])},
-             {'label': 2,
-              'sentence_splits': [['a', 'b', 'c'], ['c', 'd']],
-              'candidate_ids': torch.tensor([2, 1]),
-              'embedded_page_content': torch.tensor([[1], [-2], [2], [3], [-3], [4]]),
-              'entity_page_mentions': torch.tensor([[1], [-2], [0], [3], [0], [4]]),
-              'p_prior': torch.tensor([0.1, 0.9])},
-             {'label': 1,
-              'sentence_splits': [['a', 'b', 'c'], ['c', 'd']],
-              'candidate_ids': torch.tensor([3, 1]),
-              'embedded_page_content': torch.tensor([[1], [-2], [2], [3], [-3], [4]]),
-              'entity_page_mentions': torch.tensor([[1], [-2], [0], [3], [0], [4]]),
-              'p_prior': torch.tensor([0.1, 0.9])}]
+def test_tester(monkeypatch):
+  torch.manual_seed(0)
+  get_sample = lambda label, candidate_ids: {'label': label,
+                                             'sentence_splits': [torch.tensor([0, 1, 2], dtype=torch.int32),
+                                                                 torch.tensor([2, 3], dtype=torch.int32)],
+                                             'candidate_ids': torch.tensor(candidate_ids),
+                                             'page_content': torch.tensor([1, 4, 2, 3, 5, 4], dtype=torch.int32),
+                                             'entity_page_mentions': torch.tensor([1, 4, 0, 3, 0, 4], dtype=torch.int32),
+                                             'p_prior': torch.tensor([0.1, 0.9]),
+                                             'candidate_mention_sim': [0.5, 0.5]}
+  dataset = [get_sample(0, [0, 1]), get_sample(2, [2, 1]), get_sample(1, [3, 1])]
   num_entities = 10
   embed_len = 200
   batch_size = 3
@@ -57,8 +46,7 @@ def test_tester(monkeypatch, myMock):
   token_idx_lookup = dict(zip(embedding_dict.keys(),
                               range(len(embedding_dict))))
   embedding = nn.Embedding.from_pretrained(torch.stack([embedding_dict[token] for token in token_idx_lookup]))
-  vector_to_return = entity_embeds(torch.tensor([1, 1, 1]))
-  model = get_mock_model(vector_to_return)
+  model = get_mock_model(entity_embeds, entity_embeds(torch.tensor([1, 1, 1])))
   device = None
   batch_sampler = BatchSampler(RandomSampler(dataset), batch_size, True)
   mock_experiment = create_autospec(Experiment, instance=True)
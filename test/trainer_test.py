@@ -0,0 +1,75 @@
+from unittest.mock import Mock
+
+import torch
+import torch.nn as nn
+
+from synthetic_corpus import calc_loss, get_calc_logits, get_synthetic_model
+from trainer import Trainer
+
+def get_samples(num_samples, num_entities, num_candidates, vocab_size):
+  generator = torch.Generator().manual_seed(0)
+  rand_idxs = lambda length: torch.randint(1, vocab_size, (length,), generator=generator, dtype=torch.int32)
+  samples = []
+  for i in range(num_samples):
+    candidate_ids = torch.randperm(num_entities, generator=generator)[:num_candidates]
+    samples.append({'sentence_splits': [rand_idxs(3), rand_idxs(4)],
+                    'label': int(candidate_ids[i % num_candidates]),
+                    'page_content': rand_idxs(10),
+                    'entity_page_mentions': rand_idxs(5),
+                    'candidate_ids': candidate_ids,
+                    'candidate_mention_sim': [0.0] * num_candidates})
+  return samples
+
+def get_trainer(samples, batch_size, **kwargs):
+  torch.manual_seed(0)
+  model = get_synthetic_model(20, nn.Embedding(30, 8, padding_idx=0), 6, lstm_size=4, num_lstm_layers=1)
+  return Trainer(device=torch.device('cpu'),
+                 embedding=model.word_embedding,
+                 token_idx_lookup={'<PAD>': 0},
+                 model=model,
+                 get_dataset=lambda: samples,
+                 get_batch_sampler=lambda: [list(range(start, start + batch_size))
+                                            for start in range(0, len(samples), batch_size)],
+                 num_epochs=1,
+                 experiment=Mock(),
+                 calc_loss=calc_loss,
+                 calc_logits=get_calc_logits(model),
+                 logits_and_softmax=None,
+                 adaptive_logits={'desc': None, 'mention': None},
+                 use_adaptive_softmax=False,
+                 clip_grad=0.01,
+                 **kwargs)
+
+def test_start_epoch_restarts_without_sampler_state():
+  trainer = get_trainer(get_samples(4, 20, 3, 30), 2)
+  batch_sampler = Mock()
+  dataset = Mock()
+  trainer.get_batch_sampler = lambda: batch_sampler
+  trainer.get_dataset = lambda: dataset
+  trainer.resume_state = {'epoch_num': 0, 'batch_num': 5, 'dataset': None, 'sampler': None}
+  assert trainer._start_epoch(0) == (batch_sampler, 0)
+  assert not batch_sampler.set_state.called and not dataset.set_state.called
+  trainer.resume_state = {'epoch_num': 0, 'batch_num': 5, 'dataset': {'page_ctr': 3}, 'sampler': {'batch_num': 5}}
+  assert trainer._start_epoch(0) == (batch_sampler, 6)
+  batch_sampler.set_state.assert_called_with({'batch_num': 5})
+  dataset.set_state.assert_called_with({'page_ctr': 3})
+
+def test_train_evaluates_every_eval_every_batches():
+  batch_size = 2
+  samples = get_samples(8, 20, 3, 30)
+  for sample in samples:
+    sample['label'] = int(sample['candidate_ids'][0])
+  trainer = get_trainer(samples, batch_size, eval_every=2)
+  calls = []
+  def push_scores(module, inputs, output):
+    favored = torch.zeros_like(output[0])
+    favored[:, 0 if not module.training else 1] = 100.0
+    calls.append({'training': module.training, 'grad': torch.is_grad_enabled()})
+    return tuple(score + favored for score in output)
+  trainer.model.calc_scores.register_forward_hook(push_scores)
+  trainer.train()
+  assert [call['training'] for call in calls] == [True, True, False, True, True, False]
+  assert [call['grad'] for call in calls] == [True, True, False, True, True, False]
+  logged = [call[0][0] for call in trainer.experiment.record_metrics.call_args_list]
+  assert [metrics['mention_context_error'] for metrics in logged] == [batch_size, 0, batch_size, 0]
+  assert [metrics['document_context_error'] for metrics in logged] == [batch_size, 0, batch_size, 0]